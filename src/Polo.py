@@ -19,6 +19,7 @@ from PyQt5.QtGui import QColor, QIcon, QPalette
 
 import astor
 from polo.windows.main_window import MainWindow
+from polo.threads.thread import MarcoWarmupThread
 from polo import *
 
 
@@ -73,15 +74,18 @@ def main():
     
     app = QtWidgets.QApplication(sys.argv)
     
-    multiprocessing.freeze_support()  # prevent threads continuing after program closed
     logger.debug('App icon location: {}'.format(APP_ICON))
     app.setWindowIcon(QtGui.QIcon(str(APP_ICON)))
     main = MainWindow()
     main.show()
     logger.debug('Launched main window')
+    if MARCO_WARMUP_ON_START:
+        main.marco_warmup_thread = MarcoWarmupThread()
+        main.marco_warmup_thread.start()
     sys.exit(app.exec_())
 
 
 # called to run the app
 if __name__ == "__main__":
+	multiprocessing.freeze_support()  # classification workers in frozen builds
 	main()
@@ -0,0 +1,2 @@
+# Benchmark scripts for Polo. Run from the src directory, for example
+# python -m benchmarks.startup_benchmark
@@ -0,0 +1,289 @@
+'''Measure MARCO classification throughput. Classifies a fixed set of images
+(the jpegs bundled in ``data/images`` plus generated synthetic jpegs) for
+every combination of batch size, worker count and TF thread setting and
+reports images per second, per image latency percentiles and peak memory
+use, summed over the benchmark process and its pool workers, as json. Each combination runs in a fresh process so model loading and
+peak memory of one combination do not leak into the next.
+
+.. code-block:: text
+
+    python -m benchmarks.marco_throughput --batch-sizes 1 16 32 --workers 1 2 \\
+        --intra-threads 0 4 --output throughput.json
+
+A TF thread setting of 0 lets TF decide. With more than one worker images
+are classified by a :class:`~polo.marco.pool.ClassificationPool` and the
+latency is the time between finished chunks divided by the chunk size.
+``--backend mock`` benchmarks everything around the model without
+TensorFlow, see :mod:`polo.marco.backends`.
+'''
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parent.parent
+BUNDLED_IMAGE_DIR = SRC_DIR.joinpath('data/images')
+IMAGE_SUFFIXES = ('.jpg', '.jpeg')
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def bundled_images(image_dir=BUNDLED_IMAGE_DIR):
+    '''Return the paths of all jpegs under `image_dir`.
+
+    :param image_dir: Directory to search, defaults to ``data/images``
+    :type image_dir: Path, optional
+    :return: Sorted image paths
+    :rtype: list
+    '''
+    return sorted(str(p) for p in Path(image_dir).rglob('*')
+                  if p.suffix.lower() in IMAGE_SUFFIXES)
+
+
+def make_synthetic_images(output_dir, count, size=(1280, 1024), seed=0):
+    '''Write `count` synthetic jpegs that roughly look like a well: a
+    light background with random drops and specks. The same seed always
+    produces the same images.
+
+    :param output_dir: Directory to write the images to
+    :type output_dir: str or Path
+    :param count: Number of images to write
+    :type count: int
+    :param size: Width and height of each image, defaults to (1280, 1024)
+    :type size: tuple, optional
+    :param seed: Random seed, defaults to 0
+    :type seed: int, optional
+    :return: Paths of the written images
+    :rtype: list
+    '''
+    from PyQt5.QtCore import Qt
+    from PyQt5.QtGui import QColor, QImage, QPainter
+    from polo.classify import make_headless_application
+
+    app = make_headless_application()  # QPainter needs an application
+    rng = random.Random(seed)
+    paths = []
+    for i in range(count):
+        image = QImage(size[0], size[1], QImage.Format_RGB32)
+        image.fill(QColor(*[rng.randint(180, 230)] * 3))
+        painter = QPainter(image)
+        painter.setPen(Qt.NoPen)
+        for _ in range(rng.randint(5, 60)):
+            painter.setBrush(QColor(*[rng.randint(0, 255) for _ in range(3)]))
+            w, h = rng.randint(2, size[0] // 3), rng.randint(2, size[1] // 3)
+            painter.drawEllipse(
+                rng.randint(0, size[0] - w), rng.randint(0, size[1] - h), w, h)
+        painter.end()
+        path = str(Path(output_dir).joinpath('synthetic_{}.jpg'.format(i)))
+        image.save(path, 'JPG')
+        paths.append(path)
+    return paths
+
+
+def peak_rss_mb():
+    '''Peak resident memory of the calling process in megabytes, or None if
+    it can not be measured. Child processes are not included, pool workers
+    report their own peak, see :func:`_time_with_pool`.
+
+    :return: Peak RSS in MB
+    :rtype: float
+    '''
+    if resource is None:
+        return None
+    # ru_maxrss is in bytes on macOS and kilobytes everywhere else
+    scale = 1024 ** 2 if sys.platform == 'darwin' else 1024
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1)
+
+
+def percentile(values, p):
+    '''Nearest rank percentile of `values`.
+
+    :param values: Values to take the percentile of
+    :type values: list
+    :param p: Percentile between 0 and 100
+    :type p: float
+    :return: Percentile
+    :rtype: float
+    '''
+    values = sorted(values)
+    index = max(0, min(len(values) - 1, int(round(p / 100 * len(values))) - 1))
+    return values[index]
+
+
+def _time_in_process(images, batch_size, intra_threads, inter_threads, backend):
+    from polo.marco.backends import make_predictor
+
+    predictor = make_predictor(
+        backend, intra_op_threads=intra_threads, inter_op_threads=inter_threads)
+    predictor.predict(images[0])  # warm up the graph
+    latencies = []
+    start = time.perf_counter()
+    for i in range(0, len(images), batch_size):
+        batch = images[i:i+batch_size]
+        s = time.perf_counter()
+        predictor.predict_batch(batch, batch_size)
+        latencies.extend([(time.perf_counter() - s) / len(batch)] * len(batch))
+    return time.perf_counter() - start, latencies
+
+
+def _warm_up_worker(image, batch_size):
+    from polo.marco.pool import _classify_chunk
+
+    _classify_chunk((0, [image] * batch_size, False))
+
+
+def _time_with_pool(images, batch_size, workers, intra_threads, backend):
+    from polo.marco.pool import ClassificationPool
+
+    latencies = []
+    with ClassificationPool(workers, batch_size, intra_op_threads=intra_threads,
+                            backend=backend) as pool:
+        # every worker loads its model and runs a batch before the clock starts
+        pool.run_on_each_worker(_warm_up_worker, (images[0], batch_size))
+        start = s = time.perf_counter()
+        for _, results in pool.classify(images):
+            e = time.perf_counter()
+            latencies.extend([(e - s) / len(results)] * len(results))
+            s = e
+        elapsed = time.perf_counter() - start
+        worker_peaks = list(pool.run_on_each_worker(peak_rss_mb).values())
+    return elapsed, latencies, worker_peaks
+
+
+def _benchmark_config(config, images, queue):
+    '''Run one benchmark configuration and put its results on `queue`.
+    Runs in its own process.
+
+    :param config: Batch size, worker count and TF thread settings
+    :type config: dict
+    :param images: Image paths to classify
+    :type images: list
+    :param queue: Queue to put the results dict on
+    :type queue: multiprocessing.Queue
+    '''
+    try:
+        load_start = time.perf_counter()
+        worker_peaks = []
+        if config['workers'] > 1:
+            elapsed, latencies, worker_peaks = _time_with_pool(
+                images, config['batch_size'], config['workers'],
+                config['intra_threads'], config['backend'])
+        else:
+            elapsed, latencies = _time_in_process(
+                images, config['batch_size'], config['intra_threads'],
+                config['inter_threads'], config['backend'])
+        total = time.perf_counter() - load_start
+        queue.put(dict(
+            config,
+            images=len(images),
+            seconds=round(elapsed, 4),
+            setup_seconds=round(total - elapsed, 4),
+            images_per_second=round(len(images) / elapsed, 3),
+            latency_p50=round(percentile(latencies, 50), 5),
+            latency_p95=round(percentile(latencies, 95), 5),
+            latency_mean=round(statistics.mean(latencies), 5),
+            # workers peak independently, their sum bounds the memory needed
+            peak_rss_mb=(round(peak_rss_mb() + sum(worker_peaks), 1)
+                         if resource else None),
+            worker_peak_rss_mb=worker_peaks
+        ))
+    except Exception as e:
+        queue.put(dict(config, error=repr(e)))
+
+
+def run_benchmark(images, batch_sizes, workers, intra_threads, inter_threads,
+                  backend='tf1'):
+    '''Benchmark every combination of the given settings.
+
+    :param images: Image paths to classify
+    :type images: list
+    :param batch_sizes: Batch sizes to try
+    :type batch_sizes: list
+    :param workers: Worker counts to try
+    :type workers: list
+    :param intra_threads: TF intra op thread counts to try, 0 lets TF decide
+    :type intra_threads: list
+    :param inter_threads: TF inter op thread counts to try, 0 lets TF decide.
+                          Pool workers always use one inter op thread.
+    :type inter_threads: list
+    :param backend: Inference backend to benchmark, defaults to `tf1`
+    :type backend: str, optional
+    :return: Benchmark results
+    :rtype: dict
+    '''
+    from polo.marco.backends import set_backend
+    from polo.marco.run_marco import marco_model_version
+
+    set_backend(backend)
+    try:
+        import tensorflow
+        tf_version = tensorflow.__version__
+    except ImportError:
+        tf_version = None
+    results = {
+        'python': sys.version.split()[0], 'platform': platform.platform(),
+        'cpu_count': os.cpu_count(), 'tensorflow': tf_version,
+        'backend': backend, 'model_version': marco_model_version(),
+        'images': len(images), 'runs': []
+    }
+    context = multiprocessing.get_context('spawn')
+    for batch_size, num_workers, intra, inter in itertools.product(
+            batch_sizes, workers, intra_threads, inter_threads):
+        if num_workers > 1 and inter != inter_threads[0]:
+            continue  # inter op threads are fixed for pool workers
+        config = dict(backend=backend, batch_size=batch_size, workers=num_workers,
+                      intra_threads=intra or None,
+                      inter_threads=(inter or None) if num_workers == 1 else 1)
+        queue = context.Queue()
+        process = context.Process(
+            target=_benchmark_config, args=(config, images, queue))
+        process.start()
+        result = queue.get()
+        process.join()
+        print(json.dumps(result), file=sys.stderr)
+        results['runs'].append(result)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--batch-sizes', nargs='+', type=int,
+                        default=[1, 8, 16, 32])
+    parser.add_argument('--workers', nargs='+', type=int, default=[1])
+    parser.add_argument('--intra-threads', nargs='+', type=int, default=[0])
+    parser.add_argument('--inter-threads', nargs='+', type=int, default=[0])
+    parser.add_argument('--backend', default='tf1',
+                        help='Inference backend, see polo.marco.backends')
+    parser.add_argument('--synthetic', type=int, default=64,
+                        help='Number of synthetic jpegs to add to the images')
+    parser.add_argument('--image-dir', default=None,
+                        help='Use the jpegs in this directory instead of the '
+                             'bundled images')
+    parser.add_argument('--output', help='Write json results to this file')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as synthetic_dir:
+        images = bundled_images(args.image_dir or BUNDLED_IMAGE_DIR)
+        images += make_synthetic_images(synthetic_dir, args.synthetic)
+        results = json.dumps(run_benchmark(
+            images, args.batch_sizes, args.workers, args.intra_threads,
+            args.inter_threads, args.backend), indent=4)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(results)
+    print(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+'''Measure Polo cold start times. Each stage is timed in a fresh Python
+interpreter so nothing is cached between measurements and results are
+written as json.
+
+.. code-block:: text
+
+    python -m benchmarks.startup_benchmark --repeats 5 --output startup.json
+'''
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parent.parent
+
+# each snippet must print the elapsed time in seconds as its last line and
+# may print a json dict of extra info on the line before it
+STAGES = {
+    'import_polo': '''
+import sys, time, json
+t = time.perf_counter()
+import polo
+e = time.perf_counter() - t
+print(json.dumps({'tensorflow_imported': 'tensorflow' in sys.modules}))
+print(e)
+''',
+    'import_crystallography': '''
+import time
+t = time.perf_counter()
+import polo.crystallography.run
+print(time.perf_counter() - t)
+''',
+    'load_model': '''
+import time
+import polo
+from polo.marco.run_marco import get_marco_model
+t = time.perf_counter()
+get_marco_model()
+print(time.perf_counter() - t)
+''',
+    'main_window': '''
+import os, sys, time
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+t = time.perf_counter()
+from PyQt5 import QtWidgets
+from polo.windows.main_window import MainWindow
+app = QtWidgets.QApplication(sys.argv)
+main = MainWindow()
+main.show()
+app.processEvents()
+print(time.perf_counter() - t)
+'''
+}
+DEFAULT_STAGES = ['import_polo', 'import_crystallography', 'load_model']
+
+
+def time_stage(snippet):
+    '''Run a stage snippet in a new interpreter and return the elapsed time
+    it reports along with any extra info it prints.
+
+    :param snippet: Python source to run
+    :type snippet: str
+    :return: Tuple of elapsed seconds and extra info dict
+    :rtype: tuple
+    '''
+    output = subprocess.run(
+        [sys.executable, '-c', snippet], cwd=str(SRC_DIR),
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True,
+        universal_newlines=True
+    ).stdout.strip().splitlines()
+    extra = json.loads(output[-2]) if len(output) > 1 else {}
+    return float(output[-1]), extra
+
+
+def run_benchmark(stages=DEFAULT_STAGES, repeats=5):
+    '''Time each of the `stages` `repeats` times.
+
+    :param stages: Names of stages in :const:`STAGES` to time
+    :type stages: list
+    :param repeats: Number of cold starts to time per stage
+    :type repeats: int
+    :return: Benchmark results
+    :rtype: dict
+    '''
+    results = {
+        'python': sys.version.split()[0], 'platform': platform.platform(),
+        'cpu_count': os.cpu_count(), 'repeats': repeats, 'stages': {}
+    }
+    for stage in stages:
+        times, extra = [], {}
+        for _ in range(repeats):
+            elapsed, extra = time_stage(STAGES[stage])
+            times.append(elapsed)
+        results['stages'][stage] = dict(
+            min=min(times), median=statistics.median(times), max=max(times),
+            **extra
+        )
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stages', nargs='+', choices=sorted(STAGES),
+                        default=DEFAULT_STAGES)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--output', help='Write json results to this file')
+    args = parser.parse_args(argv)
+
+    results = json.dumps(run_benchmark(args.stages, args.repeats), indent=4)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(results)
+    print(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,10 +5,6 @@ from pathlib import Path
 import sys
 import platform
 
-import tensorflow.compat.v1 as tf
-tf.disable_v2_behavior()
-
-
 from PyQt5.QtGui import QBrush, QColor, QIcon, QPixmap
 from PyQt5 import QtWidgets
 #from tensorflow.contrib.predictor import from_saved_model
@@ -29,6 +25,7 @@ UNRAR = dirname.joinpath('unrar')
 TEMP_DIR = dirname.joinpath('.tmp')
 
 BACKUP_DIR = Path(os.getcwd()).joinpath('.polo_backups')
+CACHE_DIR = Path(os.getcwd()).joinpath('.polo_cache')
 
 if not TEMP_DIR.is_dir():
     os.makedirs(str(TEMP_DIR))
@@ -36,6 +33,9 @@ if not TEMP_DIR.is_dir():
 if not BACKUP_DIR.is_dir():
     os.makedirs(str(BACKUP_DIR))
 
+if not CACHE_DIR.is_dir():
+    os.makedirs(str(CACHE_DIR))
+
 if not RECENT_FILES.is_file():
     f = open(str(RECENT_FILES), 'w')
     f.close()
@@ -55,10 +55,58 @@ DEFAULT_IMAGE_PATH, BLANK_IMAGE = (
 
 # path to tensorflow marco model
 MODEL_PATH = DATA_DIR.joinpath('savedmodel')
-SESS = tf.Session(graph=tf.Graph())
-LOADED_MODEL = tf.saved_model.loader.load(
-    SESS, [tf.saved_model.tag_constants.SERVING], str(MODEL_PATH)
-)
+MARCO_BATCH_SIZE = 16  # images fed to the model per session.run call
+MARCO_NUM_WORKERS = max(1, (os.cpu_count() or 1) // 4)
+# number of processes used to classify a run, 1 classifies on the calling
+# thread. Each worker holds its own copy of the model and TF runtime.
+MARCO_READ_WORKERS = 4  # threads prefetching image bytes ahead of inference
+MARCO_PREFETCH_DEPTH = 4  # max batches read ahead of the inference loop
+MARCO_CPU_BUDGET = os.cpu_count() or 1
+# cores shared by all runs being classified at the same time, runs are
+# classified concurrently while each can have MARCO_NUM_WORKERS cores
+PREDICTION_CACHE_PATH = CACHE_DIR.joinpath('marco_predictions.sqlite')
+PREDICTION_CACHE_MAX_ENTRIES = 250000  # about 160 full 1536 well plates
+MARCO_WARMUP_ON_START = True  # load the model in the background at startup
+MARCO_SPECTRUM_AWARE = True
+# only run MARCO on visible spectrum runs and copy the classifications to the
+# linked non-visible runs, MARCO is not trained on non-visible images
+CHECKPOINT_DIR = CACHE_DIR.joinpath('checkpoints')
+# journals of predictions made for runs that are still being classified,
+# used to resume classification after Polo is closed or crashes
+MARCO_THROUGHPUT_SMOOTHING = 0.3
+# weight of the latest batch in the moving average of images per second used
+# to estimate the time left, lower values give a steadier estimate
+MARCO_BACKEND = os.environ.get('POLO_MARCO_BACKEND') or 'tf1'
+# inference backend used to run MARCO, see polo.marco.backends. One of tf1
+# (TF1 compatible session), tf2 (tf.saved_model.load) or mock (deterministic
+# fake predictions for tests and benchmarks, no TensorFlow needed)
+MARCO_SERVER_ADDRESS = os.environ.get('POLO_MARCO_SERVER') or None
+# address of a shared MARCO inference server, see polo.marco.server, like
+# http://127.0.0.1:8765 or unix:///tmp/marco.sock. If set images are sent to
+# the server instead of loading TensorFlow and the model in this process
+MARCO_SERVER_MAX_BATCH = 64  # max images the server runs through the model at once
+MARCO_SERVER_MAX_WAIT = 0.01  # seconds the server waits to fill a batch
+MARCO_SERVER_MAX_IMAGE_BYTES = 4 * 1024 ** 2  # largest image expected in a request
+MARCO_SERVER_MAX_REQUEST_BYTES = 4 * MARCO_BATCH_SIZE * MARCO_SERVER_MAX_IMAGE_BYTES
+# larger prediction requests are rejected by the server with 413
+THUMBNAIL_DIR = CACHE_DIR.joinpath('thumbnails')
+THUMBNAIL_SIZES = (64, 128, 256, 512)
+# longest edge in pixels of each thumbnail tier, the plate viewer shows the
+# smallest tier at least as large as a tile on screen and full size images
+# when tiles are larger than the largest tier
+THUMBNAIL_CACHE_MAX_BYTES = 1024 ** 3  # about 7 1536 well plates at every tier
+PLATE_LOADER_THREADS = max(1, min(4, (os.cpu_count() or 1) // 2))
+# background threads decoding the images of the plate view, tiles show a
+# placeholder until their image is loaded
+PLATE_LOADER_CHUNK = 48  # images decoded per background task
+SLIDESHOW_PREFETCH_AHEAD = 4  # slides after the current slide decoded ahead of time
+SLIDESHOW_PREFETCH_BEHIND = 2  # slides before the current slide kept decoded
+PIXMAP_CACHE_MAX_BYTES = 512 * 1024 ** 2
+# memory budget for decoded images kept by the image views, the least
+# recently shown images are released first, see polo.utils.pixmap_cache
+# TensorFlow and the MARCO model are loaded lazily the first time they are
+# needed, see polo.marco.run_marco.get_marco_model. SESS, LOADED_MODEL and tf
+# are still available as attributes of this module through __getattr__.
 
 
 
@@ -159,6 +207,22 @@ water_regex = re.compile('\*[0-9]*h2o', re.I)
 # FUNCTIONS
 # =============================================================================
 
+def __getattr__(name):
+    '''Module level attribute lookup (PEP 562) that provides the lazily
+    loaded `tf`, `SESS` and `LOADED_MODEL` attributes. Accessing any of
+    these for the first time imports TensorFlow and for the latter two
+    also loads the MARCO model.
+    '''
+    if name in ('SESS', 'LOADED_MODEL'):
+        from polo.marco.run_marco import get_marco_model
+        loaded_model, session = get_marco_model()
+        return session if name == 'SESS' else loaded_model
+    elif name == 'tf':
+        from polo.marco.run_marco import get_tf
+        return get_tf()
+    raise AttributeError('module {} has no attribute {}'.format(__name__, name))
+
+
 def make_default_logger(name):
     logger = logging.getLogger(name)
     logger.setLevel(logging.DEBUG)
@@ -216,7 +280,7 @@ Bruno AE, Charbonneau P, Newman J, Snell EH, So DR, et al. (2018) Classification
 
 critical_paths = [
     MODEL_PATH, COCKTAIL_DATA_PATH, COCKTAIL_META_DATA, BACKUP_DIR,
-    TEMP_DIR, DATA_DIR
+    TEMP_DIR, DATA_DIR, CACHE_DIR
 ]
 
 # for path in critical_paths:
@@ -0,0 +1,290 @@
+'''Classify imaging runs with MARCO without starting the Polo GUI.
+
+Intended for headless machines, for example to classify every plate that
+comes off the imager overnight. Accepts directories of images, rar archives
+and xtal files and writes the classified runs back out as xtal, mso and / or
+csv files. ::
+
+    python -m polo.classify /path/to/plate_a.rar /path/to/plate_b --workers 4
+
+Set ``POLO_MARCO_SERVER`` to classify through a shared
+:mod:`polo.marco.server` instead of loading the model in every job.
+
+No Qt window is ever created. Qt still needs an application instance before
+:class:`~polo.crystallography.image.Image` objects can be made so one is
+created using the offscreen platform plugin.
+'''
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+from polo import MARCO_BATCH_SIZE, MARCO_NUM_WORKERS, make_default_logger
+
+logger = make_default_logger(__name__)
+
+OUTPUT_FORMATS = ('xtal', 'mso', 'csv')
+
+
+def make_headless_application():
+    '''Create the Qt application Polo needs to create images without
+    connecting to a display. If an application already exists it is
+    returned instead.
+
+    :return: Qt application
+    :rtype: QGuiApplication
+    '''
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5.QtGui import QGuiApplication
+    app = QGuiApplication.instance()
+    if app is None:
+        app = QGuiApplication(sys.argv[:1])
+    return app
+
+
+def load_run(target_path):
+    '''Create a run from a directory of images, a rar archive of images or
+    an xtal file. Rar archives are extracted next to the archive.
+
+    :param target_path: Path to the directory, rar archive or xtal file
+    :type target_path: str or Path
+    :raises ValueError: If the path cannot be converted to a run
+    :return: Run with its images loaded
+    :rtype: Run or HWIRun
+    '''
+    from polo.crystallography.run import Run
+    from polo.utils.io_utils import RUN_TYPES, RunDeserializer, RunImporter
+
+    target_path = Path(target_path)
+    if target_path.suffix == '.xtal':
+        run = RunDeserializer(str(target_path)).xtal_to_run()
+        if isinstance(run, Run):
+            return run
+        raise ValueError('Could not read xtal file {}: {}'.format(
+            target_path, run))
+
+    if target_path.suffix == '.rar':
+        result = RunImporter.crack_open_a_rar_one(target_path)
+        if not isinstance(result, Path):
+            raise ValueError('Could not unrar {}: {}'.format(
+                target_path, result))
+        target_path = result
+
+    if target_path.is_dir():
+        for run_type in RUN_TYPES:
+            try:
+                run = run_type.init_from_directory(str(target_path))
+                run.add_images_from_dir()
+                return run
+            except Exception as e:
+                logger.debug('Could not import {} as {}: {}'.format(
+                    target_path, run_type.__name__, e))
+                continue
+    raise ValueError('Could not import {} as a run'.format(target_path))
+
+
+def classify_run(run, batch_size=MARCO_BATCH_SIZE, num_workers=MARCO_NUM_WORKERS,
+                 use_cache=True, force=False, progress=None):
+    '''Classify the images of `run` using a
+    :class:`~polo.threads.thread.ClassificationThread` and block until
+    it has finished.
+
+    :param run: Run to classify
+    :type run: Run or HWIRun
+    :param batch_size: Images per batch, defaults to
+                       :const:`polo.MARCO_BATCH_SIZE`
+    :type batch_size: int, optional
+    :param num_workers: Number of classification processes, defaults to
+                        :const:`polo.MARCO_NUM_WORKERS`
+    :type num_workers: int, optional
+    :param use_cache: Use the prediction cache, defaults to True
+    :type use_cache: bool, optional
+    :param force: Reclassify images that already have a current
+                  classification, defaults to False
+    :type force: bool, optional
+    :param progress: Called with the number of classified and pending images
+                     after every batch, defaults to None
+    :type progress: callable, optional
+    :raises Exception: Any exception caught by the classification thread
+    :return: Telemetry summary of the classification, see
+             :meth:`~polo.threads.thread.ClassificationThread._telemetry`
+    :rtype: dict
+    '''
+    from PyQt5.QtCore import Qt
+    from polo.threads.thread import ClassificationThread
+
+    classification_thread = ClassificationThread(
+        run, batch_size=batch_size, num_workers=num_workers,
+        use_cache=use_cache, force=force)
+    telemetry = {}
+    classification_thread.telemetry.connect(telemetry.update, Qt.DirectConnection)
+    if progress:
+        counts = {'pending': 0}
+
+        def set_pending(pending):
+            counts['pending'] = pending
+
+        classification_thread.pending_count.connect(
+            set_pending, Qt.DirectConnection)
+        classification_thread.change_value.connect(
+            lambda done: progress(done, counts['pending']), Qt.DirectConnection)
+    # there is no event loop to hand control back to so run the
+    # classification on this thread
+    classification_thread.run()
+    if classification_thread.exceptions:
+        raise classification_thread.exceptions
+    return telemetry
+
+
+def write_outputs(run, output_dir, formats=OUTPUT_FORMATS):
+    '''Write a classified run to `output_dir` in each of the requested
+    formats. Files are named after the run. Mso files can only be written
+    for :class:`~polo.crystallography.run.HWIRun` instances and are skipped
+    for other runs.
+
+    :param run: Run to write
+    :type run: Run or HWIRun
+    :param output_dir: Directory to write files to
+    :type output_dir: str or Path
+    :param formats: Output formats, defaults to all of :const:`OUTPUT_FORMATS`
+    :type formats: iterable, optional
+    :return: Paths of the files that were written
+    :rtype: list
+    '''
+    from polo.utils.io_utils import MsoWriter, RunCsvWriter, XtalWriter
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    written = []
+    # csv and mso first, writing the xtal file removes the links between runs
+    if 'csv' in formats:
+        csv_path = str(output_dir.joinpath(run.run_name + '.csv'))
+        if RunCsvWriter(run, csv_path).write_csv() is True:
+            written.append(csv_path)
+    if 'mso' in formats:
+        mso_writer = MsoWriter(
+            run, str(output_dir.joinpath(run.run_name + '.mso')))
+        if mso_writer.write_mso_file(use_marco_classifications=True):
+            written.append(mso_writer.output_path)
+    if 'xtal' in formats:
+        xtal_path = XtalWriter(run, None).write_xtal_file(
+            str(output_dir.joinpath(run.run_name + '.xtal')))
+        if isinstance(xtal_path, str):
+            written.append(xtal_path)
+    return written
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m polo.classify',
+        description='Classify imaging runs with MARCO without the Polo GUI.')
+    parser.add_argument(
+        'targets', nargs='+',
+        help='Directories of images, rar archives or xtal files to classify')
+    parser.add_argument(
+        '-o', '--output-dir', default=None,
+        help='Directory to write results to, defaults to the directory '
+             'containing each target. Xtal targets are overwritten.')
+    parser.add_argument(
+        '-f', '--formats', nargs='+', choices=OUTPUT_FORMATS,
+        default=list(OUTPUT_FORMATS), help='Output file formats')
+    parser.add_argument(
+        '-w', '--workers', type=int, default=MARCO_NUM_WORKERS,
+        help='Number of classification processes')
+    parser.add_argument(
+        '-b', '--batch-size', type=int, default=MARCO_BATCH_SIZE,
+        help='Number of images sent to the model at once')
+    parser.add_argument(
+        '--force', action='store_true',
+        help='Reclassify images that already have a MARCO classification')
+    parser.add_argument(
+        '--no-cache', action='store_true',
+        help='Do not read from or write to the prediction cache')
+    return parser
+
+
+def link_runs(runs):
+    '''Link runs of the same sample by date and spectrum like the run
+    browser of the GUI does, so classifications of visible runs can be copied
+    to the non-visible runs of the same plate. Visible runs are put first so
+    they are classified before the runs that depend on them.
+
+    :param runs: Runs to link
+    :type runs: list
+    :return: Runs in the order they should be classified
+    :rtype: list
+    '''
+    from polo import IMAGE_SPECS
+    from polo.utils.io_utils import RunLinker
+
+    samples = {}
+    for run in runs:
+        sample = getattr(run, 'sampleName', None) or getattr(run, 'plate_id', None)
+        samples.setdefault(sample, []).append(run)
+    for sample_name, sample_runs in samples.items():
+        if sample_name and len(sample_runs) > 1:
+            RunLinker.the_big_link(sample_runs)
+    return sorted(runs, key=lambda r: r.image_spectrum != IMAGE_SPECS[0])
+
+
+def main(argv=None):
+    args = make_parser().parse_args(argv)
+    app = make_headless_application()  # keep a reference for the whole run
+    failures = 0
+
+    runs, targets = [], {}
+    for target in args.targets:
+        try:
+            run = load_run(target)
+            runs.append(run)
+            targets[id(run)] = target
+        except Exception as e:
+            failures += 1
+            logger.error('Caught {} at {}'.format(e, main))
+            print('{}: failed, {}'.format(target, e), file=sys.stderr)
+
+    # classify everything before writing, writing xtal files unlinks runs
+    classified = []
+    for run in link_runs(runs):
+        target, start = targets[id(run)], time.time()
+        try:
+            print('{}: classifying {} images'.format(target, len(run)))
+
+            def progress(done, pending):
+                print('\r{}: {}/{}'.format(run.run_name, done, pending),
+                      end='', flush=True)
+
+            summary = classify_run(
+                run, batch_size=args.batch_size, num_workers=args.workers,
+                use_cache=not args.no_cache, force=args.force,
+                progress=progress)
+            print('\n{}: classified in {} seconds{}'.format(
+                target, round(time.time() - start, 2),
+                ', {} images / sec'.format(summary['mean_images_per_second'])
+                if summary.get('mean_images_per_second') else ''))
+            classified.append(run)
+        except Exception as e:
+            failures += 1
+            logger.error('Caught {} at {}'.format(e, main))
+            print('\n{}: failed, {}'.format(target, e), file=sys.stderr)
+
+    for run in classified:
+        target = targets[id(run)]
+        if not run.has_been_machine_classified:
+            print('{}: not classified, non-visible runs are classified '
+                  'from a visible run of the same plate'.format(target))
+        try:
+            output_dir = args.output_dir or Path(target).resolve().parent
+            written = write_outputs(run, output_dir, args.formats)
+            print('{}: wrote {}'.format(target, ', '.join(written)))
+        except Exception as e:
+            failures += 1
+            logger.error('Caught {} at {}'.format(e, main))
+            print('{}: failed, {}'.format(target, e), file=sys.stderr)
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,629 @@
+import base64
+import os
+from pathlib import Path
+from datetime import datetime
+
+from polo import (DEFAULT_IMAGE_PATH, IMAGE_CLASSIFICATIONS,
+                  make_default_logger, BLANK_IMAGE)
+from polo.utils.io_utils import BarTender
+from polo.marco.cache import content_key, get_prediction_cache
+from polo.marco.run_marco import get_predictor, marco_model_version
+
+logger = make_default_logger(__name__)
+
+
+class ImageRecord():
+    '''ImageRecords hold the data relating to one image in a particular
+    screening well of a particular run: where the image file is, its
+    classifications and MARCO predictions and how it is linked to other
+    images. Records keep their attributes in `__slots__` and hold no pixel
+    data so a run with thousands of images stays small and can be loaded,
+    exported and classified without any GUI. Pixmaps are only attached to
+    images when they are shown, see :class:`~polo.crystallography.image.Image`.
+
+    :param path: Path to the actual image file, defaults to None
+    :type path: str or Path, optional
+    :param bites: Image encoded as base64, defaults to None
+    :type bites: str or bytes, optional
+    :param well_number: Well number of the image, defaults to None
+    :type well_number: int, optional
+    :param human_class: Human classification of this image, defaults to None
+    :type human_class: str, optional
+    :param machine_class: MARCO classification of this image, defaults to None
+    :type machine_class: str, optional
+    :param prediction_dict: Dictionary containing MARCO model confidence for
+                            all image classifications, defaults to None
+    :type prediction_dict: dict, optional
+    :param plate_id: HWI given unique ID for plate this image belongs to
+                     , defaults to None
+    :type plate_id: str, optional
+    :param date: Date this image was taken on, defaults to None
+    :type date: Datetime, optional
+    :param cocktail: Cocktail assigned to the well this image is of, defaults to None
+    :type cocktail: Cocktail, optional
+    :param spectrum: Keyword describing the imaging tech used to take the image
+                    , defaults to None
+    :type spectrum: str, optional
+    :param previous_image: Image of the same well and sample but taken on a previous date
+                            , defaults to None
+    :type previous_image: ImageRecord, optional
+    :param next_image: Image of the same well and sample but taken on a future
+                        date, defaults to None
+    :type next_image: ImageRecord, optional
+    :param alt_image: Image of the same well and sample but taken with a
+                      different imaging tech, defaults to None
+    :type alt_image: ImageRecord, optional
+    :param marco_version: Version of the MARCO model that made the
+                          :attr:`machine_class` prediction, defaults to None
+    :type marco_version: str, optional
+    '''
+
+    # order is the order attributes are written to xtal and csv files
+    __slots__ = (
+        '_path', '_bites', '_human_class', '_machine_class', 'well_number',
+        '_prediction_dict', 'plate_id', '_date', 'cocktail', 'spectrum',
+        '_previous_image', '_next_image', '_alt_image', '_favorite',
+        'marco_version', '_columns', '_sample'
+    )
+    # slots that are not written to files
+    transient_attributes = ('_columns', '_sample')
+
+    def __init__(self, path=None, bites=None, well_number=None, human_class=None,
+                 machine_class=None, prediction_dict={},
+                 plate_id=None, date=None, cocktail=None, spectrum=None,
+                 previous_image=None, next_image=None, alt_image=None,
+                 favorite=False, marco_version=None, parent=None, **kwargs):
+
+        self._columns = None  # (RunColumns, row) of the run holding the record
+        self._sample = None  # (SampleIndex, run, row) if the run is indexed
+        self.path = str(path)
+        self.bites = bites
+        self.human_class = human_class
+        self.machine_class = machine_class
+        self.well_number = well_number
+        self.prediction_dict = prediction_dict
+        self.plate_id = plate_id
+        self.date = date
+        self.cocktail = cocktail
+        self.spectrum = spectrum
+        self.previous_image = previous_image
+        self.next_image = next_image
+        self.alt_image = alt_image
+        self.favorite = favorite
+        self.marco_version = marco_version
+
+    @classmethod
+    def fields(cls):
+        '''Names of the attributes the record stores, in the order they
+        are serialized. Properties are stored under their name prefixed
+        with an underscore.
+
+        :return: Attribute names
+        :rtype: list
+        '''
+        fields = []
+        for klass in reversed(cls.__mro__):
+            fields += [f for f in klass.__dict__.get('__slots__', ())
+                       if f not in cls.transient_attributes]
+        return fields
+
+    def to_dict(self):
+        '''Create a dictionary of the record's attributes keyed by their
+        stored names. Takes the place of `__dict__`, which records do not
+        have, when images are written to xtal, json and csv files.
+
+        :return: Attributes of the record
+        :rtype: dict
+        '''
+        return {field: getattr(self, field, None) for field in self.fields()}
+
+    @property
+    def next_image(self):
+        '''Image of the same well and sample taken on the next date. Read
+        from the :class:`~polo.crystallography.sample_index.SampleIndex`
+        of the sample if the image's run is indexed.
+
+        :return: Next image or None
+        :rtype: ImageRecord
+        '''
+        sample = self._indexed()
+        if sample:
+            return sample[0].next_image(*sample[1:])
+        return self._next_image
+
+    @next_image.setter
+    def next_image(self, image):
+        self._next_image = image
+
+    @property
+    def previous_image(self):
+        '''Image of the same well and sample taken on the previous date,
+        see :attr:`next_image`.
+
+        :return: Previous image or None
+        :rtype: ImageRecord
+        '''
+        sample = self._indexed()
+        if sample:
+            return sample[0].previous_image(*sample[1:])
+        return self._previous_image
+
+    @previous_image.setter
+    def previous_image(self, image):
+        self._previous_image = image
+
+    @property
+    def alt_image(self):
+        '''Image of the same well and sample taken in the next spectrum,
+        see :attr:`next_image`.
+
+        :return: Alt spectrum image or None
+        :rtype: ImageRecord
+        '''
+        sample = self._indexed()
+        if sample:
+            return sample[0].alt_image(*sample[1:])
+        return self._alt_image
+
+    @alt_image.setter
+    def alt_image(self, image):
+        self._alt_image = image
+
+    def _indexed(self):
+        '''Private method that returns the sample index, run and row of the
+        image if its run is currently indexed.
+
+        :return: (SampleIndex, run, row) or None
+        :rtype: tuple
+        '''
+        if self._sample:
+            index, run, row = self._sample
+            if run.sample_index is index and index.image_of(run, row) is self:
+                return self._sample
+
+    def _sync_columns(self):
+        '''Private method that copies the record into the
+        :class:`~polo.crystallography.run_columns.RunColumns` of the run it
+        belongs to, if that run has built one, whenever one of the
+        attributes the run queries changes.
+        '''
+        if self._columns:
+            columns, row = self._columns
+            columns.update_row(row, self)
+
+    @staticmethod
+    def clean_base64_string(string):
+        '''Image instances may contain byte strings that store their actual
+        crystallization image encoded as base64. Previously, these byte strings
+        were written directly into the json file as strings causing the `b`
+        byte string identifier to be written along with the actual base64 data.
+        This method removes those artifacts if they are present and returns a
+        clean byte string with only the actual base64 data.
+
+        :param string: A string to interrogate for base64 compliance
+        :type string: str
+        :return: byte string with non-data artifacts removed
+        :rtype: bytes
+        '''
+        if string:
+            if isinstance(string, bytes):
+                string = str(string, 'utf-8')
+            if string[0] == 'b':  # bytes string written directly to string
+                string = string[1:]
+            if string[-1] == "'":
+                string = string[:-1]
+            if string:
+                return bytes(string, 'utf-8')
+
+    @property
+    def date(self):
+        '''The date associated with this
+        :class:`~polo.crystallography.image_record.ImageRecord`.
+        Presumably should be the date the image was taken.
+
+        :return: Datetime object representation of
+                 the :class:`~polo.crystallography.image_record.ImageRecord`'s
+                 imaging date
+        :rtype: datetime
+        '''
+        return self._date
+
+    @date.setter
+    def date(self, date):
+        if isinstance(date, str):
+            d = BarTender.datetime_converter(date)
+            self._date = d
+        else:
+            self._date = date
+        self._sync_columns()
+
+    @property
+    def path(self):
+        '''Filepath for the image. Note that if this path is loaded
+        from an xtal file, this path may not exists because the xtal
+        file may have been created on a different machine.
+
+        :return: Path to image file
+        :rtype: str
+        '''
+        return self._path
+
+    @path.setter
+    def path(self, new_path):
+        if new_path:
+            if isinstance(new_path, Path):
+                self._path = str(new_path)
+            self._path = new_path
+        else:
+            self._path = None
+        self._sync_columns()
+
+    @property
+    def bites(self):
+        return self._bites
+
+    @bites.setter
+    def bites(self, new_bites):
+        if isinstance(new_bites, bytes):
+            self._bites = new_bites
+        elif isinstance(new_bites, str):
+            self._bites = ImageRecord.clean_base64_string(new_bites)
+        else:
+            self._bites = None
+
+    @property
+    def prediction_dict(self):
+        return self._prediction_dict
+
+    @prediction_dict.setter
+    def prediction_dict(self, new_dict):
+        try:
+            default = dict(zip(IMAGE_CLASSIFICATIONS, [0]*len(IMAGE_CLASSIFICATIONS)))
+            valid_dict = False
+            self._prediction_dict = new_dict
+            if all([im_cls in new_dict for im_cls in IMAGE_CLASSIFICATIONS]):
+                valid_dict = True
+            if valid_dict:
+                self._prediction_dict = new_dict
+            else:
+                self._prediction_dict = default
+        except Exception as e:
+            logger.critical('Caught {} setting prediction_dict value'.format(e))
+            self._prediction_dict = {}  # try and save face
+            # had issues finding errors this method threw because setter
+            # decorator kind of hides them.
+        self._sync_columns()
+
+    @property
+    def human_class(self):
+        '''Human classification of the image.
+
+        :return: Current human classification
+        :rtype: str
+        '''
+        return self._human_class
+
+    @human_class.setter
+    def human_class(self, new_class):
+        self._human_class = new_class
+        self._sync_columns()
+
+    @property
+    def machine_class(self):
+        '''MARCO classification of the image.
+
+        :return: Current MARCO classification
+        :rtype: str
+        '''
+        return self._machine_class
+
+    @machine_class.setter
+    def machine_class(self, new_class):
+        self._machine_class = new_class
+        self._sync_columns()
+
+    @property
+    def favorite(self):
+        '''If the user has marked the image as a favorite.
+
+        :return: Favorite flag
+        :rtype: bool
+        '''
+        return self._favorite
+
+    @favorite.setter
+    def favorite(self, favorite):
+        self._favorite = favorite
+        self._sync_columns()
+
+    @property
+    def formated_date(self):
+        '''Get the image's :attr:`~polo.crystallography.image_record.ImageRecord.date`
+        attribute formated in the month/date/year format. If the
+        :class:`~polo.crystallography.image_record.ImageRecord`
+        has no :attr:`~polo.crystallography.image_record.ImageRecord.date`
+        returns an empty string.
+
+        :return: Date
+        :rtype: str
+        '''
+        if isinstance(self.date, datetime):
+            return datetime.strftime(self.date, '%m/%d/%Y')
+        else:
+            return ''
+
+    @property
+    def is_placeholder(self):
+        if(str(self.path) == str(BLANK_IMAGE)
+           or str(self.path) == str(DEFAULT_IMAGE_PATH)):
+            return True
+        else:
+            return False
+
+    @property
+    def earliest_crystallization_date(self):
+        try:
+            dates = self.get_linked_images_by_date()
+            dates = sorted(dates, key=lambda i: i.date)
+            for i, each_date in enumerate(dates):
+                if dates[i].human_class == IMAGE_CLASSIFICATIONS[0]:
+                    return dates[i].date
+        except Exception as e:
+            return None
+
+    def __str__(self):
+        image_string = 'Well Num: {}\n'.format(str(self.well_number))
+        image_string += 'MARCO Class: {}\nHuman Class: {}\n'.format(
+            str(self.machine_class), str(self.human_class))
+        if self.machine_class and self.prediction_dict and self.machine_class in self.prediction_dict:
+            image_string += 'MARCO Confidence: {} %\n'.format(
+                round(float(self.prediction_dict[self.machine_class]) * 100, 1)
+            )
+        image_string += 'Date: {}\n'.format(self.formated_date)
+        image_string += 'Spectrum: {}\n'.format(self.spectrum)
+        return image_string
+
+    def encode_base64(self):
+        if not self.bites and os.path.exists(self.path):
+            with open(self.path, 'rb') as image_file:
+                self.bites = base64.b64encode(image_file.read())
+
+    def encode_bytes(self):
+        '''If the :attr:`~polo.crystallography.image_record.ImageRecord.path`
+        attribute exists and is an image file then encodes
+        that file as a base64 string and returns the encoded
+        image data.
+
+        :return: base64 encoded image
+        :rtype: str
+        '''
+        if self.bites:
+            return self.bites
+        elif os.path.exists(self.path):
+            with open(self.path, 'rb') as image:
+                return base64.b64encode(image.read())
+
+    def read_bytes(self):
+        '''Read the raw (not base64 encoded) image data, either from the
+        file at :attr:`~polo.crystallography.image_record.ImageRecord.path`
+        or from the base64 encoded
+        :attr:`~polo.crystallography.image_record.ImageRecord.bites`.
+
+        :return: Raw image data or None if no data is available
+        :rtype: bytes or None
+        '''
+        if self.path and os.path.exists(self.path):
+            with open(self.path, 'rb') as image:
+                return image.read()
+        elif self.bites:
+            return base64.b64decode(self.bites)
+
+    def get_tool_tip(self):
+        '''Create a string to use as the tooltip for this
+        :class:`~polo.crystallography.image_record.ImageRecord`.
+
+        :return: Tooltip string
+        :rtype: str
+        '''
+        if self.cocktail:
+            cocktail = self.cocktail.number
+        else:
+            cocktail = None
+        return 'Well: {}\nCocktail: {}\nDate: {} \nMARCO Class: {}\nHuman Class: {}'.format(
+            str(self.well_number), cocktail, self.formated_date,
+            str(self.machine_class), str(self.human_class)
+        )
+
+    def get_linked_images_by_date(self):
+        '''Get all images that are linked to this
+        :class:`~polo.crystallography.image_record.ImageRecord` instance by
+        date. Image linking by date is accomplished by creating a
+        bi-directional linked list between images, where each image acts
+        as a node and the
+        :attr:`~polo.crystallography.image_record.ImageRecord.next_image` and
+        :attr:`~polo.crystallography.image_record.ImageRecord.previous_image`
+        act as the forwards and backwards pointers respectively. Images of
+        indexed runs are read from the sample's
+        :class:`~polo.crystallography.sample_index.SampleIndex` instead.
+
+        :return: All images connected to this
+                 :class:`~polo.crystallography.image_record.ImageRecord`
+                 by date
+        :rtype: list
+        '''
+        sample = self._indexed()
+        if sample:
+            return sample[0].images_by_date(*sample[1:])
+        try:
+            linked_images = [self]
+            if self.next_image:
+                start_image = self.next_image
+                while isinstance(start_image, ImageRecord) and start_image.path != self.path:
+                    linked_images.append(start_image)
+                    start_image = start_image.next_image
+            if self.previous_image:
+                start_image = self.previous_image
+                while isinstance(start_image, ImageRecord) and self.previous_image.path != self.path:
+                    linked_images.append(start_image)
+                    start_image = start_image.previous_image
+            return sorted(linked_images, key=lambda i: i.date)
+        except Exception as e:
+            logger.error('Caught {} at {}'.format(e, self.get_linked_images_by_date))
+            return []
+
+    def get_linked_images_by_spectrum(self):
+        '''Get all images that are linked to this
+        :class:`~polo.crystallography.image_record.ImageRecord` instance by
+        spectrum. Linking images by spectrum is accomplished by
+        creating a mono-directional circular linked list where
+        images serve as nodes and their
+        :attr:`~polo.crystallography.image_record.ImageRecord.alt_image`
+        attribute acts as the pointer to the next node. Images of indexed
+        runs are read from the sample's
+        :class:`~polo.crystallography.sample_index.SampleIndex` instead.
+
+        :return: List of all images linked to this
+                 :class:`~polo.crystallography.image_record.ImageRecord`
+                 by spectrum
+        :rtype: list
+        '''
+        sample = self._indexed()
+        if sample:
+            return sample[0].images_by_spectrum(*sample[1:])
+        linked_images, paths = [self], set([])
+        if self.alt_image:
+            start_image = self.alt_image
+            while (isinstance(start_image, ImageRecord)
+                   and start_image.path != self.path
+                   and start_image.path not in paths):
+                linked_images.append(start_image)
+                paths.add(start_image.path)
+                start_image = start_image.alt_image
+
+            return sorted(linked_images, key=lambda i: len(i.spectrum))
+        else:
+            return linked_images
+
+    def set_marco_classification(self, machine_class, prediction_dict,
+                                 marco_version=None):
+        '''Set the MARCO classification of this
+        :class:`~polo.crystallography.image_record.ImageRecord` along with
+        the version of the model that made it.
+
+        :param machine_class: MARCO classification
+        :type machine_class: str
+        :param prediction_dict: MARCO confidence for each classification
+        :type prediction_dict: dict
+        :param marco_version: Model version, defaults to None. If None the
+                              version of the bundled model is used.
+        :type marco_version: str, optional
+        '''
+        self.machine_class = machine_class
+        self.prediction_dict = prediction_dict
+        self.marco_version = marco_version or marco_model_version()
+
+    def needs_classification(self, marco_version=None):
+        '''Check if this
+        :class:`~polo.crystallography.image_record.ImageRecord` still
+        needs to be classified by MARCO. Images need classification if they
+        have no MARCO classification or if their classification was made by
+        a different version of the model. Classifications loaded from files
+        written before model versions were recorded are assumed to be current.
+
+        :param marco_version: Current model version, defaults to None. If None
+                              the version of the bundled model is used.
+        :type marco_version: str, optional
+        :return: True if the image should be classified
+        :rtype: bool
+        '''
+        if self.is_placeholder:
+            return False
+        elif not self.machine_class or not self.prediction_dict:
+            return True
+        elif self.marco_version:
+            return self.marco_version != (marco_version or marco_model_version())
+        return False
+
+    def classify_image(self, use_cache=True):
+        '''Classify the image using the MARCO CNN model. Sets the
+        :attr:`~polo.crystallography.image_record.ImageRecord.machine_class`
+        and
+        :attr:`~polo.crystallography.image_record.ImageRecord.prediction_dict`
+        attributes based on the model results. If `use_cache` is True the
+        :class:`~polo.marco.cache.PredictionCache` is checked first and the
+        model is only run if this image's content has not been classified
+        before.
+
+        :param use_cache: Look up and store the prediction in the prediction
+                          cache, defaults to True
+        :type use_cache: bool, optional
+        '''
+        try:
+            image_bytes = self.read_bytes()
+            if not image_bytes:
+                raise AttributeError('No image data for {}'.format(self.path))
+            key, cached = content_key(image_bytes), None
+            if use_cache:
+                cached = get_prediction_cache().get(key)
+            if cached:
+                self.set_marco_classification(*cached)
+            else:
+                self.set_marco_classification(*get_predictor().predict(image_bytes))
+                if use_cache:
+                    get_prediction_cache().put(
+                        key, self.machine_class, self.prediction_dict)
+        except AttributeError as e:
+            logger.error('Caught {} at classify_image method'.format(e))
+            return e
+
+    def standard_filter(self, image_types, human, marco, favorite):
+        '''Method that determines if this image should be included in a set
+        of filtered images based on given image classifications and a
+        classifier: human, marco or both. Returns True if the image meets
+        the filtering requirements specified by the method's arguments,
+        otherwise returns False.
+
+        :param image_types: Collection of image classifications.
+                            The image's classification must in included in
+                            this collection for the method to return True.
+        :type image_types: list or set
+        :param human: If True, use the image's human classification as the
+                      overall image classification.
+        :type human: bool
+        :param marco: If True, use the image's MARCO classification as the
+                      overall image classification.
+        :type marco: bool
+        :return: True if the image meets the filter requirements, False
+                 otherwise
+        :rtype: bool
+        '''
+        if favorite == self.favorite:
+            if image_types:  # have specificed some image types
+                if self.human_class and human and self.human_class in image_types:
+                    return True
+                elif self.machine_class and marco and self.machine_class in image_types:
+                    return True
+                else:
+                    return False
+            else:
+                if human or marco:  # set at least one classifier filter
+                    if (human and self.human_class) or (marco and self.machine_class):
+                        return True
+                    else:
+                        return False
+                else:
+                    return True  # set no filters so return True
+        else:
+            return False
+
+    def write_from_bites(self, path):
+        '''Write the image to a file using the base64 encoded data stored in
+        the :attr:`~polo.crystallography.image_record.ImageRecord.bites`
+        attribute.
+        '''
+        if self.bites:
+            with open(path, 'wb') as handle:
+                handle.write(base64.decodebytes(self.bites))
+            return path
+        else:
+            raise Exception('Image has not been base64 encoded')
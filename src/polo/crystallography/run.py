@@ -4,6 +4,7 @@ import os
 
 from polo import *
 from polo.crystallography.image import Image
+from polo.crystallography.run_columns import RunColumns
 # from polo.utils.io_utils import list_dir_abs, parse_HWI_filename_meta
 from polo.utils.io_utils import (if_dir_not_exists_make,
                                 list_dir_abs, parse_HWI_filename_meta, XmlReader)
@@ -55,6 +56,7 @@ class Run():
     AllOWED_PLOTS = ['Classification Counts',
                      'MARCO Accuracy', 'Classification Progress']
     import_priority = 0
+    transient_attributes = ('_columns', 'sample_index')  # not written to files
 
     def __init__(self, image_dir, run_name, image_spectrum=None, date=None, 
                  images=[], **kwargs):
@@ -64,6 +66,7 @@ class Run():
         self.images = images
         self.date = date
         self.has_been_machine_classified = False
+        self.sample_index = None  # SampleIndex of the sample, see RunLinker
         self.__dict__.update(kwargs)
 
 
@@ -86,6 +89,23 @@ class Run():
         else:
             return self.run_name
     
+    @property
+    def columns(self):
+        '''Columnar copy of the classifications, predictions, favorite
+        flags and dates of the run's images that queries over the run use.
+        Built the first time it is needed and rebuilt whenever the
+        :attr:`~polo.crystallography.run.Run.images` list changes, changes
+        to the images themselves are written through to it.
+
+        :return: Columns of the run's images
+        :rtype: RunColumns
+        '''
+        columns = self.__dict__.get('_columns')
+        if not (isinstance(columns, RunColumns) and columns.is_current(self.images)):
+            columns = RunColumns(self.images)
+            self._columns = columns
+        return columns
+
     def __getitem__(self, n):
         try:
             return self.images[n]
@@ -166,21 +186,7 @@ class Run():
         determine the image type. Human = True sets the human
         as the classifier and False sets MARCO as the classifier.
         '''
-        image_class_dict = {}
-        for image in self.images:
-            if image:
-                c = None
-                if human:
-                    if image.human_class:
-                        c = image.human_class
-                else:
-                    if image.machine_class:
-                        c = image.machine_class
-                if c in image_class_dict:
-                    image_class_dict[c].append(image)
-                else:
-                    image_class_dict[c] = [image]
-        return image_class_dict
+        return self.columns.images_by_classification(human)
 
     def image_filter_query(self, image_types, human, marco, favorite):
         '''General use method for returning :class:`~polo.crystallography.image.Image`s
@@ -201,17 +207,16 @@ class Run():
                          `favorite` if set to True
         :type favorite: bool
         '''
-        images = [i for i in self.images if i and i.standard_filter(
+        images = self.columns.images(self.columns.filter_mask(
             image_types, human, marco, favorite
-        )]
+        ))
         if not images:
             images.append(Image.no_image())
         return images
 
     def get_current_hits(self):
         # hits are classified as images with human crystal designation
-        return [image for image in self.images
-                if image and image.human_class == 'Crystals']
+        return self.columns.images(self.columns.class_mask('Crystals'))
 
 
 
@@ -308,6 +313,17 @@ class HWIRun(Run):
         return tooltip
 
 
+    @staticmethod
+    def dissolve_sample_indexes(*runs):
+        '''Dissolve the :class:`~polo.crystallography.sample_index.SampleIndex`
+        of any of `runs` so their links can be changed by hand. The links
+        the index gave the images are kept.
+        '''
+        for run in runs:
+            index = getattr(run, 'sample_index', None)
+            if index:
+                index.dissolve()
+
     def link_to_next_date(self, other_run):
         '''Link this :class:`~polo.crystallography.run.HWIRun` to another 
         :class:`~polo.crystallography.run.HWIRun` instance that is of the same
@@ -349,6 +365,7 @@ class HWIRun(Run):
         '''
 
         if type(other_run) == HWIRun:
+            self.dissolve_sample_indexes(self, other_run)
             for current_image, dec_image in zip(self.images, other_run.images):
                 if current_image:
                     current_image.next_image = dec_image
@@ -379,6 +396,7 @@ class HWIRun(Run):
         '''
         
         if isinstance(other_run, (HWIRun, Run)):
+            self.dissolve_sample_indexes(self, other_run)
             for current_image, alt_image in zip(self.images, other_run.images):
                 current_image.alt_image = alt_image
             self.alt_spectrum = other_run
@@ -391,6 +409,8 @@ class HWIRun(Run):
         :return: List of runs linked to this run by spectrum
         :rtype: list
         '''
+        if self.sample_index:
+            return self.sample_index.alt_runs_of(self)
         if isinstance(self.alt_spectrum, (Run, HWIRun)):    
             linked_runs = [self.alt_spectrum]
             start_run = self.alt_spectrum.alt_spectrum
@@ -405,6 +425,16 @@ class HWIRun(Run):
             return []
     
     def get_linked_date_runs(self):
+        '''Return all :class:`~polo.crystallography.run.HWIRun`s that this
+        :class:`~polo.crystallography.run.HWIRun` is linked to by date,
+        starting with this run, then the later runs and then the earlier
+        runs. See :meth:`~polo.crystallography.HWIRun.link_to_next_date`.
+
+        :return: List of runs linked to this run by date
+        :rtype: list
+        '''
+        if self.sample_index:
+            return self.sample_index.date_runs_of(self)
         linked_runs = [self]
         if self.next_run:
             start_run = self.next_run
@@ -418,6 +448,61 @@ class HWIRun(Run):
                 start_run = start_run.previous_run
         return linked_runs
     
+    def nearest_visible_run(self, visible_runs):
+        '''Return the visible spectrum run out of `visible_runs` that was
+        imaged closest in time to this :class:`~polo.crystallography.run.HWIRun`.
+        Non-visible spectrum images are normally taken on the same day as one
+        of the visible imaging runs of the same plate.
+
+        :param visible_runs: Visible spectrum runs of the same sample
+        :type visible_runs: list
+        :return: Closest visible run or None if there are none
+        :rtype: HWIRun
+        '''
+        visible_runs = [r for r in visible_runs
+                        if r and r.image_spectrum == IMAGE_SPECS[0]]
+        if not visible_runs:
+            return None
+        if not isinstance(self.date, datetime):
+            return visible_runs[0]
+        return min(visible_runs, key=lambda r: abs(
+            (r.date - self.date).total_seconds())
+            if isinstance(r.date, datetime) else float('inf'))
+
+    def propagate_marco_classifications(self):
+        '''Copy the MARCO classifications of this visible spectrum
+        :class:`~polo.crystallography.run.HWIRun` to the images of the
+        non-visible spectrum runs it is linked to through
+        :meth:`~polo.crystallography.run.HWIRun.link_to_alt_spectrum`. MARCO
+        is only trained on visible images so this replaces running the model
+        on the alt spectrum images. Each alt spectrum run is only given the
+        classifications of the visible run imaged closest to it in time, see
+        :meth:`~polo.crystallography.run.HWIRun.nearest_visible_run`.
+
+        :return: Alt spectrum images that were given a classification
+        :rtype: list
+        '''
+        updated = []
+        if self.image_spectrum != IMAGE_SPECS[0]:
+            return updated
+        visible_runs = [r for r in self.get_linked_date_runs()
+                        if r.image_spectrum == IMAGE_SPECS[0]]
+        for alt_run in self.get_linked_alt_runs():
+            if (not alt_run or alt_run.image_spectrum == IMAGE_SPECS[0]
+                or alt_run.nearest_visible_run(visible_runs) is not self):
+                continue
+            for image, alt_image in zip(self.images, alt_run.images):
+                if (image and image.machine_class and alt_image
+                    and not alt_image.is_placeholder):
+                    alt_image.set_marco_classification(
+                        image.machine_class, dict(image.prediction_dict),
+                        image.marco_version)
+                    updated.append(alt_image)
+            alt_run.has_been_machine_classified = True
+            logger.debug('Copied MARCO classifications from {} to {}'.format(
+                self, alt_run))
+        return updated
+
     def insert_into_alt_spec_chain(self):
         '''When runs are first loaded into Polo they are automatically linked together.
         Normally, `HWIRuns` that are linked by date should contain only 
@@ -433,7 +518,12 @@ class HWIRun(Run):
         HWIRun. Therefore, before a HWIRun is set to be viewed by the user this method
         temporary inserts it into the alt spectrum circular linked list. 
         Also see :meth:`~polo.crystallography.HWIRun.link_to_alt_spectrum`.
+        Runs in a :class:`~polo.crystallography.sample_index.SampleIndex`
+        are inserted into the index's ring instead.
         '''
+        if self.sample_index:
+            self.sample_index.insert_into_ring(self)
+            return
         linked_runs = self.get_linked_alt_runs()
         if linked_runs:
             if len(linked_runs) == 1:
@@ -0,0 +1,212 @@
+from datetime import datetime
+
+import numpy as np
+
+from polo import IMAGE_CLASSIFICATIONS, make_default_logger
+
+logger = make_default_logger(__name__)
+
+NO_CLASS = -1  # code of images without a classification
+OTHER_CLASS = len(IMAGE_CLASSIFICATIONS)  # code of classifications not in IMAGE_CLASSIFICATIONS
+CLASS_CODES = {c: i for i, c in enumerate(IMAGE_CLASSIFICATIONS)}
+
+
+def class_code(image_class):
+    '''Convert an image classification to the integer code it is stored as
+    in a :class:`RunColumns`.
+
+    :param image_class: Image classification
+    :type image_class: str
+    :return: Index in :const:`polo.IMAGE_CLASSIFICATIONS`, :const:`NO_CLASS`
+             if `image_class` is empty or :const:`OTHER_CLASS` if it is not
+             a known classification
+    :rtype: int
+    '''
+    if not image_class:
+        return NO_CLASS
+    return CLASS_CODES.get(image_class, OTHER_CLASS)
+
+
+class RunColumns():
+    '''Columnar copy of the data runs are queried by: well numbers, human
+    and MARCO classifications, MARCO predictions, favorite flags and
+    imaging dates of every image of a run, one row per entry of the run's
+    images list. Filtering and plotting work on numpy masks over these
+    columns instead of looping over the images.
+
+    Each image keeps a reference to its row and writes changes to its
+    classifications, predictions, favorite flag, date or path straight
+    into the columns. Changes to the images list itself are picked up by
+    :meth:`is_current`, see :attr:`polo.crystallography.run.Run.columns`.
+
+    :param images: Images of the run, may contain None for missing images
+    :type images: list
+    '''
+
+    def __init__(self, images):
+        n = len(images)
+        self._images = list(images)
+        self.present = np.zeros(n, dtype=bool)
+        self.placeholder = np.zeros(n, dtype=bool)
+        self.well_number = np.zeros(n, dtype=np.int32)
+        self.human_class = np.full(n, NO_CLASS, dtype=np.int8)
+        self.machine_class = np.full(n, NO_CLASS, dtype=np.int8)
+        self.predictions = np.zeros((n, len(IMAGE_CLASSIFICATIONS)), dtype=np.float32)
+        self.favorite = np.zeros(n, dtype=bool)
+        self.date = np.full(n, np.datetime64('NaT'), dtype='datetime64[s]')
+        for row, image in enumerate(self._images):
+            if image:
+                image._columns = (self, row)
+                self.update_row(row, image)
+
+    def __len__(self):
+        return len(self._images)
+
+    def is_current(self, images):
+        '''Check if the columns were built from exactly the images in
+        `images`, in the same order.
+
+        :param images: Images of the run
+        :type images: list
+        :return: True if the columns can be used for `images`
+        :rtype: bool
+        '''
+        return self._images == images
+
+    def update_row(self, row, image):
+        '''Copy the data of `image` into `row`.
+
+        :param row: Row of the image
+        :type row: int
+        :param image: Image to copy
+        :type image: ImageRecord
+        '''
+        if self._images[row] is not image:
+            return  # image has been replaced in the run, columns are stale
+        self.present[row] = True
+        self.placeholder[row] = image.is_placeholder
+        self.well_number[row] = image.well_number or 0
+        self.human_class[row] = class_code(image.human_class)
+        self.machine_class[row] = class_code(image.machine_class)
+        self.favorite[row] = bool(image.favorite)
+        prediction_dict = image.prediction_dict or {}
+        try:
+            self.predictions[row] = [float(prediction_dict.get(c, 0))
+                                     for c in IMAGE_CLASSIFICATIONS]
+        except (TypeError, ValueError) as e:
+            logger.error('Caught {} at {}'.format(e, self.update_row))
+            self.predictions[row] = 0
+        if isinstance(image.date, datetime):
+            self.date[row] = np.datetime64(image.date.replace(tzinfo=None), 's')
+        else:
+            self.date[row] = np.datetime64('NaT')
+
+    def images(self, mask):
+        '''Get the images of the rows selected by `mask`.
+
+        :param mask: Boolean mask over the rows
+        :type mask: ndarray
+        :return: Images in row order
+        :rtype: list
+        '''
+        return [self._images[i] for i in np.flatnonzero(mask)]
+
+    def class_column(self, human=True):
+        '''Get the human or MARCO classification codes.
+
+        :param human: If True return human classifications otherwise
+                      MARCO classifications, defaults to True
+        :type human: bool, optional
+        :return: Classification code of each row, see :func:`class_code`
+        :rtype: ndarray
+        '''
+        return self.human_class if human else self.machine_class
+
+    def filter_mask(self, image_types, human, marco, favorite):
+        '''Vectorized version of
+        :meth:`~polo.crystallography.image_record.ImageRecord.standard_filter`
+        that selects the rows of every image that passes the filter.
+
+        :param image_types: Image classifications to keep
+        :type image_types: list or set
+        :param human: Filter using human classifications
+        :type human: bool
+        :param marco: Filter using MARCO classifications
+        :type marco: bool
+        :param favorite: Favorite flag images must have
+        :type favorite: bool
+        :return: Boolean mask over the rows
+        :rtype: ndarray
+        '''
+        mask = self.present & (self.favorite == bool(favorite))
+        if not (human or marco):
+            # with image types given nothing can match without a classifier
+            return np.zeros_like(mask) if image_types else mask
+        classified = np.zeros(len(self), dtype=bool)
+        if image_types:
+            codes = [CLASS_CODES[t] for t in image_types if t in CLASS_CODES]
+            if human:
+                classified |= np.isin(self.human_class, codes)
+            if marco:
+                classified |= np.isin(self.machine_class, codes)
+        else:
+            if human:
+                classified |= self.human_class != NO_CLASS
+            if marco:
+                classified |= self.machine_class != NO_CLASS
+        return mask & classified
+
+    def class_mask(self, image_class, human=True):
+        '''Select the rows of images with the classification `image_class`.
+
+        :param image_class: Image classification
+        :type image_class: str
+        :param human: Use human classifications otherwise MARCO
+                      classifications, defaults to True
+        :type human: bool, optional
+        :return: Boolean mask over the rows
+        :rtype: ndarray
+        '''
+        return self.present & (self.class_column(human) == class_code(image_class))
+
+    def images_by_classification(self, human=True):
+        '''Group the images by their human or MARCO classification. Groups
+        are in the order their classification first appears in the run.
+
+        :param human: Use human classifications otherwise MARCO
+                      classifications, defaults to True
+        :type human: bool, optional
+        :return: Images of each classification keyed by classification,
+                 unclassified images are under None
+        :rtype: dict
+        '''
+        codes = np.where(self.present, self.class_column(human), OTHER_CLASS + 1)
+        unique, first = np.unique(codes, return_index=True)
+        groups = {}
+        for code in unique[np.argsort(first)]:
+            if code == OTHER_CLASS + 1:
+                continue  # missing images
+            group = self.images(codes == code)
+            if code == NO_CLASS:
+                groups[None] = group
+            elif code == OTHER_CLASS:  # unknown classifications keep their name
+                for image in group:
+                    c = image.human_class if human else image.machine_class
+                    groups.setdefault(c, []).append(image)
+            else:
+                groups[IMAGE_CLASSIFICATIONS[code]] = group
+        return groups
+
+    def prediction_column(self, image_class):
+        '''Get the MARCO confidence of every row for one classification.
+
+        :param image_class: Image classification
+        :type image_class: str
+        :return: Confidence of each row, 0 for missing images
+        :rtype: ndarray
+        '''
+        return np.where(self.present,
+                        self.predictions[:, CLASS_CODES[image_class]], 0)
+
+    def __repr__(self):
+        return '<RunColumns {} rows>'.format(len(self))
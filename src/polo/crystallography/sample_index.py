@@ -0,0 +1,315 @@
+from bisect import bisect_right
+from datetime import datetime
+
+from polo import IMAGE_SPECS, make_default_logger
+
+logger = make_default_logger(__name__)
+
+
+class SampleIndex():
+    '''Index of all the runs of one sample, a three dimensional table of
+    images keyed by imaging date, spectrum and well. Visible spectrum runs
+    are ordered by date and the other spectrum runs form the alt spectrum
+    ring, ordered as :meth:`~polo.utils.io_utils.RunLinker.link_runs_by_spectrum`
+    would link them. Rows are the positions of images in their run's
+    images list, which for :class:`~polo.crystallography.run.HWIRun`\\s is
+    the well number - 1.
+
+    Indexed images answer
+    :attr:`~polo.crystallography.image_record.ImageRecord.next_image`,
+    :attr:`~polo.crystallography.image_record.ImageRecord.previous_image`
+    and :attr:`~polo.crystallography.image_record.ImageRecord.alt_image`
+    as well as the timeline and spectrum queries from the index in
+    constant time instead of walking and sorting linked lists. Indexes are
+    made and kept up to date by :class:`~polo.utils.io_utils.RunLinker`.
+
+    :param runs: Runs of the sample, only runs that can be linked
+                 (:class:`~polo.crystallography.run.HWIRun`) are indexed
+    :type runs: list
+    '''
+
+    def __init__(self, runs):
+        runs = [r for r in runs if hasattr(r, 'link_to_alt_spectrum')]
+        self.visible_runs = [r for r in runs if r.image_spectrum == IMAGE_SPECS[0]]
+        self.date_runs = sorted(  # earliest first
+            [r for r in self.visible_runs if isinstance(r.date, datetime)],
+            key=lambda r: r.date)
+        self.spectrum_runs = sorted(
+            [r for r in runs if r.image_spectrum != IMAGE_SPECS[0]],
+            key=lambda r: len(str(r.image_spectrum)))
+        self.ring_visible = None  # visible run inserted into the spectrum ring
+        self._reindex()
+        for run in runs:
+            self._attach(run)
+        self._link_runs()
+
+    def __len__(self):
+        return len(self.visible_runs) + len(self.spectrum_runs)
+
+    def __contains__(self, run):
+        return run.sample_index is self
+
+    @property
+    def runs(self):
+        '''All runs in the index.
+
+        :return: Visible spectrum runs followed by the alt spectrum ring
+        :rtype: list
+        '''
+        return self.visible_runs + self.spectrum_runs
+
+    @property
+    def ring(self):
+        '''The alt spectrum ring, including the visible run that has been
+        inserted into it by :meth:`insert_into_ring`.
+
+        :return: Runs in ring order
+        :rtype: list
+        '''
+        if self.ring_visible:
+            return self.spectrum_runs + [self.ring_visible]
+        return self.spectrum_runs
+
+    def _reindex(self):
+        '''Private method that recomputes the positions of the runs along
+        the date and spectrum axes and the order spectrum queries return
+        images in. Takes time proportional to the number of runs, not
+        the number of images.
+        '''
+        ring = self._ring = self.ring
+        self._visible = {id(r) for r in self.visible_runs}
+        self._date_position = {id(r): i for i, r in enumerate(self.date_runs)}
+        self._ring_position = {id(r): i for i, r in enumerate(ring)}
+        self._table = {(r.date, r.image_spectrum): r for r in self.runs}
+
+        def spectrum_order(runs):
+            return sorted(runs, key=lambda r: len(
+                str(r.image_spectrum if r else IMAGE_SPECS[0])))
+        # runs linked by spectrum to a visible run, None is the run itself
+        self._visible_order = spectrum_order([None] + self.spectrum_runs)
+        self._ring_orders = [spectrum_order(ring[p:] + ring[:p])
+                             for p in range(len(ring))]
+
+    def _attach(self, run):
+        '''Private method that adds `run` and its images to the index.
+        '''
+        run.sample_index = self
+        for row, image in enumerate(run.images):
+            if image:
+                image._sample = (self, run, row)
+
+    def _link_runs(self):
+        '''Private method that sets the
+        :attr:`~polo.crystallography.run.HWIRun.next_run`,
+        :attr:`~polo.crystallography.run.HWIRun.previous_run` and
+        :attr:`~polo.crystallography.run.HWIRun.alt_spectrum` attributes
+        of the indexed runs.
+        '''
+        for run in self.runs:
+            run.next_run = self.next_run(run)
+            run.previous_run = self.previous_run(run)
+            run.alt_spectrum = self.alt_run(run)
+
+    def insert(self, run):
+        '''Add a new run to the index. The run is spliced into the date
+        order or the alt spectrum ring and only its own images are
+        touched, so adding a run to a sample takes time proportional to
+        the number of runs plus the number of images in the new run.
+
+        :param run: Run of this sample that is not indexed yet
+        :type run: HWIRun
+        '''
+        if run in self or not hasattr(run, 'link_to_alt_spectrum'):
+            return
+        if run.image_spectrum == IMAGE_SPECS[0]:
+            self.visible_runs.append(run)
+            if isinstance(run.date, datetime):
+                self.date_runs.insert(
+                    bisect_right([r.date for r in self.date_runs], run.date), run)
+        else:
+            self.spectrum_runs.insert(bisect_right(
+                [len(str(r.image_spectrum)) for r in self.spectrum_runs],
+                len(str(run.image_spectrum))), run)
+        self._reindex()
+        self._attach(run)
+        self._link_runs()
+        logger.debug('Inserted {} into {}'.format(run, self))
+
+    def remove(self, run):
+        '''Take `run` out of the index. The runs around it are linked to
+        each other and the images of `run` are left without links.
+
+        :param run: Indexed run
+        :type run: HWIRun
+        '''
+        if run not in self:
+            return
+        for runs in (self.visible_runs, self.date_runs, self.spectrum_runs):
+            if run in runs:
+                runs.remove(run)
+        if run is self.ring_visible:
+            self.ring_visible = None
+        run.sample_index = None
+        run.previous_run, run.next_run, run.alt_spectrum = None, None, None
+        self._reindex()
+        self._link_runs()
+        logger.debug('Removed {} from {}'.format(run, self))
+
+    def discard(self):
+        '''Remove every run from the index. Images of the runs fall back to
+        the links stored in their own attributes.
+        '''
+        for run in self.runs:
+            if run.sample_index is self:
+                run.sample_index = None
+
+    def dissolve(self):
+        '''Store the links the index gives every image in the images
+        themselves and then remove every run from the index. Used before
+        runs are linked by hand so links outside of the changed runs are
+        kept.
+        '''
+        for run in self.runs:
+            for image in run.images:
+                if image:
+                    image.next_image, image.previous_image, image.alt_image = (
+                        image.next_image, image.previous_image, image.alt_image)
+        self.discard()
+        logger.debug('Dissolved {}'.format(self))
+
+    def image_at(self, well, date, spectrum):
+        '''Get the image of `well` taken on `date` in `spectrum`.
+
+        :param well: Well number
+        :type well: int
+        :param date: Imaging date of the run
+        :type date: datetime
+        :param spectrum: Spectrum of the run
+        :type spectrum: str
+        :return: Image or None if the sample has no such image
+        :rtype: Image
+        '''
+        run = self._table.get((date, spectrum))
+        if run and well:
+            return self.image_of(run, well - 1)
+
+    @staticmethod
+    def image_of(run, row):
+        '''Get the image at `row` of `run`.
+
+        :return: Image or None if `run` has no image at `row`
+        :rtype: Image
+        '''
+        if run and 0 <= row < len(run.images):
+            return run.images[row]
+
+    def next_run(self, run):
+        '''Run imaged after `run` in the visible spectrum.
+
+        :return: Next run or None
+        :rtype: HWIRun
+        '''
+        p = self._date_position.get(id(run))
+        if p is not None and p + 1 < len(self.date_runs):
+            return self.date_runs[p + 1]
+
+    def previous_run(self, run):
+        '''Run imaged before `run` in the visible spectrum.
+
+        :return: Previous run or None
+        :rtype: HWIRun
+        '''
+        p = self._date_position.get(id(run))
+        if p:
+            return self.date_runs[p - 1]
+
+    def alt_run(self, run):
+        '''Run that `run` links to by spectrum. Visible runs link to the
+        first run of the alt spectrum ring and ring runs to the next run
+        in the ring.
+
+        :return: Alt spectrum run or None
+        :rtype: HWIRun
+        '''
+        ring = self._ring
+        p = self._ring_position.get(id(run))
+        if p is not None:
+            if len(ring) > 1:
+                return ring[(p + 1) % len(ring)]
+        elif id(run) in self._visible and self.spectrum_runs:
+            return self.spectrum_runs[0]
+
+    def next_image(self, run, row):
+        return self.image_of(self.next_run(run), row)
+
+    def previous_image(self, run, row):
+        return self.image_of(self.previous_run(run), row)
+
+    def alt_image(self, run, row):
+        return self.image_of(self.alt_run(run), row)
+
+    def images_by_date(self, run, row):
+        '''Images of the well at `row` on every date `run` is linked to.
+
+        :return: Images sorted by date
+        :rtype: list
+        '''
+        if id(run) not in self._date_position:
+            return [run.images[row]]
+        images = [self.image_of(r, row) for r in self.date_runs]
+        return [i for i in images if i]
+
+    def images_by_spectrum(self, run, row):
+        '''Images of the well at `row` in every spectrum `run` is linked to.
+
+        :return: Images sorted by the length of their spectrum name
+        :rtype: list
+        '''
+        p = self._ring_position.get(id(run))
+        if p is not None:
+            order = self._ring_orders[p]
+        elif id(run) in self._visible:
+            order = [r or run for r in self._visible_order]
+        else:
+            return [run.images[row]]
+        images = [self.image_of(r, row) for r in order]
+        return [i for i in images if i]
+
+    def date_runs_of(self, run):
+        '''Same as :meth:`~polo.crystallography.run.HWIRun.get_linked_date_runs`.
+        '''
+        p = self._date_position.get(id(run))
+        if p is None:
+            return [run]
+        return [run] + self.date_runs[p + 1:] + self.date_runs[:p][::-1]
+
+    def alt_runs_of(self, run):
+        '''Same as :meth:`~polo.crystallography.run.HWIRun.get_linked_alt_runs`.
+        Visible runs in the ring are replaced by False.
+        '''
+        alt_run, ring = self.alt_run(run), self._ring
+        if not alt_run:
+            return []
+        k = self._ring_position[id(alt_run)]
+        rotated = ring[k:] + ring[:k]
+        return [alt_run] + [r if id(r) not in self._visible else False
+                            for r in rotated[1:]]
+
+    def insert_into_ring(self, run):
+        '''Temporarily insert the visible `run` into the alt spectrum ring
+        so the alt spectrum runs link back to it. Replaces the visible run
+        inserted before. See
+        :meth:`~polo.crystallography.run.HWIRun.insert_into_alt_spec_chain`.
+
+        :param run: Visible spectrum run of this sample
+        :type run: HWIRun
+        '''
+        if (id(run) in self._visible and self.spectrum_runs
+                and run is not self.ring_visible):
+            self.ring_visible = run
+            self._reindex()
+            self._link_runs()
+
+    def __repr__(self):
+        return '<SampleIndex {} dates {} spectrums>'.format(
+            len(self.date_runs), len(self.spectrum_runs))
@@ -0,0 +1,186 @@
+'''Inference backends that can run MARCO. Every backend is a
+:class:`~polo.marco.run_marco.Predictor` so the classification pipeline,
+worker pools and the MARCO server work the same whatever runs the model.
+
+=======  =================================================================
+Name     Backend
+=======  =================================================================
+`tf1`    :class:`~polo.marco.run_marco.MarcoPredictor`, the saved model in
+         a TF1 compatible session. The default.
+`tf2`    :class:`TF2Predictor`, the saved model loaded with
+         `tf.saved_model.load` and run eagerly.
+`mock`   :class:`MockPredictor`, deterministic fake predictions made
+         without TensorFlow. For tests and for benchmarking everything
+         around the model.
+=======  =================================================================
+
+The backend is picked with the ``POLO_MARCO_BACKEND`` environment variable
+(:const:`polo.MARCO_BACKEND`) or :func:`set_backend`. A process should stick
+to one TensorFlow backend since the `tf1` backend switches off TF2 behavior
+for the whole process.
+'''
+import hashlib
+import threading
+import time
+
+from polo import (IMAGE_CLASSIFICATIONS, MARCO_BACKEND, MODEL_PATH,
+                  make_default_logger)
+from polo.marco.run_marco import MarcoPredictor, Predictor, load_model
+
+logger = make_default_logger(__name__)
+
+BACKENDS = ('tf1', 'tf2', 'mock')
+BACKEND_MODEL_VERSIONS = {'mock': 'mock'}  # backends not running the saved model
+
+_backend = MARCO_BACKEND
+_backend_predictors = {}  # shared predictor of each backend
+_backend_lock = threading.Lock()
+
+
+class TF2Predictor(Predictor):
+    '''Runs the MARCO saved model through the `serving_default` signature
+    of `tf.saved_model.load`, without a TF1 session.
+
+    :param model_path: Path to the saved model directory, defaults to
+                       :const:`polo.MODEL_PATH`
+    :type model_path: str or Path, optional
+    :param intra_op_threads: Threads TF may use within one op, defaults to
+                             None (let TF decide)
+    :type intra_op_threads: int, optional
+    :param inter_op_threads: Threads TF may use to run ops in parallel,
+                             defaults to None (let TF decide)
+    :type inter_op_threads: int, optional
+    '''
+
+    def __init__(self, model_path=MODEL_PATH, intra_op_threads=None,
+                 inter_op_threads=None):
+        import tensorflow as tf
+        if intra_op_threads:
+            tf.config.threading.set_intra_op_parallelism_threads(int(intra_op_threads))
+        if inter_op_threads:
+            tf.config.threading.set_inter_op_parallelism_threads(int(inter_op_threads))
+        self._tf = tf
+        self.model = tf.saved_model.load(str(model_path))
+        self.signature = self.model.signatures['serving_default']
+        logger.debug('Created {}'.format(self))
+
+    def infer(self, image_bytes):
+        outputs = self.signature(
+            image_bytes=self._tf.constant(image_bytes, dtype=self._tf.string))
+        return {name: tensor.numpy() for name, tensor in outputs.items()}
+
+
+class MockPredictor(Predictor):
+    '''Deterministic stand in for the MARCO model. The scores of an image
+    are derived from a hash of its bytes, so the same image always gets the
+    same prediction, and no TensorFlow is needed. An optional delay per
+    image simulates the cost of running the real model.
+
+    :param seconds_per_image: Time to sleep for each image, defaults to 0
+    :type seconds_per_image: float, optional
+    '''
+    model_version = BACKEND_MODEL_VERSIONS['mock']
+
+    def __init__(self, seconds_per_image=0):
+        self.seconds_per_image = seconds_per_image
+        self._classes = [c.encode('utf-8') for c in IMAGE_CLASSIFICATIONS]
+
+    def scores(self, image):
+        '''Scores of one image, they add up to 1.
+
+        :param image: Raw image bytes
+        :type image: bytes
+        :return: Score for each class of :const:`polo.IMAGE_CLASSIFICATIONS`
+        :rtype: list
+        '''
+        digest = hashlib.sha1(image).digest()
+        weights = [digest[i] + 1 for i in range(len(self._classes))]
+        return [w / sum(weights) for w in weights]
+
+    def infer(self, image_bytes):
+        if self.seconds_per_image:
+            time.sleep(self.seconds_per_image * len(image_bytes))
+        return {
+            'classes': [list(self._classes) for _ in image_bytes],
+            'scores': [self.scores(image) for image in image_bytes]
+        }
+
+
+def get_backend():
+    '''Name of the backend used when no specific model is asked for.
+
+    :return: Backend name
+    :rtype: str
+    '''
+    return _backend
+
+
+def set_backend(name):
+    '''Switch the backend used from now on.
+
+    :param name: One of :const:`BACKENDS`
+    :type name: str
+    :raises ValueError: If there is no backend called `name`
+    '''
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError('Unknown MARCO backend {}, use one of {}'.format(
+            name, ', '.join(BACKENDS)))
+    _backend = name
+    logger.info('Using MARCO backend {}'.format(name))
+
+
+def make_predictor(backend=None, model_path=MODEL_PATH, intra_op_threads=None,
+                   inter_op_threads=None):
+    '''Create a new predictor for `backend`. Worker processes and the MARCO
+    server use this to get a model of their own.
+
+    :param backend: Backend name, defaults to None (:func:`get_backend`)
+    :type backend: str, optional
+    :param model_path: Path to the saved model directory, defaults to
+                       :const:`polo.MODEL_PATH`
+    :type model_path: str or Path, optional
+    :param intra_op_threads: TF threads within one op, defaults to None
+    :type intra_op_threads: int, optional
+    :param inter_op_threads: TF threads running ops in parallel, defaults
+                             to None
+    :type inter_op_threads: int, optional
+    :raises ValueError: If there is no backend called `backend`
+    :return: New predictor
+    :rtype: Predictor
+    '''
+    backend = backend or get_backend()
+    if backend == 'tf1':
+        loaded_model, session = load_model(
+            model_path, intra_op_threads=intra_op_threads,
+            inter_op_threads=inter_op_threads)
+        return MarcoPredictor(loaded_model, session, use_callable=True)
+    elif backend == 'tf2':
+        return TF2Predictor(model_path, intra_op_threads, inter_op_threads)
+    elif backend == 'mock':
+        return MockPredictor()
+    raise ValueError('Unknown MARCO backend {}, use one of {}'.format(
+        backend, ', '.join(BACKENDS)))
+
+
+def get_backend_predictor(backend=None):
+    '''Return the predictor of `backend` shared by the whole program,
+    creating it the first time it is needed. The `tf1` backend shares the
+    model of :func:`~polo.marco.run_marco.get_marco_model`.
+
+    :param backend: Backend name, defaults to None (:func:`get_backend`)
+    :type backend: str, optional
+    :return: Shared predictor
+    :rtype: Predictor
+    '''
+    backend = backend or get_backend()
+    if backend == 'tf1':
+        from polo.marco.run_marco import get_marco_model, get_predictor
+        return get_predictor(*get_marco_model())
+    with _backend_lock:
+        if backend not in _backend_predictors:
+            start = time.time()
+            _backend_predictors[backend] = make_predictor(backend)
+            logger.info('Loaded MARCO backend {} in {} seconds'.format(
+                backend, round(time.time() - start, 2)))
+    return _backend_predictors[backend]
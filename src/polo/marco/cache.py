@@ -0,0 +1,340 @@
+import base64
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from polo import (PREDICTION_CACHE_MAX_ENTRIES, PREDICTION_CACHE_PATH,
+                  make_default_logger)
+from polo.marco.run_marco import marco_model_version
+
+logger = make_default_logger(__name__)
+
+
+def content_key(image_bytes):
+    '''Content hash used to identify an image in the
+    :class:`PredictionCache`. Identical images get the same key no matter
+    where they are stored or what they are named.
+
+    :param image_bytes: Raw image bytes
+    :type image_bytes: bytes
+    :return: Hex digest of the image content
+    :rtype: str
+    '''
+    return hashlib.sha1(image_bytes).hexdigest()
+
+
+def file_content_key(image_path, block_size=1 << 16):
+    '''Same as :func:`content_key` but reads the image from a file.
+
+    :param image_path: Path to an image file
+    :type image_path: str or Path
+    :return: Hex digest of the image content
+    :rtype: str
+    '''
+    digest = hashlib.sha1()
+    with open(str(image_path), 'rb') as image_file:
+        for block in iter(lambda: image_file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_source_key(image_path):
+    '''Identify an image file by its path, size and modification time.
+    Used to find the content key of files that have been classified before
+    without reading and hashing them again.
+
+    :param image_path: Path to an image file
+    :type image_path: str or Path
+    :return: Source key or None if `image_path` is not a file
+    :rtype: str or None
+    '''
+    if image_path and os.path.isfile(str(image_path)):
+        stat = os.stat(str(image_path))
+        return '{}|{}|{}'.format(
+            os.path.abspath(str(image_path)), stat.st_size, stat.st_mtime_ns)
+
+
+class PredictionCache():
+    '''On disk SQLite cache of MARCO predictions keyed by the content hash
+    of the image and the version of the model that made the prediction. Lets
+    Polo skip running the model on images it has already classified, even
+    if they are imported again from a different rar archive, directory or
+    xtal file.
+
+    The cache holds at most `max_entries` predictions. When it grows larger
+    the least recently used predictions are evicted. The cache also
+    remembers the content key of every image file it has been given a
+    :func:`file_source_key` for, so files can be looked up by path, size and
+    modification time before they are read.
+
+    :param path: Path to the SQLite database, defaults to
+                 :const:`polo.PREDICTION_CACHE_PATH`
+    :type path: str or Path, optional
+    :param max_entries: Max number of cached predictions, defaults to
+                        :const:`polo.PREDICTION_CACHE_MAX_ENTRIES`
+    :type max_entries: int, optional
+    :param model_version: Model version predictions are stored and looked
+                          up under, defaults to None. If None the version of
+                          the bundled model is used.
+    :type model_version: str, optional
+    '''
+
+    def __init__(self, path=PREDICTION_CACHE_PATH,
+                 max_entries=PREDICTION_CACHE_MAX_ENTRIES, model_version=None):
+        self.path = str(path)
+        self.max_entries = max(int(max_entries), 1)
+        self.model_version = model_version or marco_model_version()
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                '''CREATE TABLE IF NOT EXISTS predictions (
+                    key TEXT, model_version TEXT, machine_class TEXT,
+                    prediction_dict TEXT, last_used REAL,
+                    PRIMARY KEY (key, model_version))''')
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS last_used_index ON predictions (last_used)')
+            self._connection.execute(
+                '''CREATE TABLE IF NOT EXISTS sources (
+                    source TEXT PRIMARY KEY, key TEXT)''')
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS source_key_index ON sources (key)')
+            self._count = self._connection.execute(  # kept up to date by puts
+                'SELECT COUNT(*) FROM predictions').fetchone()[0]
+        logger.debug('Opened {} at {}'.format(self, self.path))
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute(
+                'SELECT COUNT(*) FROM predictions').fetchone()[0]
+
+    def __contains__(self, key):
+        return self.get(key, touch=False) is not None
+
+    def get(self, key, touch=True):
+        '''Look up the cached prediction for one image.
+
+        :param key: Content key of the image, see :func:`content_key`
+        :type key: str
+        :param touch: If True mark the prediction as recently used,
+                      defaults to True
+        :type touch: bool, optional
+        :return: Tuple of (classification, prediction dict) or None if the
+                 image is not in the cache
+        :rtype: tuple or None
+        '''
+        return self.get_many([key], touch).get(key)
+
+    def get_many(self, keys, touch=True):
+        '''Look up the cached predictions for a collection of images.
+
+        :param keys: Content keys of the images
+        :type keys: list
+        :param touch: If True mark found predictions as recently used,
+                      defaults to True
+        :type touch: bool, optional
+        :return: Dictionary of (classification, prediction dict) tuples keyed
+                 by content key. Keys that are not cached are left out.
+        :rtype: dict
+        '''
+        found = {}
+        with self._lock:
+            rows = self._select(
+                'SELECT key, machine_class, prediction_dict FROM predictions '
+                'WHERE model_version = ? AND key IN ({})',
+                [self.model_version], keys)
+            for key, machine_class, prediction_dict in rows:
+                found[key] = (machine_class, json.loads(prediction_dict))
+            if touch and found:
+                now = time.time()
+                with self._connection:
+                    self._connection.executemany(
+                        'UPDATE predictions SET last_used = ? '
+                        'WHERE key = ? AND model_version = ?',
+                        [(now, key, self.model_version) for key in found])
+        return found
+
+    def _select(self, query, args, keys):
+        '''Private method that runs a query with an `IN` clause for `keys`
+        in chunks small enough for SQLite. Must be called holding
+        :attr:`_lock`.
+        '''
+        keys, rows = list(set(keys)), []
+        for i in range(0, len(keys), 500):  # stay under SQLite var limit
+            chunk = keys[i:i+500]
+            rows.extend(self._connection.execute(
+                query.format(','.join('?' * len(chunk))), args + chunk).fetchall())
+        return rows
+
+    def get_source_keys(self, sources):
+        '''Look up the content keys of image files by their source keys.
+
+        :param sources: Source keys of the files, see :func:`file_source_key`
+        :type sources: list
+        :return: Content keys keyed by source key. Files the cache has not
+                 seen are left out.
+        :rtype: dict
+        '''
+        with self._lock:
+            return dict(self._select(
+                'SELECT source, key FROM sources WHERE source IN ({})', [],
+                [s for s in sources if s]))
+
+    def put_source_keys(self, sources):
+        '''Remember the content keys of image files.
+
+        :param sources: Iterable of (source key, content key) tuples
+        :type sources: iterable
+        '''
+        rows = [(source, key) for source, key in sources if source and key]
+        if rows:
+            with self._lock, self._connection:
+                self._connection.executemany(
+                    'INSERT OR REPLACE INTO sources VALUES (?, ?)', rows)
+
+    def put(self, key, machine_class, prediction_dict):
+        '''Cache the prediction for one image.
+
+        :param key: Content key of the image
+        :type key: str
+        :param machine_class: MARCO classification
+        :type machine_class: str
+        :param prediction_dict: MARCO confidence for each classification
+        :type prediction_dict: dict
+        '''
+        self.put_many([(key, machine_class, prediction_dict)])
+
+    def put_many(self, predictions):
+        '''Cache the predictions for a collection of images and evict the
+        least recently used predictions if the cache is over its size limit.
+
+        :param predictions: Iterable of (content key, classification,
+                            prediction dict) tuples
+        :type predictions: iterable
+        '''
+        now = time.time()
+        rows = [(key, self.model_version, machine_class,
+                 json.dumps(prediction_dict), now)
+                for key, machine_class, prediction_dict in predictions
+                if key and machine_class]
+        if rows:
+            with self._lock, self._connection:
+                existing = self._select(
+                    'SELECT key FROM predictions '
+                    'WHERE model_version = ? AND key IN ({})',
+                    [self.model_version], [row[0] for row in rows])
+                self._connection.executemany(
+                    'INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?)',
+                    rows)
+                self._count += len(set(row[0] for row in rows)) - len(existing)
+            if self._count > self.max_entries:
+                self.evict()
+
+    def evict(self):
+        '''Remove the least recently used predictions until the cache holds
+        at most :attr:`max_entries` predictions. Predictions made by other
+        model versions are the first to go.
+
+        :return: Number of predictions removed
+        :rtype: int
+        '''
+        overflow = self._count - self.max_entries
+        if overflow > 0:
+            with self._lock, self._connection:
+                evicted = self._connection.execute(
+                    'SELECT rowid, key FROM predictions '
+                    'ORDER BY model_version = ?, last_used LIMIT ?',
+                    (self.model_version, overflow)).fetchall()
+                self._connection.executemany(
+                    'DELETE FROM predictions WHERE rowid = ?',
+                    [(rowid,) for rowid, _ in evicted])
+                self._connection.executemany(  # forget files of evicted keys
+                    'DELETE FROM sources WHERE key = ?',
+                    [(key,) for _, key in evicted])
+                overflow = len(evicted)
+                self._count -= overflow
+            logger.debug('Evicted {} cached predictions'.format(overflow))
+            return overflow
+        return 0
+
+    def clear(self):
+        '''Remove every cached prediction.
+        '''
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM predictions')
+            self._connection.execute('DELETE FROM sources')
+            self._count = 0
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def populate_from_run(self, run):
+        '''Add the MARCO classifications already stored in a run to the
+        cache. Only images that have a MARCO classification and whose image
+        data is available (either on disk or base64 encoded in the run) are
+        added.
+
+        :param run: Run to take predictions from
+        :type run: Run
+        :return: Number of predictions added
+        :rtype: int
+        '''
+        predictions = []
+        for image in run.images:
+            if image and not image.is_placeholder and image.machine_class:
+                image_bytes = image.read_bytes()
+                if image_bytes:
+                    predictions.append((content_key(image_bytes),
+                                        image.machine_class, image.prediction_dict))
+        self.put_many(predictions)
+        logger.debug('Added {} predictions from {}'.format(len(predictions), run))
+        return len(predictions)
+
+    def populate_from_xtal(self, xtal_path):
+        '''Add the MARCO classifications saved in an xtal file to the
+        cache. See :meth:`populate_from_run`.
+
+        :param xtal_path: Path to xtal file
+        :type xtal_path: str or Path
+        :return: Number of predictions added
+        :rtype: int
+        '''
+        from polo.utils.io_utils import RunDeserializer
+        run = RunDeserializer(str(xtal_path)).xtal_to_run()
+        if isinstance(run, Exception) or not hasattr(run, 'images'):
+            logger.warning('Could not read {} to populate cache'.format(xtal_path))
+            return 0
+        return self.populate_from_run(run)
+
+
+_prediction_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_prediction_cache():
+    '''Return the :class:`PredictionCache` shared by the whole program,
+    opening it the first time it is needed.
+
+    :return: Shared prediction cache
+    :rtype: PredictionCache
+    '''
+    global _prediction_cache
+    with _cache_lock:
+        if _prediction_cache is None:
+            _prediction_cache = PredictionCache()
+    return _prediction_cache
+
+
+if __name__ == '__main__':
+    # pre-populate the cache from xtal files
+    # python -m polo.marco.cache file_a.xtal file_b.xtal
+    import sys
+    cache = get_prediction_cache()
+    for xtal_path in sys.argv[1:]:
+        print('{}: added {} predictions'.format(
+            xtal_path, cache.populate_from_xtal(xtal_path)))
+    print('Cache holds {} predictions'.format(len(cache)))
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+from polo import CHECKPOINT_DIR, make_default_logger
+
+logger = make_default_logger(__name__)
+
+
+class ClassificationJournal():
+    '''Append only journal of the MARCO predictions made for one run while
+    it is being classified. Every prediction is written to disk as soon as
+    it is made so the work done before Polo is closed, crashes or the
+    machine goes to sleep is not lost. Predictions are stored as one json
+    object per line keyed by image path, a partially written last line is
+    ignored when the journal is read.
+
+    The journal of a run is removed once the run has been classified
+    completely, so finding one means classification was interrupted. If it
+    was interrupted on purpose by cancelling, :meth:`mark_cancelled` records
+    that so the run is not automatically resumed.
+
+    :param run: Run the journal records predictions for
+    :type run: Run or HWIRun
+    :param checkpoint_dir: Directory journals are stored in, defaults to
+                           :const:`polo.CHECKPOINT_DIR`
+    :type checkpoint_dir: str or Path, optional
+    '''
+
+    def __init__(self, run, checkpoint_dir=CHECKPOINT_DIR):
+        self.run_name = run.run_name
+        self.path = Path(checkpoint_dir).joinpath(
+            ClassificationJournal.journal_name(run))
+        self.cancelled = False  # set by read if the last entry is a cancel
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def journal_name(run):
+        '''Name of the journal file of `run`. Includes a hash of the paths
+        of the run's images so different runs that share a name do not
+        share a journal.
+
+        :param run: Run to name the journal of
+        :type run: Run or HWIRun
+        :return: File name
+        :rtype: str
+        '''
+        digest = hashlib.sha1()
+        for image in run.images:
+            if image:
+                digest.update(str(image.path).encode())
+        safe_name = ''.join(
+            c if c.isalnum() or c in '-_' else '_' for c in str(run.run_name))
+        return '{}_{}.jsonl'.format(safe_name, digest.hexdigest()[:12])
+
+    @property
+    def exists(self):
+        return self.path.is_file()
+
+    def record(self, images, marco_version=None):
+        '''Append the current MARCO classification of each image in
+        `images` to the journal and flush it to disk.
+
+        :param images: Images that were just classified
+        :type images: list
+        :param marco_version: Version of the model that classified the
+                              images, defaults to None
+        :type marco_version: str, optional
+        '''
+        lines = ''.join(
+            json.dumps({
+                'path': str(image.path),
+                'machine_class': image.machine_class,
+                'prediction_dict': image.prediction_dict,
+                'marco_version': marco_version
+            }) + '\n'
+            for image in images if image and image.machine_class
+        )
+        if not lines:
+            return
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(str(self.path), 'a') as journal:
+                journal.write(lines)
+                journal.flush()
+                os.fsync(journal.fileno())
+
+    def mark_cancelled(self):
+        '''Record that classification was cancelled by the user.
+        '''
+        with self._lock:
+            if self.path.is_file():
+                with open(str(self.path), 'a') as journal:
+                    journal.write(json.dumps({'cancelled': True}) + '\n')
+                    journal.flush()
+                    os.fsync(journal.fileno())
+
+    def read(self):
+        '''Read the predictions stored in the journal. Later entries for an
+        image replace earlier ones. Sets :attr:`cancelled` if classification
+        was cancelled after the last prediction was recorded.
+
+        :return: Dictionary of image path to journal entry
+        :rtype: dict
+        '''
+        entries = {}
+        self.cancelled = False
+        if not self.exists:
+            return entries
+        with self._lock, open(str(self.path)) as journal:
+            for line in journal:
+                try:
+                    entry = json.loads(line)
+                    if entry.get('cancelled'):
+                        self.cancelled = True
+                        continue
+                    entries[entry['path']] = entry
+                    self.cancelled = False
+                except (ValueError, KeyError, AttributeError):
+                    # last line may have been cut off by a crash
+                    logger.debug('Skipped bad journal line in {}'.format(
+                        self.path))
+        return entries
+
+    def restore(self, run, marco_version=None):
+        '''Give the images of `run` the classifications stored in the
+        journal. Only entries made by `marco_version` are used and images
+        that already have a current classification are left alone.
+
+        :param run: Run to restore
+        :type run: Run or HWIRun
+        :param marco_version: Only restore predictions of this model
+                              version, defaults to None (any version)
+        :type marco_version: str, optional
+        :return: Images that were given a classification
+        :rtype: list
+        '''
+        entries = self.read()
+        restored = []
+        if not entries:
+            return restored
+        for image in run.images:
+            if not image or not image.needs_classification(marco_version):
+                continue
+            entry = entries.get(str(image.path))
+            if entry and (marco_version is None
+                          or entry['marco_version'] == marco_version):
+                image.set_marco_classification(
+                    entry['machine_class'], entry['prediction_dict'],
+                    entry['marco_version'])
+                restored.append(image)
+        logger.debug('Restored {} classifications of {} from {}'.format(
+            len(restored), self.run_name, self.path))
+        return restored
+
+    def clear(self):
+        '''Delete the journal.
+        '''
+        with self._lock:
+            try:
+                self.path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def __repr__(self):
+        return '<ClassificationJournal {}>'.format(self.path)
@@ -0,0 +1,388 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from polo import (MARCO_BATCH_SIZE, MARCO_PREFETCH_DEPTH, MARCO_READ_WORKERS,
+                  MARCO_THROUGHPUT_SMOOTHING, make_default_logger)
+from polo.marco.cache import content_key
+from polo.marco.run_marco import load_image_batch, process_batch_output
+
+logger = make_default_logger(__name__)
+
+
+class StageTimer():
+    '''Accumulates wall time spent in named stages of the classification
+    pipeline. Safe to use from multiple threads.
+
+    .. code-block:: python
+
+        timer = StageTimer()
+        with timer.time('read'):
+            image_bytes = load_image(path)
+        timer.summary()  # {'read': {'total': ..., 'count': 1, 'mean': ...}}
+    '''
+
+    def __init__(self):
+        self._totals = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds, count=1):
+        '''Add time to a stage.
+
+        :param stage: Name of the stage
+        :type stage: str
+        :param seconds: Time spent in the stage
+        :type seconds: float
+        :param count: Number of images the time was spent on, defaults to 1
+        :type count: int, optional
+        '''
+        with self._lock:
+            self._totals[stage] = self._totals.get(stage, 0) + seconds
+            self._counts[stage] = self._counts.get(stage, 0) + count
+
+    def merge(self, summary):
+        '''Add the timings of another timer, for example one that ran in a
+        worker process, to this one.
+
+        :param summary: Output of :meth:`summary` of the other timer
+        :type summary: dict
+        '''
+        for stage, timing in summary.items():
+            self.add(stage, timing['total'], timing['count'])
+
+    @contextmanager
+    def time(self, stage, count=1):
+        '''Context manager that adds the time spent in the `with` block
+        to `stage`.
+
+        :param stage: Name of the stage
+        :type stage: str
+        :param count: Number of images handled in the block, defaults to 1
+        :type count: int, optional
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start, count)
+
+    def summary(self):
+        '''Total time, number of images and mean time per image for
+        each stage.
+
+        :return: Stage timings keyed by stage name
+        :rtype: dict
+        '''
+        with self._lock:
+            return {
+                stage: {
+                    'total': round(total, 4), 'count': self._counts[stage],
+                    'mean': round(total / max(self._counts[stage], 1), 4)
+                } for stage, total in self._totals.items()
+            }
+
+    def __str__(self):
+        return ', '.join('{}: {}s ({}s / image)'.format(
+            stage, t['total'], t['mean']) for stage, t in self.summary().items())
+
+
+class ThroughputMeter():
+    '''Tracks how fast images are being classified. The rate is an
+    exponentially weighted moving average (EWMA) of the images per second
+    of each batch, so one slow or fast batch does not throw off the estimate
+    of the time left the way the time of the last image alone does.
+
+    .. code-block:: python
+
+        meter = ThroughputMeter()
+        for batch in batches:
+            classify(batch)
+            meter.update(len(batch))
+        meter.seconds_remaining(images_left)
+
+    :param smoothing: Weight of the latest batch between 0 and 1, defaults
+                      to :const:`polo.MARCO_THROUGHPUT_SMOOTHING`
+    :type smoothing: float, optional
+    '''
+
+    def __init__(self, smoothing=MARCO_THROUGHPUT_SMOOTHING):
+        self.smoothing = min(max(float(smoothing), 0.01), 1)
+        self.images = 0
+        self.elapsed = 0  # seconds spent classifying, excluding pauses
+        self.rate = None  # EWMA images per second
+        self._last = time.perf_counter()
+
+    def restart_clock(self):
+        '''Start timing the next batch from now, so time spent outside of
+        classification (like being paused) is not counted.
+        '''
+        self._last = time.perf_counter()
+
+    def update(self, count, seconds=None):
+        '''Record that `count` more images have been classified.
+
+        :param count: Images classified since the last update
+        :type count: int
+        :param seconds: Time it took, defaults to None (time since the last
+                        update or :meth:`restart_clock`)
+        :type seconds: float, optional
+        :return: Smoothed images per second
+        :rtype: float
+        '''
+        now = time.perf_counter()
+        if seconds is None:
+            seconds = now - self._last
+        self._last = now
+        if count <= 0:
+            return self.rate
+        self.images += count
+        self.elapsed += seconds
+        batch_rate = count / max(seconds, 1e-6)
+        if self.rate is None:
+            self.rate = batch_rate
+        else:
+            self.rate = (self.smoothing * batch_rate
+                         + (1 - self.smoothing) * self.rate)
+        return self.rate
+
+    @property
+    def mean_rate(self):
+        '''Images per second over everything classified so far.
+
+        :return: Mean images per second or None before the first update
+        :rtype: float
+        '''
+        if not self.images:
+            return None
+        return self.images / max(self.elapsed, 1e-6)
+
+    def seconds_remaining(self, remaining):
+        '''Estimate how long it will take to classify `remaining` images.
+
+        :param remaining: Images left to classify
+        :type remaining: int
+        :return: Seconds or None if there is no estimate yet
+        :rtype: float
+        '''
+        if not self.rate:
+            return None
+        return remaining / self.rate
+
+
+class PriorityBatchQueue():
+    '''Thread-safe queue of items waiting to be classified that hands them
+    out in batches. Items are handed out in the order they were added
+    unless they are moved to the front with :meth:`prioritize`, which is how
+    the images a user is currently looking at get classified first. Items
+    are keyed by identity, the same way
+    :class:`~polo.crystallography.image.Image` objects are keyed in the
+    :class:`~polo.utils.pixmap_cache.PixmapCache`, so an item is only queued
+    once and items that are not hashable can be queued as well.
+
+    :param items: Items to queue, defaults to None
+    :type items: iterable, optional
+    '''
+
+    def __init__(self, items=None):
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        if items:
+            self.extend(items)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+
+    def extend(self, items):
+        '''Add `items` to the back of the queue. Items already in the
+        queue keep their place.
+
+        :param items: Items to add
+        :type items: iterable
+        '''
+        with self._lock:
+            for item in items:
+                self._items.setdefault(id(item), item)
+
+    def prioritize(self, items):
+        '''Move `items` to the front of the queue, keeping the order they
+        are given in. Items that are not in the queue, because they have
+        already been handed out or were never added, are ignored.
+
+        :param items: Items to classify next
+        :type items: iterable
+        :return: Number of items that were moved
+        :rtype: int
+        '''
+        moved = 0
+        with self._lock:
+            for item in reversed(list(items)):
+                if id(item) in self._items:
+                    self._items.move_to_end(id(item), last=False)
+                    moved += 1
+        return moved
+
+    def next_batch(self, batch_size):
+        '''Remove and return up to `batch_size` items from the front of
+        the queue.
+
+        :param batch_size: Max number of items to return
+        :type batch_size: int
+        :return: Next items to classify, empty if the queue is empty
+        :rtype: list
+        '''
+        with self._lock:
+            return [self._items.popitem(last=False)[1]
+                    for _ in range(min(batch_size, len(self._items)))]
+
+
+class PrefetchPipeline():
+    '''Producer / consumer pipeline that overlaps reading images from disk
+    with running them through the MARCO model. A bounded pool of reader
+    threads loads the bytes of upcoming batches while the current batch is
+    being classified, with at most `queue_depth` batches read ahead of the
+    inference loop. This hides slow disk or network share reads behind
+    inference time.
+
+    Stage timings are collected in :attr:`timer`: `read` is the time reader
+    threads spent loading images, `read_wait` is the time the inference loop
+    sat waiting for a batch to be read, `infer` is time spent in the model
+    and `post-process` is time spent turning model output into
+    predictions. Callers can add their own post processing time to the same
+    timer.
+
+    :param predictor: Predictor to classify images with
+    :type predictor: Predictor
+    :param batch_size: Images per model call, defaults to
+                       :const:`polo.MARCO_BATCH_SIZE`
+    :type batch_size: int, optional
+    :param read_workers: Number of reader threads, defaults to
+                         :const:`polo.MARCO_READ_WORKERS`
+    :type read_workers: int, optional
+    :param queue_depth: Max number of batches read ahead, defaults to
+                        :const:`polo.MARCO_PREFETCH_DEPTH`
+    :type queue_depth: int, optional
+    :param timer: Timer to record stage timings in, defaults to None. If None
+                  a new :class:`StageTimer` is created.
+    :type timer: StageTimer, optional
+    '''
+
+    def __init__(self, predictor, batch_size=MARCO_BATCH_SIZE,
+                 read_workers=MARCO_READ_WORKERS, queue_depth=MARCO_PREFETCH_DEPTH,
+                 timer=None):
+        self.predictor = predictor
+        self.batch_size = max(int(batch_size), 1)
+        self.read_workers = max(int(read_workers), 1)
+        self.queue_depth = max(int(queue_depth), 1)
+        self.timer = timer if isinstance(timer, StageTimer) else StageTimer()
+
+    def _read_batch(self, batch, hash_content=False):
+        '''Private method run by the reader threads to load one batch.
+
+        :param batch: Image file paths and / or raw image bytes
+        :type batch: list
+        :param hash_content: Also compute the content key of every image
+                             while it is in memory, defaults to False
+        :type hash_content: bool, optional
+        :return: List of raw image bytes and list of content keys, None
+                 if `hash_content` is False
+        :rtype: tuple
+        '''
+        with self.timer.time('read', len(batch)):
+            image_bytes = load_image_batch(batch)
+            if hash_content:
+                return image_bytes, [content_key(b) if b else None
+                                     for b in image_bytes]
+            return image_bytes, None
+
+    def classify(self, images, hash_content=False):
+        '''Classify `images`, yielding results one batch at a time in the
+        same order as `images`.
+
+        :param images: Image file paths and / or raw image bytes
+        :type images: list
+        :param hash_content: Also yield the content key of every image,
+                             computed from the bytes read for the model so
+                             images do not have to be read twice to be
+                             cached, see :func:`~polo.marco.cache.content_key`.
+                             Defaults to False
+        :type hash_content: bool, optional
+        :yield: Tuple of the batch's start index in `images` and a list of
+                (classification, prediction dict) tuples for the batch,
+                followed by a list of content keys if `hash_content` is True
+        :rtype: tuple
+        '''
+        starts = deque(range(0, len(images), self.batch_size))
+        pending = deque()  # (start, future) for batches being read
+        with ThreadPoolExecutor(max_workers=self.read_workers) as readers:
+            while starts or pending:
+                while starts and len(pending) < self.queue_depth:
+                    start = starts.popleft()
+                    pending.append((start, readers.submit(
+                        self._read_batch, images[start:start+self.batch_size],
+                        hash_content)))
+                start, future = pending.popleft()
+                results, keys = self._classify_read_batch(future)
+                yield (start, results, keys) if hash_content else (start, results)
+        logger.debug('Pipeline timings {}'.format(self.timer))
+
+    def classify_queue(self, queue, key=None, hash_content=False):
+        '''Classify the items of a :class:`PriorityBatchQueue` until it is
+        empty. Batches are taken from the queue only when there is room to
+        read them ahead, so items prioritized while classification is running
+        are classified after at most :attr:`queue_depth` more batches.
+
+        :param queue: Queue of items to classify
+        :type queue: PriorityBatchQueue
+        :param key: Function that returns the image path or raw image bytes
+                    of a queued item, defaults to None (items are paths or
+                    bytes)
+        :type key: callable, optional
+        :param hash_content: Also yield the content key of every item,
+                             computed from the bytes read for the model so
+                             images do not have to be read twice to be
+                             cached, see :func:`~polo.marco.cache.content_key`.
+                             Defaults to False
+        :type hash_content: bool, optional
+        :yield: Tuple of a batch of items and a list of (classification,
+                prediction dict) tuples for the batch, followed by a list of
+                content keys if `hash_content` is True
+        :rtype: tuple
+        '''
+        key = key or (lambda item: item)
+        pending = deque()  # (items, future) for batches being read
+        with ThreadPoolExecutor(max_workers=self.read_workers) as readers:
+            while True:
+                while len(pending) < self.queue_depth:
+                    items = queue.next_batch(self.batch_size)
+                    if not items:
+                        break
+                    pending.append((items, readers.submit(
+                        self._read_batch, [key(item) for item in items],
+                        hash_content)))
+                if not pending:
+                    break
+                items, future = pending.popleft()
+                results, keys = self._classify_read_batch(future)
+                yield (items, results, keys) if hash_content else (items, results)
+        logger.debug('Pipeline timings {}'.format(self.timer))
+
+    def _classify_read_batch(self, future):
+        '''Private method that waits for a batch to be read and runs it
+        through the model.
+
+        :param future: Future of a :meth:`_read_batch` call
+        :type future: Future
+        :return: List of (classification, prediction dict) tuples and the
+                 content keys read with the batch
+        :rtype: tuple
+        '''
+        with self.timer.time('read_wait', 0):
+            batch, keys = future.result()
+        with self.timer.time('infer', len(batch)):
+            output = self.predictor.infer(batch)
+        with self.timer.time('post-process', len(batch)):
+            return process_batch_output(output, len(batch)), keys
@@ -0,0 +1,267 @@
+import multiprocessing
+import os
+from collections import deque
+
+from polo import (MARCO_BATCH_SIZE, MARCO_NUM_WORKERS, MODEL_PATH,
+                  make_default_logger)
+
+logger = make_default_logger(__name__)
+
+_worker_predictor = None  # each worker process holds its own predictor
+
+
+def _init_worker(model_path, intra_op_threads, backend):
+    '''Initializer for :class:`ClassificationPool` worker processes. Loads the
+    worker's own copy of the MARCO model once when the worker starts so it
+    can be reused for every chunk of images the worker is handed.
+
+    :param model_path: Path to the MARCO saved model directory
+    :type model_path: str
+    :param intra_op_threads: Number of TF threads the worker may use
+    :type intra_op_threads: int
+    :param backend: Inference backend to load, see
+                    :mod:`polo.marco.backends`
+    :type backend: str
+    '''
+    global _worker_predictor
+    from polo.marco.backends import make_predictor, set_backend
+    set_backend(backend)  # spawned workers do not inherit the parent's choice
+    _worker_predictor = make_predictor(
+        backend, model_path, intra_op_threads=intra_op_threads,
+        inter_op_threads=1)
+
+
+def _classify_chunk(chunk):
+    '''Classify one chunk of images in a worker process.
+
+    :param chunk: Tuple of the chunk's start index, a list of image paths
+                  or raw image bytes and whether to compute the content key
+                  of every image
+    :type chunk: tuple
+    :return: Tuple of the chunk's start index, a list of (classification,
+             prediction dict) tuples, the worker's stage timings for the
+             chunk and the content keys of the images (None if not asked
+             for)
+    :rtype: tuple
+    '''
+    from polo.marco.cache import content_key
+    from polo.marco.pipeline import StageTimer
+    from polo.marco.run_marco import load_image_batch, process_batch_output
+
+    start, images, hash_content = chunk
+    timer = StageTimer()
+    keys = None
+    with timer.time('read', len(images)):
+        image_bytes = load_image_batch(images)
+        if hash_content:
+            keys = [content_key(b) if b else None for b in image_bytes]
+    with timer.time('infer', len(images)):
+        output = _worker_predictor.infer(image_bytes)
+    with timer.time('post-process', len(images)):
+        results = process_batch_output(output, len(images))
+    return start, results, timer.summary(), keys
+
+
+def _run_at_barrier(barrier, function, args):
+    '''Run `function` in a worker process and then wait until every other
+    worker has done the same, which keeps this worker from being handed
+    another call. See :meth:`ClassificationPool.run_on_each_worker`.
+    '''
+    try:
+        return os.getpid(), function(*args)
+    finally:
+        barrier.wait()
+
+
+class ClassificationPool():
+    '''Pool of worker processes that classify images with the MARCO model.
+    Each worker loads its own copy of the saved model once and then pulls
+    chunks of images from the pool's task queue, so classification of a
+    plate is spread across multiple cores instead of sharing the one global
+    session. Results are yielded back as soon as each chunk finishes.
+
+    Workers are always started with the `spawn` method since forking a
+    process that already holds a TF session and Qt threads is not safe.
+
+    .. code-block:: python
+
+        with ClassificationPool(num_workers=8) as pool:
+            for start, results in pool.classify(image_paths):
+                # results[0] is the classification of image_paths[start]
+                pass
+
+    :param num_workers: Number of worker processes, defaults to
+                        :const:`polo.MARCO_NUM_WORKERS`
+    :type num_workers: int, optional
+    :param chunk_size: Number of images sent to a worker at once, defaults to
+                       :const:`polo.MARCO_BATCH_SIZE`
+    :type chunk_size: int, optional
+    :param model_path: Path to the saved model, defaults to
+                       :const:`polo.MODEL_PATH`
+    :type model_path: str or Path, optional
+    :param intra_op_threads: TF threads each worker may use, defaults to
+                             None (split the machine's cores evenly, see
+                             :attr:`threads_per_worker`)
+    :type intra_op_threads: int, optional
+    :param timer: :class:`~polo.marco.pipeline.StageTimer` the workers'
+                  stage timings are added to, defaults to None. Times are
+                  summed over all workers.
+    :type timer: StageTimer, optional
+    :param backend: Inference backend the workers load, defaults to None
+                    (the backend selected in this process, see
+                    :func:`~polo.marco.backends.get_backend`)
+    :type backend: str, optional
+    '''
+
+    def __init__(self, num_workers=MARCO_NUM_WORKERS, chunk_size=MARCO_BATCH_SIZE,
+                 model_path=MODEL_PATH, intra_op_threads=None, timer=None,
+                 backend=None):
+        self.num_workers = max(int(num_workers), 1)
+        self.chunk_size = max(int(chunk_size), 1)
+        self.model_path = str(model_path)
+        self.intra_op_threads = intra_op_threads
+        self.timer = timer
+        if backend is None:
+            from polo.marco.backends import get_backend
+            backend = get_backend()
+        self.backend = backend
+        self._pool = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def is_running(self):
+        return self._pool is not None
+
+    @property
+    def threads_per_worker(self):
+        '''Number of TF threads each worker is allowed so the workers
+        together do not oversubscribe the machine's cores, unless set
+        explicitly through :attr:`intra_op_threads`.
+
+        :return: TF intra op threads per worker
+        :rtype: int
+        '''
+        if self.intra_op_threads:
+            return int(self.intra_op_threads)
+        return max(1, (os.cpu_count() or 1) // self.num_workers)
+
+    def start(self):
+        '''Start the worker processes if they are not already running.
+        '''
+        if not self.is_running:
+            context = multiprocessing.get_context('spawn')
+            self._pool = context.Pool(
+                self.num_workers, initializer=_init_worker,
+                initargs=(self.model_path, self.threads_per_worker, self.backend)
+            )
+            logger.debug('Started {} with {} workers'.format(
+                self, self.num_workers))
+
+    def close(self):
+        '''Stop all worker processes. Any chunks that have not been
+        classified yet are dropped.
+        '''
+        if self.is_running:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+            logger.debug('Closed {}'.format(self))
+
+    def run_on_each_worker(self, function, args=()):
+        '''Call `function` exactly once in every worker process, for example
+        to warm up each worker's model or to collect per worker statistics.
+
+        :param function: Module level function the workers can import
+        :type function: callable
+        :param args: Arguments to call `function` with, defaults to ()
+        :type args: tuple, optional
+        :return: Return value of `function` keyed by worker process id
+        :rtype: dict
+        '''
+        self.start()
+        with multiprocessing.get_context('spawn').Manager() as manager:
+            barrier = manager.Barrier(self.num_workers)
+            return dict(self._pool.starmap(
+                _run_at_barrier, [(barrier, function, args)] * self.num_workers,
+                chunksize=1))
+
+    def classify(self, images, hash_content=False):
+        '''Classify a collection of images across the worker processes.
+        Chunks are yielded in the order they finish, not the order they
+        were submitted.
+
+        :param images: Image file paths and / or raw image bytes
+        :type images: list
+        :param hash_content: Also yield the content key of every image,
+                             computed by the workers from the bytes they
+                             read, defaults to False
+        :type hash_content: bool, optional
+        :yield: Tuple of the chunk's start index in `images` and a list of
+                (classification, prediction dict) tuples for the chunk,
+                followed by a list of content keys if `hash_content` is True
+        :rtype: tuple
+        '''
+        self.start()
+        images = [i if isinstance(i, bytes) else str(i) for i in images]
+        chunks = [(i, images[i:i+self.chunk_size], hash_content)
+                  for i in range(0, len(images), self.chunk_size)]
+        for start, results, timings, keys in self._pool.imap_unordered(
+                _classify_chunk, chunks):
+            self._record_timings(timings)
+            yield (start, results, keys) if hash_content else (start, results)
+
+    def classify_queue(self, queue, key=None, max_in_flight=None,
+                       hash_content=False):
+        '''Classify the items of a :class:`~polo.marco.pipeline.PriorityBatchQueue`
+        across the worker processes until it is empty. Only `max_in_flight`
+        chunks are handed to the workers at a time so items prioritized while
+        classification is running are picked up by the next free worker.
+        Chunks are yielded in the order they were handed out.
+
+        :param queue: Queue of items to classify
+        :type queue: PriorityBatchQueue
+        :param key: Function that returns the image path or raw image bytes
+                    of a queued item, defaults to None (items are paths or
+                    bytes)
+        :type key: callable, optional
+        :param max_in_flight: Max number of chunks handed out at once,
+                              defaults to None (two per worker)
+        :type max_in_flight: int, optional
+        :param hash_content: Also yield the content key of every item,
+                             computed by the workers from the bytes they
+                             read, defaults to False
+        :type hash_content: bool, optional
+        :yield: Tuple of a chunk of items and a list of (classification,
+                prediction dict) tuples for the chunk, followed by a list of
+                content keys if `hash_content` is True
+        :rtype: tuple
+        '''
+        self.start()
+        key = key or (lambda item: item)
+        max_in_flight = max_in_flight or self.num_workers * 2
+        in_flight = deque()
+        while True:
+            while len(in_flight) < max_in_flight:
+                items = queue.next_batch(self.chunk_size)
+                if not items:
+                    break
+                images = [key(i) for i in items]
+                images = [i if isinstance(i, bytes) else str(i) for i in images]
+                in_flight.append((items, self._pool.apply_async(
+                    _classify_chunk, ((0, images, hash_content),))))
+            if not in_flight:
+                break
+            items, result = in_flight.popleft()
+            _, results, timings, keys = result.get()
+            self._record_timings(timings)
+            yield (items, results, keys) if hash_content else (items, results)
+
+    def _record_timings(self, timings):
+        if self.timer:
+            self.timer.merge(timings)
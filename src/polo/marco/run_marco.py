@@ -1,25 +1,148 @@
+import hashlib
 import os
 import sys
 import operator
-from polo import make_default_logger, tf
+import threading
+from polo import MARCO_BATCH_SIZE, MODEL_PATH, make_default_logger
 import time
 
 logger = make_default_logger(__name__)
 
+_marco_model = None  # (loaded model, session) once get_marco_model is called
+_model_lock = threading.Lock()
 
 
 
 
+
+def get_tf():
+    '''Import and return the TF1 compatible TensorFlow API. TensorFlow is
+    only imported the first time this is called so that importing Polo does
+    not pay the cost of starting the TensorFlow runtime.
+
+    :return: `tensorflow.compat.v1` module
+    :rtype: module
+    '''
+    import tensorflow.compat.v1 as tf
+    if tf.executing_eagerly():
+        tf.disable_v2_behavior()
+    return tf
+
+
+def get_marco_model():
+    '''Return the MARCO model shared by the whole program, loading it
+    from :const:`polo.MODEL_PATH` the first time this is called. Safe to call
+    from multiple threads, only one copy of the model is ever loaded.
+
+    :return: Tuple of loaded model (meta graph) and session
+    :rtype: tuple
+    '''
+    global _marco_model
+    if _marco_model is None:
+        with _model_lock:
+            if _marco_model is None:
+                start = time.time()
+                _marco_model = load_model(MODEL_PATH)
+                logger.info('Loaded MARCO model in {} seconds'.format(
+                    round(time.time() - start, 2)))
+    return _marco_model
+
+
+def model_is_loaded():
+    '''Check if the shared MARCO model has been loaded yet.
+
+    :return: True if :func:`get_marco_model` has loaded the model
+    :rtype: bool
+    '''
+    return _marco_model is not None
+
+
+_model_versions = {}  # model version hashes keyed by model path
+
+
+def marco_model_version(model_path=MODEL_PATH):
+    '''Short hash of the files that make up the saved model at
+    `model_path`. Used to tell predictions made by different versions of the
+    model apart. Computed once per model path. Backends that do not run the
+    saved model, like the `mock` backend, report their own version so their
+    predictions are never mistaken for real ones.
+
+    :param model_path: Path to the saved model directory,
+                       defaults to :const:`polo.MODEL_PATH`
+    :type model_path: str or Path, optional
+    :return: Model version hash
+    :rtype: str
+    '''
+    from polo.marco.backends import BACKEND_MODEL_VERSIONS, get_backend
+    if get_backend() in BACKEND_MODEL_VERSIONS:
+        # predictions that do not come from the saved model
+        return BACKEND_MODEL_VERSIONS[get_backend()]
+    model_path = str(model_path)
+    if model_path not in _model_versions:
+        digest = hashlib.sha1()
+        for root, dirs, files in sorted(os.walk(model_path)):
+            dirs.sort()
+            for f in sorted(files):
+                digest.update(f.encode('utf-8'))
+                with open(os.path.join(root, f), 'rb') as model_file:
+                    digest.update(model_file.read())
+        _model_versions[model_path] = digest.hexdigest()[:12]
+    return _model_versions[model_path]
+
+
+def load_model(model_path=MODEL_PATH, intra_op_threads=None,
+               inter_op_threads=None):
+    '''Load the MARCO saved model into a new session.
+
+    :param model_path: Path to the saved model directory,
+                       defaults to :const:`polo.MODEL_PATH`
+    :type model_path: str or Path, optional
+    :param intra_op_threads: Threads TF may use within one op, defaults to
+                             None (let TF decide)
+    :type intra_op_threads: int, optional
+    :param inter_op_threads: Threads TF may use to run ops in parallel,
+                             defaults to None (let TF decide)
+    :type inter_op_threads: int, optional
+    :return: Tuple of loaded model (meta graph) and session
+    :rtype: tuple
+    '''
+    tf = get_tf()
+    config = tf.ConfigProto()
+    if intra_op_threads:
+        config.intra_op_parallelism_threads = int(intra_op_threads)
+    if inter_op_threads:
+        config.inter_op_parallelism_threads = int(inter_op_threads)
+    session = tf.Session(graph=tf.Graph(), config=config)
+    loaded_model = tf.saved_model.loader.load(
+        session, [tf.saved_model.tag_constants.SERVING], str(model_path)
+    )
+    logger.debug('Loaded MARCO model from {}'.format(model_path))
+    return loaded_model, session
+
+
 def load_image(image_path):
     with open(str(image_path), 'rb') as f:
         image_bytes = f.read()
     return image_bytes
 
 
-def process_model_output(model_output):
+def load_image_batch(images):
+    '''Read a collection of images into memory so they can be fed to the
+    MARCO model. Items that are already `bytes` are passed through unchanged
+    and anything else is treated as a path to an image file.
+
+    :param images: Image file paths and / or raw image bytes
+    :type images: list
+    :return: List of raw image bytes, in the same order as `images`
+    :rtype: list
+    '''
+    return [i if isinstance(i, bytes) else load_image(i) for i in images]
+
+
+def process_model_output(model_output, index=0):
     # Extract classes and scores from the model output
-    classes = model_output['classes'][0]
-    scores = model_output['scores'][0]
+    classes = model_output['classes'][index]
+    scores = model_output['scores'][index]
 
     # Create a dictionary mapping classes to probabilities
     class_probabilities = {class_name.decode('utf-8'): float(score) 
@@ -31,25 +154,208 @@ def process_model_output(model_output):
     return highest_probability_class, class_probabilities
 
 
+def process_batch_output(model_output, batch_length):
+    '''Split the output of one batched `session.run` call into per image
+    results.
+
+    :param model_output: Raw model output for the batch
+    :type model_output: dict
+    :param batch_length: Number of images that were in the batch
+    :type batch_length: int
+    :return: List of (classification, prediction dict) tuples
+    :rtype: list
+    '''
+    return [process_model_output(model_output, i) for i in range(batch_length)]
+
+
+class Predictor():
+    '''Interface every MARCO inference backend implements, see
+    :mod:`polo.marco.backends`. Subclasses only have to implement
+    :meth:`infer`, which runs one batch of raw image bytes through the
+    model and returns the raw model output, a dict with a row of class
+    names (as bytes) in `classes` and a row of matching scores in `scores`
+    for each image. :func:`process_batch_output` turns that output into
+    predictions.
+    '''
+    model_version = None  # None if the predictor runs the bundled model
+
+    def infer(self, image_bytes):
+        '''Run one batch of raw image bytes through the model.
+
+        :param image_bytes: List of raw image bytes
+        :type image_bytes: list
+        :return: Model output keyed by output name
+        :rtype: dict
+        '''
+        raise NotImplementedError
+
+    def predict(self, image):
+        '''Classify a single image.
+
+        :param image: Path to an image file or raw image bytes
+        :type image: str, Path or bytes
+        :return: Tuple of (classification, prediction dict)
+        :rtype: tuple
+        '''
+        return process_model_output(self.infer(load_image_batch([image])))
+
+    def predict_batch(self, images, batch_size=MARCO_BATCH_SIZE):
+        '''Classify a collection of images, feeding at most `batch_size`
+        images to the model at once.
+
+        :param images: Image file paths and / or raw image bytes to classify
+        :type images: list
+        :param batch_size: Max number of images per model call,
+                           defaults to :const:`polo.MARCO_BATCH_SIZE`
+        :type batch_size: int, optional
+        :return: List of (classification, prediction dict) tuples, one for
+                 each image in `images` and in the same order
+        :rtype: list
+        '''
+        if not isinstance(batch_size, int) or batch_size < 1:
+            batch_size = 1
+        images, processed_results = list(images), []
+        for i in range(0, len(images), batch_size):
+            batch = load_image_batch(images[i:i+batch_size])
+            processed_results += process_batch_output(self.infer(batch), len(batch))
+        return processed_results
+
+
+class MarcoPredictor(Predictor):
+    '''Reusable wrapper around a loaded MARCO model, the `tf1` backend. The `serving_default`
+    signature and the input and output tensors are resolved once when the
+    :class:`MarcoPredictor` is created instead of every time an image is
+    classified. Optionally a `session.make_callable` fast path is compiled
+    which avoids the feed dict and fetch parsing overhead of `session.run`.
+
+    :param loaded_model: Loaded MARCO model (meta graph)
+    :type loaded_model: MetaGraphDef
+    :param session: Session the MARCO model was loaded into
+    :type session: tf.Session
+    :param use_callable: If True compile a `session.make_callable` fast path,
+                         defaults to False
+    :type use_callable: bool, optional
+    '''
+
+    def __init__(self, loaded_model, session, use_callable=False):
+        self.loaded_model = loaded_model
+        self.session = session
+        signature = loaded_model.signature_def['serving_default']
+        self.input_tensor = session.graph.get_tensor_by_name(
+            signature.inputs['image_bytes'].name)
+        self.output_names = sorted(signature.outputs.keys())
+        self.output_tensors = {
+            name: session.graph.get_tensor_by_name(signature.outputs[name].name)
+            for name in self.output_names}
+        self._callable = None
+        if use_callable:
+            try:
+                self._callable = session.make_callable(
+                    [self.output_tensors[name] for name in self.output_names],
+                    feed_list=[self.input_tensor])
+            except Exception as e:
+                logger.warning('Caught {} compiling callable, using session.run'.format(e))
+        logger.debug('Created {}'.format(self))
+
+    @property
+    def has_callable(self):
+        '''True if the `session.make_callable` fast path is being used.
+
+        :return: If the callable fast path is available
+        :rtype: bool
+        '''
+        return self._callable is not None
+
+    def infer(self, image_bytes):
+        '''Run one batch of raw image bytes through the model and return
+        the raw model output. Use :func:`process_batch_output` to convert the
+        output to predictions.
+
+        :param image_bytes: List of raw image bytes
+        :type image_bytes: list
+        :return: Model output keyed by output name
+        :rtype: dict
+        '''
+        if self._callable:
+            return dict(zip(self.output_names, self._callable(image_bytes)))
+        else:
+            return self.session.run(
+                self.output_tensors, feed_dict={self.input_tensor: image_bytes})
+
+
+_predictors = {}  # predictors already built keyed by model and session ids
+_predictor_lock = threading.Lock()
+
+
+def get_predictor(loaded_model=None, session=None, use_callable=True):
+    '''Return a :class:`MarcoPredictor` for `loaded_model` and `session`,
+    creating it the first time it is requested. If either is not given
+    the model loaded at startup (:const:`polo.LOADED_MODEL` and 
+    :const:`polo.SESS`) is used, unless a MARCO server is configured through
+    :const:`polo.MARCO_SERVER_ADDRESS` and can be reached. Then a
+    :class:`~polo.marco.server.RemotePredictor` is returned instead and no
+    model is loaded in this process. If another backend than `tf1` is
+    selected, see :func:`~polo.marco.backends.get_backend`, the shared
+    predictor of that backend is returned. Safe to call from multiple
+    threads, each predictor is only built once.
+
+    :param loaded_model: Loaded MARCO model, defaults to None
+    :type loaded_model: MetaGraphDef, optional
+    :param session: Session the model was loaded into, defaults to None
+    :type session: tf.Session, optional
+    :param use_callable: Compile the `session.make_callable` fast path when
+                         the predictor is first created, defaults to True
+    :type use_callable: bool, optional
+    :return: Predictor for the model
+    :rtype: Predictor
+    '''
+    if loaded_model is None and session is None:
+        from polo.marco.backends import get_backend, get_backend_predictor
+        from polo.marco.server import get_remote_predictor
+        remote_predictor = get_remote_predictor()
+        if remote_predictor is not None:
+            return remote_predictor
+        if get_backend() != 'tf1':
+            return get_backend_predictor()
+    if loaded_model is None or session is None:
+        loaded_model, session = get_marco_model()
+    key = (id(loaded_model), id(session))
+    if key not in _predictors:
+        with _predictor_lock:
+            if key not in _predictors:  # built by another thread while waiting
+                _predictors[key] = MarcoPredictor(
+                    loaded_model, session, use_callable)
+    return _predictors[key]
+
 
 def run_model(loaded_model, session, image_path):
-    image_bytes = load_image(image_path)
-
-    meta_graph = loaded_model        
-    # Get the 'serving_default' signature
-    signature = meta_graph.signature_def['serving_default']
-    
-    # Get input and output tensors
-    input_tensor = session.graph.get_tensor_by_name(signature.inputs['image_bytes'].name)
-    output_tensors = {name: session.graph.get_tensor_by_name(tensor_info.name) 
-                      for name, tensor_info in signature.outputs.items()}
-    
-    # Run inference
-    feed_dict = {input_tensor: [image_bytes]}
-    results = session.run(output_tensors, feed_dict=feed_dict)
-    
-    processed_results = process_model_output(results)
-    
+    return get_predictor(loaded_model, session).predict(image_path)
+
+
+def run_model_batch(loaded_model, session, images, batch_size=MARCO_BATCH_SIZE):
+    '''Batched version of :func:`run_model`. Feeds `batch_size` images
+    through the `serving_default` signature of the MARCO model with each
+    model call instead of one image per call, which cuts down
+    on the per call session overhead when classifying an entire plate.
+
+    :param loaded_model: Loaded MARCO model (meta graph)
+    :type loaded_model: MetaGraphDef
+    :param session: Session the MARCO model was loaded into
+    :type session: tf.Session
+    :param images: Image file paths and / or raw image bytes to classify
+    :type images: list
+    :param batch_size: Max number of images per model call,
+                       defaults to :const:`polo.MARCO_BATCH_SIZE`
+    :type batch_size: int, optional
+    :return: List of (classification, prediction dict) tuples, one for each
+             image in `images` and in the same order
+    :rtype: list
+    '''
+    processed_results = get_predictor(loaded_model, session).predict_batch(
+        images, batch_size)
+    logger.debug('Classified {} images in batches of {}'.format(
+        len(processed_results), batch_size))
+
     return processed_results
 
 
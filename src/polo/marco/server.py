@@ -0,0 +1,565 @@
+'''Shared MARCO inference server. Loads TensorFlow and the MARCO model once
+and classifies images for every Polo instance and
+:mod:`polo.classify` job on the machine, so several users on one analysis
+server do not each hold their own copy of the TF runtime. ::
+
+    python -m polo.marco.server --address unix:///tmp/marco.sock
+    python -m polo.marco.server --address http://127.0.0.1:8765
+
+Clients use the server when the ``POLO_MARCO_SERVER`` environment variable
+(:const:`polo.MARCO_SERVER_ADDRESS`) is set to its address, in which case
+:func:`~polo.marco.run_marco.get_predictor` returns a
+:class:`RemotePredictor` instead of loading the model. If the server cannot
+be reached the model is loaded locally as usual, and if it goes away while
+images are being classified the remaining images are classified locally.
+
+Requests from different clients that arrive within
+:const:`polo.MARCO_SERVER_MAX_WAIT` seconds of each other are run through
+the model together as one batch by a :class:`MicroBatcher`.
+
+The protocol is plain HTTP/1.1. ``POST /predict`` takes a body of images,
+each prefixed with its length as a 4 byte big endian integer, and returns
+json with the `classes` and `scores` of each image. ``GET /health`` returns
+the model version and request counts.
+'''
+import argparse
+import http.client
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from polo import (MARCO_SERVER_ADDRESS, MARCO_SERVER_MAX_BATCH,
+                  MARCO_SERVER_MAX_REQUEST_BYTES, MARCO_SERVER_MAX_WAIT,
+                  make_default_logger)
+from polo.marco.run_marco import Predictor, marco_model_version
+
+logger = make_default_logger(__name__)
+
+DEFAULT_ADDRESS = 'http://127.0.0.1:8765'
+
+
+def parse_address(address):
+    '''Split a server address into its scheme and location.
+
+    :param address: ``unix:///path/to/socket`` or ``http://host:port``
+    :type address: str
+    :raises ValueError: If the address uses another scheme
+    :return: Tuple of `unix` and the socket path or `http` and a
+             (host, port) tuple
+    :rtype: tuple
+    '''
+    parsed = urlparse(address)
+    if parsed.scheme == 'unix':
+        return 'unix', parsed.path
+    elif parsed.scheme == 'http':
+        port = parsed.port if parsed.port is not None else 80
+        return 'http', (parsed.hostname or '127.0.0.1', port)
+    raise ValueError('Unsupported MARCO server address {}'.format(address))
+
+
+def pack_images(images):
+    '''Encode a list of raw images as a request body.
+
+    :param images: Raw image bytes
+    :type images: list
+    :return: Length prefixed images
+    :rtype: bytes
+    '''
+    return b''.join(struct.pack('>I', len(i)) + i for i in images)
+
+
+def unpack_images(body):
+    '''Decode a request body made by :func:`pack_images`.
+
+    :param body: Request body
+    :type body: bytes
+    :raises ValueError: If the body is truncated
+    :return: Raw image bytes
+    :rtype: list
+    '''
+    images, offset = [], 0
+    while offset < len(body):
+        if offset + 4 > len(body):
+            raise ValueError('Truncated image length')
+        length = struct.unpack_from('>I', body, offset)[0]
+        offset += 4
+        if offset + length > len(body):
+            raise ValueError('Truncated image')
+        images.append(body[offset:offset+length])
+        offset += length
+    return images
+
+
+class MicroBatcher():
+    '''Collects images submitted by many request threads and runs them
+    through the model in shared batches on a single inference thread. A
+    batch is run as soon as it holds `max_batch` images or `max_wait`
+    seconds after its first request arrived.
+
+    :param predictor: Predictor holding the loaded model
+    :type predictor: Predictor
+    :param max_batch: Max images per model call, defaults to
+                      :const:`polo.MARCO_SERVER_MAX_BATCH`
+    :type max_batch: int, optional
+    :param max_wait: Max seconds to wait for a batch to fill, defaults to
+                     :const:`polo.MARCO_SERVER_MAX_WAIT`
+    :type max_wait: float, optional
+    '''
+
+    def __init__(self, predictor, max_batch=MARCO_SERVER_MAX_BATCH,
+                 max_wait=MARCO_SERVER_MAX_WAIT):
+        self.predictor = predictor
+        self.max_batch = max(int(max_batch), 1)
+        self.max_wait = max(float(max_wait), 0)
+        self.images = 0
+        self.batches = 0
+        self._requests = queue.Queue()
+        self._carried = None  # request that did not fit in the last batch
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name='MicroBatcher', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    @property
+    def pending(self):
+        '''Number of requests waiting to be put in a batch.
+
+        :return: Queued requests
+        :rtype: int
+        '''
+        return self._requests.qsize() + (self._carried is not None)
+
+    def infer(self, images):
+        '''Classify `images` as part of the next shared batches and block
+        until they are done. Safe to call from any thread.
+
+        :param images: Raw image bytes
+        :type images: list
+        :return: Classes and scores of each image, in order
+        :rtype: dict
+        '''
+        futures = []
+        for i in range(0, len(images), self.max_batch):
+            future = Future()
+            self._requests.put((images[i:i+self.max_batch], future))
+            futures.append(future)
+        output = {'classes': [], 'scores': []}
+        for future in futures:
+            result = future.result()
+            output['classes'] += result['classes']
+            output['scores'] += result['scores']
+        return output
+
+    def _next_batch(self):
+        '''Private method that waits for the first request and then collects
+        more until the batch is full or `max_wait` has passed.
+
+        :return: List of (images, future) requests
+        :rtype: list
+        '''
+        if self._carried is not None:
+            requests, self._carried = [self._carried], None
+        else:
+            try:
+                requests = [self._requests.get(timeout=0.5)]
+            except queue.Empty:
+                return []
+        size, deadline = len(requests[0][0]), time.monotonic() + self.max_wait
+        while size < self.max_batch:
+            try:
+                request = self._requests.get(
+                    timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if size + len(request[0]) > self.max_batch:
+                self._carried = request  # starts the next batch
+                break
+            requests.append(request)
+            size += len(request[0])
+        return requests
+
+    def _run(self):
+        while not self._stop.is_set():
+            requests = self._next_batch()
+            if not requests:
+                continue
+            batch = [image for images, _ in requests for image in images]
+            try:
+                output = self.predictor.infer(batch)
+                classes = [[c.decode('utf-8') for c in row]
+                           for row in output['classes']]
+                scores = [[float(s) for s in row] for row in output['scores']]
+            except Exception as e:
+                logger.error('Caught {} at {}'.format(e, self._run))
+                for _, future in requests:
+                    future.set_exception(e)
+                continue
+            self.images += len(batch)
+            self.batches += 1
+            start = 0
+            for images, future in requests:
+                future.set_result({
+                    'classes': classes[start:start+len(images)],
+                    'scores': scores[start:start+len(images)]
+                })
+                start += len(images)
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep connections open between batches
+
+    def address_string(self):
+        return str(self.client_address[0]) if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _send_json(self, status, content):
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/health':
+            batcher = self.server.batcher
+            self._send_json(200, {
+                'model_version': self.server.model_version,
+                'images': batcher.images, 'batches': batcher.batches,
+                'max_batch': batcher.max_batch
+            })
+        else:
+            self._send_json(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self._send_json(404, {'error': 'Not found'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            if length > MARCO_SERVER_MAX_REQUEST_BYTES:
+                self.close_connection = True  # the body is never read
+                self._send_json(413, {'error': 'Request of {} bytes is larger than {}'.format(
+                    length, MARCO_SERVER_MAX_REQUEST_BYTES)})
+                return
+            images = unpack_images(self.rfile.read(length))
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        try:
+            self._send_json(200, self.server.batcher.infer(images))
+        except Exception as e:
+            self._send_json(500, {'error': repr(e)})
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class MarcoServer():
+    '''Serves MARCO predictions over HTTP on a UNIX socket or a localhost
+    port. See the module documentation for the protocol.
+
+    :param address: Address to listen on, defaults to
+                    :const:`polo.MARCO_SERVER_ADDRESS` or
+                    :const:`DEFAULT_ADDRESS`. HTTP addresses with port 0
+                    listen on a free port and :attr:`address` is updated
+                    to it once the server has started.
+    :type address: str, optional
+    :param predictor: Predictor to classify images with, defaults to None
+                      (the predictor of the selected backend is loaded when
+                      the server starts, see :mod:`polo.marco.backends`)
+    :type predictor: Predictor, optional
+    :param max_batch: Max images per model call, defaults to
+                      :const:`polo.MARCO_SERVER_MAX_BATCH`
+    :type max_batch: int, optional
+    :param max_wait: Max seconds to wait for a batch to fill, defaults to
+                     :const:`polo.MARCO_SERVER_MAX_WAIT`
+    :type max_wait: float, optional
+    '''
+
+    def __init__(self, address=None, predictor=None,
+                 max_batch=MARCO_SERVER_MAX_BATCH, max_wait=MARCO_SERVER_MAX_WAIT):
+        self.address = address or MARCO_SERVER_ADDRESS or DEFAULT_ADDRESS
+        self.predictor = predictor
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.batcher = None
+        self._server = None
+        self._thread = None
+
+    def start(self, background=True):
+        '''Load the model if needed and start listening.
+
+        :param background: Serve requests on a background thread, defaults
+                           to True. If False this blocks until
+                           :meth:`shutdown` is called from another thread.
+        :type background: bool, optional
+        '''
+        if self.predictor is None:
+            from polo.marco.backends import get_backend_predictor
+            self.predictor = get_backend_predictor()
+        self.batcher = MicroBatcher(self.predictor, self.max_batch, self.max_wait)
+        self.batcher.start()
+        scheme, location = parse_address(self.address)
+        if scheme == 'unix':
+            if os.path.exists(location):
+                os.remove(location)  # left behind by a server that crashed
+            self._server = _UnixHTTPServer(location, _RequestHandler)
+        else:
+            self._server = ThreadingHTTPServer(location, _RequestHandler)
+            self._server.daemon_threads = True
+            # port 0 picks a free port, report the one actually bound
+            self.address = 'http://{}:{}'.format(*self._server.server_address[:2])
+        self._server.batcher = self.batcher
+        self._server.model_version = marco_model_version()
+        logger.info('MARCO server listening on {}'.format(self.address))
+        if background:
+            self._thread = threading.Thread(
+                target=self._server.serve_forever, name='MarcoServer',
+                daemon=True)
+            self._thread.start()
+        else:
+            self._server.serve_forever()
+
+    def shutdown(self):
+        '''Stop serving and release the socket.
+        '''
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            scheme, location = parse_address(self.address)
+            if scheme == 'unix' and os.path.exists(location):
+                os.remove(location)
+            self._server = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.batcher is not None:
+            self.batcher.stop()
+        logger.info('MARCO server on {} shut down'.format(self.address))
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, socket_path, timeout=None):
+        super(_UnixHTTPConnection, self).__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class RemotePredictor(Predictor):
+    '''Client for a :class:`MarcoServer`. Like every other
+    :class:`~polo.marco.run_marco.Predictor` it can be used anywhere a
+    local predictor is. Each thread keeps its own connection to
+    the server.
+
+    :param address: Address of the server, defaults to
+                    :const:`polo.MARCO_SERVER_ADDRESS`
+    :type address: str, optional
+    :param timeout: Seconds to wait for the server, defaults to 120
+    :type timeout: float, optional
+    :param fallback: Classify images with the local model instead of
+                     raising if the server can not be reached, defaults to
+                     False
+    :type fallback: bool, optional
+    '''
+
+    def __init__(self, address=MARCO_SERVER_ADDRESS, timeout=120, fallback=False):
+        self.address = address
+        self.timeout = timeout
+        self.fallback = fallback
+        self._scheme, self._location = parse_address(address)
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            if self._scheme == 'unix':
+                connection = _UnixHTTPConnection(self._location, self.timeout)
+            else:
+                connection = http.client.HTTPConnection(
+                    *self._location, timeout=self.timeout)
+            self._local.connection = connection
+        return connection
+
+    def _request(self, method, path, body=None):
+        '''Private method that sends one request to the server, reconnecting
+        once if the kept alive connection was closed.
+
+        :raises ConnectionError: If the server can not be reached or
+                                 returns an error
+        :return: Decoded json response
+        :rtype: dict
+        '''
+        for attempt in range(2):
+            connection = self._connection()
+            try:
+                connection.request(method, path, body=body)
+                response = connection.getresponse()
+                content = json.loads(response.read().decode('utf-8'))
+                break
+            except (OSError, ValueError, http.client.HTTPException) as e:
+                connection.close()
+                self._local.connection = None
+                if attempt:
+                    raise ConnectionError('MARCO server {} unreachable: {}'.format(
+                        self.address, e))
+        if response.status != 200:
+            raise ConnectionError('MARCO server {} returned {}: {}'.format(
+                self.address, response.status, content.get('error')))
+        return content
+
+    def health(self):
+        '''Ask the server for its status.
+
+        :return: Model version and request counts of the server
+        :rtype: dict
+        '''
+        return self._request('GET', '/health')
+
+    def infer(self, image_bytes):
+        '''Have the server run one batch of raw image bytes through the
+        model. The output has the same layout as the output of
+        :meth:`~polo.marco.run_marco.MarcoPredictor.infer` so it can be
+        passed to :func:`~polo.marco.run_marco.process_batch_output`.
+
+        With :attr:`fallback` set, images the server can not classify are
+        run through the local model instead and the server is not used
+        again, see :func:`get_remote_predictor`.
+
+        :param image_bytes: List of raw image bytes
+        :type image_bytes: list
+        :return: Model output keyed by output name
+        :rtype: dict
+        '''
+        try:
+            output = self._request('POST', '/predict', pack_images(image_bytes))
+        except ConnectionError as e:
+            if not self.fallback:
+                raise
+            logger.warning('Caught {} at {}, classifying locally'.format(
+                e, self.infer))
+            return _stop_using_remote_predictor().infer(image_bytes)
+        output['classes'] = [[c.encode('utf-8') for c in row]
+                             for row in output['classes']]
+        return output
+
+    def __repr__(self):
+        return '<RemotePredictor {}>'.format(self.address)
+
+
+_remote_predictor = None
+_remote_checked = False
+_remote_lock = threading.Lock()
+
+
+def _stop_using_remote_predictor():
+    '''Private function that makes :func:`get_remote_predictor` return None
+    from now on, after the server went away.
+
+    :return: Local predictor to use instead
+    :rtype: Predictor
+    '''
+    global _remote_predictor
+    with _remote_lock:
+        _remote_predictor = None
+    from polo.marco.backends import get_backend_predictor
+    return get_backend_predictor()
+
+
+def get_remote_predictor():
+    '''Return a :class:`RemotePredictor` for the server at
+    :const:`polo.MARCO_SERVER_ADDRESS` if one is configured and reachable.
+    The server is only checked the first time this is called, if it can
+    not be reached then Polo keeps using a locally loaded model. If it
+    stops responding later the predictor falls back to the local model.
+
+    :return: Predictor or None
+    :rtype: RemotePredictor
+    '''
+    global _remote_predictor, _remote_checked
+    if not MARCO_SERVER_ADDRESS:
+        return None
+    with _remote_lock:
+        if not _remote_checked:
+            _remote_checked = True
+            try:
+                predictor = RemotePredictor(MARCO_SERVER_ADDRESS, fallback=True)
+                server_version = predictor.health()['model_version']
+                if server_version != marco_model_version():
+                    logger.warning(
+                        'MARCO server model version {} differs from local {}'.format(
+                            server_version, marco_model_version()))
+                _remote_predictor = predictor
+                logger.info('Using MARCO server {}'.format(MARCO_SERVER_ADDRESS))
+            except (ConnectionError, ValueError) as e:
+                logger.warning('Caught {} at {}, loading model locally'.format(
+                    e, get_remote_predictor))
+    return _remote_predictor
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m polo.marco.server',
+        description='Serve MARCO predictions to Polo instances on this machine.')
+    parser.add_argument(
+        '-a', '--address', default=MARCO_SERVER_ADDRESS or DEFAULT_ADDRESS,
+        help='unix:///path/to/socket or http://127.0.0.1:port')
+    parser.add_argument(
+        '--backend', default=None,
+        help='Inference backend to serve, see polo.marco.backends')
+    parser.add_argument(
+        '--max-batch', type=int, default=MARCO_SERVER_MAX_BATCH,
+        help='Max images run through the model at once')
+    parser.add_argument(
+        '--max-wait', type=float, default=MARCO_SERVER_MAX_WAIT,
+        help='Max seconds to wait for more requests to fill a batch')
+    args = parser.parse_args(argv)
+
+    if args.backend:
+        from polo.marco.backends import set_backend
+        set_backend(args.backend)
+    server = MarcoServer(args.address, max_batch=args.max_batch,
+                         max_wait=args.max_wait)
+    server.start()
+    print('MARCO server listening on {}'.format(server.address), flush=True)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
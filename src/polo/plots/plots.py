@@ -170,17 +170,12 @@ class StaticCanvas(MplCanvas):
 
 
         try:
+            columns = current_run.columns
+            # images without a well number are left out of the map
+            in_plate = ~columns.present | (columns.well_number > 0)
             for k, image_type in enumerate(['Crystals', 'Precipitate', 'Clear', 'Other']):
-                data = []
-                for i, image in enumerate(current_run.images):
-                    if image and image.prediction_dict:
-                        confidence = image.prediction_dict[image_type]
-                        if image.well_number:
-                            data.append(confidence)
-                    else:
-                        data.append(0)
+                data = columns.prediction_column(image_type)[in_plate]
                 data = np.reshape(data, (48, 32))  # DANGER Assumes 1536 images
-                data = data.astype(np.float)
                 im = self.fig.get_axes()[k].imshow(data, cmap='hot')
                 self.fig.get_axes()[k].set_title(
                     '{} Confidence Map'.format(image_type))
@@ -345,15 +340,10 @@ class MplWidget(QtWidgets.QWidget):
         self.fig.add_subplot(143)
         self.fig.add_subplot(144)
 
+        columns = current_run.columns
+        in_plate = ~columns.present | (columns.well_number > 0)
         for k, image_type in enumerate(['Crystals', 'Precipitate', 'Clear', 'Other']):
-            data = []
-            for i, image in enumerate(current_run.images):
-                if image:
-                    confidence = image.prediction_dict[image_type]
-                    if image.well_number:
-                        data.append(confidence)
-                else:
-                    data.append(0)
+            data = columns.prediction_column(image_type)[in_plate]
             data = np.reshape(data, (48, 32))
             self.fig.get_axes()[k].imshow(data)
 
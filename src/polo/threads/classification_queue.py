@@ -0,0 +1,494 @@
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from polo import (IMAGE_SPECS, MARCO_CPU_BUDGET, MARCO_NUM_WORKERS,
+                  MARCO_SPECTRUM_AWARE, make_default_logger)
+from polo.threads.thread import ClassificationThread
+
+logger = make_default_logger(__name__)
+
+
+class ClassificationJob():
+    '''Request to classify one run, tracked by a :class:`ClassificationQueue`.
+
+    :param run: Run to classify
+    :type run: Run or HWIRun
+    :param force: Reclassify images that already have a current
+                  classification, defaults to False
+    :type force: bool, optional
+    '''
+
+    QUEUED, RUNNING, FINISHED, CANCELLED, FAILED, DEFERRED = (
+        'Queued', 'Running', 'Finished', 'Cancelled', 'Failed', 'Deferred')
+    PAUSED = 'Paused'  # shown in place of RUNNING while the thread is paused
+
+    def __init__(self, run, force=False):
+        self.run = run
+        self.force = force
+        self.state = ClassificationJob.QUEUED
+        self.done = 0
+        self.pending = 0
+        self.seconds_remaining = None
+        self.telemetry = {}  # latest telemetry of the job's thread
+        self.thread = None
+        self.exceptions = None
+
+    @property
+    def images_remaining(self):
+        '''Images of the run that still have to be run through the model.
+        Taken from the job's thread once it is running, before that it is
+        estimated from the images of the run that have no MARCO
+        classification (every image if :attr:`force` is set).
+
+        :return: Images remaining
+        :rtype: int
+        '''
+        if self.thread is not None:
+            return self.telemetry.get('remaining', self.pending - self.done)
+        if (MARCO_SPECTRUM_AWARE and hasattr(self.run, 'propagate_marco_classifications')
+                and self.run.image_spectrum
+                and self.run.image_spectrum != IMAGE_SPECS[0]):
+            return 0  # will take the classifications of a visible run
+        return len([i for i in self.run.images if i and not i.is_placeholder
+                    and (self.force or not i.machine_class)])
+
+    @property
+    def is_active(self):
+        '''True if the job is waiting to run or running.
+
+        :return: Active status
+        :rtype: bool
+        '''
+        return self.state in (ClassificationJob.QUEUED, ClassificationJob.RUNNING)
+
+    @property
+    def is_paused(self):
+        '''True if the job is running but its thread has been paused.
+
+        :return: Paused status
+        :rtype: bool
+        '''
+        return (self.state == ClassificationJob.RUNNING
+                and self.thread is not None and self.thread.is_paused)
+
+    @property
+    def status(self):
+        '''Short status string for displaying to the user.
+
+        :return: Status
+        :rtype: str
+        '''
+        if self.is_paused:
+            return ClassificationJob.PAUSED
+        elif self.state == ClassificationJob.RUNNING and self.pending:
+            return '{} / {}'.format(self.done, self.pending)
+        return self.state
+
+    def __repr__(self):
+        return '<ClassificationJob {} {}>'.format(
+            getattr(self.run, 'run_name', self.run), self.status)
+
+
+class ClassificationQueue(QObject):
+    '''Queue of runs waiting to be classified by MARCO. Runs are
+    classified concurrently by :class:`~polo.threads.thread.ClassificationThread`
+    instances, as many at a time as fit in `cpu_budget` when each is given
+    `workers_per_job` cores. The TF threads of each job's worker processes
+    are limited so concurrent jobs do not oversubscribe the machine.
+
+    Queued runs can be cancelled or reordered, running runs can be paused
+    and resumed and every job reports its progress through the
+    :const:`job_progress` signal.
+
+    Non-visible spectrum runs that are left for the classifications of a
+    visible run are kept in :attr:`deferred_jobs` until that run has been
+    classified, see :meth:`defer` and :meth:`resolve_deferred`.
+
+    :param cpu_budget: Cores to share between concurrent jobs, defaults to
+                       :const:`polo.MARCO_CPU_BUDGET`
+    :type cpu_budget: int, optional
+    :param workers_per_job: Worker processes per job, defaults to
+                            :const:`polo.MARCO_NUM_WORKERS`
+    :type workers_per_job: int, optional
+    :param parent: Parent QObject, defaults to None
+    :type parent: QObject, optional
+    '''
+    job_added = pyqtSignal(object)
+    job_started = pyqtSignal(object)
+    job_progress = pyqtSignal(object)
+    job_finished = pyqtSignal(object)
+    images_classified = pyqtSignal(list)
+    queue_empty = pyqtSignal()
+
+    def __init__(self, cpu_budget=MARCO_CPU_BUDGET,
+                 workers_per_job=MARCO_NUM_WORKERS, parent=None):
+        super(ClassificationQueue, self).__init__(parent)
+        self.cpu_budget = max(int(cpu_budget), 1)
+        self.workers_per_job = max(int(workers_per_job), 1)
+        self.jobs = []  # active jobs, running and then queued in order
+        self.completed_jobs = []  # jobs finished since the queue was last empty
+        self.deferred_jobs = []  # waiting for the classifications of a visible run
+        self._priority_images = []
+
+    @property
+    def max_concurrent_jobs(self):
+        '''Number of jobs that can run at the same time within
+        :attr:`cpu_budget`.
+
+        :return: Max concurrent jobs
+        :rtype: int
+        '''
+        return max(1, self.cpu_budget // self.workers_per_job)
+
+    @property
+    def threads_per_worker(self):
+        '''TF intra op threads given to each worker process of a job.
+
+        :return: Threads per worker
+        :rtype: int
+        '''
+        return max(1, self.cpu_budget // (
+            self.max_concurrent_jobs * self.workers_per_job))
+
+    @property
+    def running_jobs(self):
+        return [j for j in self.jobs if j.state == ClassificationJob.RUNNING]
+
+    @property
+    def queued_jobs(self):
+        return [j for j in self.jobs if j.state == ClassificationJob.QUEUED]
+
+    @property
+    def is_empty(self):
+        return not self.jobs
+
+    @property
+    def progress(self):
+        '''Images classified and images to classify summed over the active
+        jobs and the jobs completed since the queue was last empty.
+
+        :return: Tuple of images classified and images to classify
+        :rtype: tuple
+        '''
+        jobs = self.jobs + self.completed_jobs
+        return sum(j.done for j in jobs), sum(j.pending for j in jobs)
+
+    @property
+    def seconds_remaining(self):
+        '''Estimate of the time until every active job, running or queued,
+        is finished. The images remaining in all active jobs are divided by
+        the combined throughput of the running jobs, but the estimate is
+        never shorter than the longest estimate of a single running job.
+
+        :return: Seconds remaining or None if there is no estimate yet
+        :rtype: float
+        '''
+        estimates = [j.seconds_remaining for j in self.running_jobs
+                     if j.seconds_remaining is not None]
+        if not estimates:
+            return None
+        rate = self.images_per_second
+        if not rate:
+            return max(estimates)
+        remaining = sum(j.images_remaining for j in self.jobs)
+        return max(max(estimates), remaining / rate)
+
+    @property
+    def images_per_second(self):
+        '''Combined smoothed throughput of the running jobs.
+
+        :return: Images per second or None if no job has reported yet
+        :rtype: float
+        '''
+        rates = [j.telemetry.get('images_per_second') for j in self.running_jobs]
+        rates = [r for r in rates if r]
+        return sum(rates) if rates else None
+
+    def job_for(self, run):
+        '''Return the active job classifying `run`, if any.
+
+        :param run: Run to look for
+        :type run: Run or HWIRun
+        :return: Job or None
+        :rtype: ClassificationJob
+        '''
+        for job in self.jobs:
+            if job.run is run:
+                return job
+
+    def deferred_job_for(self, run):
+        '''Return the deferred job of `run`, if any.
+
+        :param run: Run to look for
+        :type run: Run or HWIRun
+        :return: Job or None
+        :rtype: ClassificationJob
+        '''
+        for job in self.deferred_jobs:
+            if job.run is run:
+                return job
+
+    def defer(self, run, force=False):
+        '''Record that `run` will be classified by copying the
+        classifications of a visible run that has not been classified, or
+        not been imported, yet. The job is finished by
+        :meth:`resolve_deferred` once `run` has been given classifications.
+
+        :param run: Non-visible spectrum run
+        :type run: HWIRun
+        :param force: Reclassify images that already have a current
+                      classification, defaults to False
+        :type force: bool, optional
+        :return: Deferred job of `run`
+        :rtype: ClassificationJob
+        '''
+        job = self.deferred_job_for(run)
+        if not job:
+            job = ClassificationJob(run, force)
+            job.state = ClassificationJob.DEFERRED
+            self.deferred_jobs.append(job)
+            logger.debug('Deferred {}'.format(job))
+        return job
+
+    def resolve_deferred(self):
+        '''Finish every deferred job whose run has been given classifications
+        since it was deferred, for example by
+        :meth:`~polo.crystallography.run.HWIRun.propagate_marco_classifications`
+        once the visible run of the same sample was classified.
+        :const:`job_finished` is emitted for each of them.
+
+        :return: Jobs that were finished
+        :rtype: list
+        '''
+        resolved = [j for j in self.deferred_jobs
+                    if j.run.has_been_machine_classified]
+        for job in resolved:
+            self.deferred_jobs.remove(job)
+            job.state = ClassificationJob.FINISHED
+            logger.debug('Resolved {}'.format(job))
+            self.job_finished.emit(job)
+        return resolved
+
+    def add(self, run, force=False):
+        '''Queue `run` for classification and start it if there is room in
+        the CPU budget. If the run is already queued or running its existing
+        job is returned.
+
+        :param run: Run to classify
+        :type run: Run or HWIRun
+        :param force: Reclassify images that already have a current
+                      classification, defaults to False
+        :type force: bool, optional
+        :return: Job for the run
+        :rtype: ClassificationJob
+        '''
+        job = self.job_for(run)
+        if job:
+            return job
+        if self.is_empty:
+            self.completed_jobs = []
+        job = ClassificationJob(run, force)
+        self.jobs.append(job)
+        logger.debug('Queued {}'.format(job))
+        self.job_added.emit(job)
+        self._start_jobs()
+        return job
+
+    def cancel(self, run):
+        '''Cancel the job of `run`. Queued and deferred jobs are removed
+        straight away, running jobs stop after their current batch.
+
+        :param run: Run to stop classifying
+        :type run: Run or HWIRun
+        :return: True if the run had an active job
+        :rtype: bool
+        '''
+        job = self.job_for(run)
+        deferred_job = self.deferred_job_for(run)
+        if deferred_job:
+            self.deferred_jobs.remove(deferred_job)
+            deferred_job.state = ClassificationJob.CANCELLED
+            self.job_finished.emit(deferred_job)
+        if not job:
+            return bool(deferred_job)
+        if job.state == ClassificationJob.RUNNING:
+            job.thread.cancel()
+        else:
+            self.jobs.remove(job)
+            job.state = ClassificationJob.CANCELLED
+            self._finish(job)
+        return True
+
+    def pause(self, run):
+        '''Pause the running job of `run` after its current batch. The job
+        keeps its share of the CPU budget while paused.
+
+        :param run: Run to pause
+        :type run: Run or HWIRun
+        :return: True if the run had a running job
+        :rtype: bool
+        '''
+        job = self.job_for(run)
+        if not job or job.state != ClassificationJob.RUNNING:
+            return False
+        job.thread.pause()
+        return True
+
+    def resume(self, run):
+        '''Resume the paused job of `run`.
+
+        :param run: Run to resume
+        :type run: Run or HWIRun
+        :return: True if the run had a paused job
+        :rtype: bool
+        '''
+        job = self.job_for(run)
+        if not job or not job.is_paused:
+            return False
+        job.thread.resume()
+        return True
+
+    def cancel_all(self):
+        '''Cancel every active job.
+        '''
+        for job in list(self.jobs):
+            self.cancel(job.run)
+
+    def move(self, run, index):
+        '''Move the queued job of `run` to position `index` among the
+        queued jobs, 0 being the next job to start.
+
+        :param run: Run whose job to move
+        :type run: Run or HWIRun
+        :param index: New position in the queue
+        :type index: int
+        :return: True if the job was moved
+        :rtype: bool
+        '''
+        job = self.job_for(run)
+        if not job or job.state != ClassificationJob.QUEUED:
+            return False
+        queued = self.queued_jobs
+        queued.remove(job)
+        queued.insert(max(0, index), job)
+        self.jobs = self.running_jobs + queued
+        logger.debug('Moved {} to queue position {}'.format(job, index))
+        return True
+
+    def move_to_front(self, run):
+        '''Make the job of `run` the next one to start.
+
+        :param run: Run whose job to move
+        :type run: Run or HWIRun
+        :return: True if the job was moved
+        :rtype: bool
+        '''
+        return self.move(run, 0)
+
+    def prioritize(self, images):
+        '''Pass images the user is looking at on to every running job, see
+        :meth:`~polo.threads.thread.ClassificationThread.prioritize`. The
+        images are remembered so jobs started later also begin with them.
+
+        :param images: Images currently shown to the user
+        :type images: list
+        '''
+        self._priority_images = list(images)
+        for job in self.running_jobs:
+            job.thread.prioritize(self._priority_images)
+
+    def wait(self):
+        '''Block until every running classification thread has exited.
+        '''
+        for job in self.running_jobs:
+            job.thread.wait()
+
+    def _start_jobs(self):
+        '''Private method that starts queued jobs until the CPU budget is
+        used up.
+        '''
+        while (self.queued_jobs
+               and len(self.running_jobs) < self.max_concurrent_jobs):
+            self._start_job(self.queued_jobs[0])
+
+    def _start_job(self, job):
+        '''Private method that creates and starts the classification thread
+        of `job`.
+
+        :param job: Job to start
+        :type job: ClassificationJob
+        '''
+        job.thread = ClassificationThread(
+            job.run, num_workers=self.workers_per_job, force=job.force,
+            intra_op_threads=self.threads_per_worker)
+        job.thread.prioritize(self._priority_images)
+        job.thread.pending_count.connect(
+            lambda pending: self._set_job_pending(job, pending))
+        job.thread.change_value.connect(
+            lambda done: self._set_job_done(job, done))
+        job.thread.telemetry.connect(
+            lambda telemetry: self._set_job_telemetry(job, telemetry))
+        job.thread.images_classified.connect(self.images_classified.emit)
+        job.thread.paused.connect(lambda _: self.job_progress.emit(job))
+        job.thread.finished.connect(lambda: self._job_thread_finished(job))
+        job.state = ClassificationJob.RUNNING
+        job.thread.start()
+        logger.debug('Started {}'.format(job))
+        self.job_started.emit(job)
+
+    def _set_job_pending(self, job, pending):
+        job.pending = pending
+        self.job_progress.emit(job)
+
+    def _set_job_done(self, job, done):
+        job.done = done
+        self.job_progress.emit(job)
+
+    def _set_job_telemetry(self, job, telemetry):
+        job.telemetry = telemetry
+        if job.state == ClassificationJob.RUNNING:
+            job.seconds_remaining = telemetry.get('seconds_remaining')
+            self.job_progress.emit(job)
+
+    def _job_thread_finished(self, job):
+        '''Private method called when the thread of `job` exits.
+
+        :param job: Job whose thread finished
+        :type job: ClassificationJob
+        '''
+        if job.thread.exceptions:
+            job.state = ClassificationJob.FAILED
+            job.exceptions = job.thread.exceptions
+        elif job.thread.is_cancelled:
+            job.state = ClassificationJob.CANCELLED
+        elif job.thread.deferred and not job.run.has_been_machine_classified:
+            job.state = ClassificationJob.DEFERRED
+            if not self.deferred_job_for(job.run):
+                self.deferred_jobs.append(job)
+        else:
+            job.state = ClassificationJob.FINISHED
+        if job in self.jobs:
+            self.jobs.remove(job)
+        if job.state == ClassificationJob.DEFERRED:
+            # only finished by resolve_deferred, so it is reported once
+            job.seconds_remaining = None
+            self.job_progress.emit(job)
+            if self.is_empty:
+                self.queue_empty.emit()
+        else:
+            self._finish(job)
+        if job.state == ClassificationJob.FINISHED:
+            self.resolve_deferred()
+        self._start_jobs()
+
+    def _finish(self, job):
+        '''Private method that records a job that is no longer active.
+
+        :param job: Finished, failed or cancelled job
+        :type job: ClassificationJob
+        '''
+        job.seconds_remaining = None
+        self.completed_jobs.append(job)
+        logger.debug('{} left the classification queue'.format(job))
+        self.job_finished.emit(job)
+        if self.is_empty:
+            self.queue_empty.emit()
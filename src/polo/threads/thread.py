@@ -1,4 +1,6 @@
+import json
 import os
+import threading
 import time
 
 from PyQt5 import QtWidgets
@@ -7,8 +9,18 @@ from PyQt5.QtGui import *
 from PyQt5.QtGui import QBrush, QColor, QIcon, QPixmap
 from PyQt5.QtWidgets import *
 
-from polo import BLANK_IMAGE, make_default_logger
+from polo import (BLANK_IMAGE, IMAGE_SPECS, MARCO_BATCH_SIZE,
+                  MARCO_NUM_WORKERS, MARCO_PREFETCH_DEPTH,
+                  MARCO_SPECTRUM_AWARE, make_default_logger)
+from polo.marco.cache import file_source_key, get_prediction_cache
+from polo.marco.checkpoint import ClassificationJournal
+from polo.marco.pipeline import (PrefetchPipeline, PriorityBatchQueue,
+                                 StageTimer, ThroughputMeter)
+from polo.marco.pool import ClassificationPool
+from polo.marco.run_marco import get_predictor, marco_model_version
+from polo.marco.server import get_remote_predictor
 from polo.utils.math_utils import best_aspect_ratio, get_cell_image_dims
+from polo.utils.thumbnail_utils import get_thumbnail_cache, load_full_size
 
 logger = make_default_logger(__name__)
 
@@ -88,55 +100,479 @@ class QuickThread(thread):
 class ClassificationThread(thread):
     '''Thread that is specifically for classifying images using the MARCO
     model. This is a very CPU intensive process so it cannot be run on
-    the GUI thread. 
+    the GUI thread. If more than one worker is requested images are
+    classified by a :class:`~polo.marco.pool.ClassificationPool` and results
+    are streamed back to this thread as they finish, otherwise they are
+    classified on this thread through a
+    :class:`~polo.marco.pipeline.PrefetchPipeline` which reads upcoming images
+    from disk while the current batch is being classified. Images are taken
+    from a :class:`~polo.marco.pipeline.PriorityBatchQueue` so the images
+    the user is currently looking at can be moved to the front with
+    :meth:`prioritize`.
 
     :param run_object: Run who's images are to be classified
     :type run_object: Run or HWIRun
+    :param batch_size: Number of images to feed to MARCO at once,
+                       defaults to :const:`polo.MARCO_BATCH_SIZE`
+    :type batch_size: int, optional
+    :param num_workers: Number of worker processes to classify with,
+                        defaults to :const:`polo.MARCO_NUM_WORKERS`
+    :type num_workers: int, optional
+    :param queue_depth: Max number of batches read ahead of the model when
+                        classifying on this thread, defaults to
+                        :const:`polo.MARCO_PREFETCH_DEPTH`
+    :type queue_depth: int, optional
+    :param use_cache: Take predictions for images that have been classified
+                      before from the :class:`~polo.marco.cache.PredictionCache`
+                      and store new predictions in it, defaults to True
+    :type use_cache: bool, optional
+    :param incremental: Only classify images that have no MARCO
+                        classification yet or that were classified by a
+                        different model version, defaults to True
+    :type incremental: bool, optional
+    :param force: Reclassify every image by running the model again, even if
+                  it already has a current classification or is in the
+                  prediction cache, defaults to False
+    :type force: bool, optional
+    :param intra_op_threads: TF threads each worker process may use, defaults
+                             to None (split the machine's cores evenly between
+                             the workers)
+    :type intra_op_threads: int, optional
+    :param spectrum_aware: Only run MARCO on visible spectrum runs and copy
+                           the classifications to the linked non-visible runs,
+                           see
+                           :meth:`~polo.crystallography.run.HWIRun.propagate_marco_classifications`.
+                           Non-visible runs are not classified and
+                           :attr:`deferred` is set instead. Defaults to
+                           :const:`polo.MARCO_SPECTRUM_AWARE`
+    :type spectrum_aware: bool, optional
+    :param checkpoint: Record every prediction in a
+                       :class:`~polo.marco.checkpoint.ClassificationJournal`
+                       as it is made and start by restoring the predictions
+                       of an interrupted earlier classification of the run,
+                       defaults to True
+    :type checkpoint: bool, optional
     '''
     change_value = pyqtSignal(int)
     estimated_time = pyqtSignal(float, int)
+    stage_timings = pyqtSignal(dict)
+    telemetry = pyqtSignal(dict)
+    pending_count = pyqtSignal(int)
+    images_classified = pyqtSignal(list)
+    paused = pyqtSignal(bool)
 
-    def __init__(self, run_object, parent=None):
+    def __init__(self, run_object, batch_size=MARCO_BATCH_SIZE,
+                 num_workers=MARCO_NUM_WORKERS, queue_depth=MARCO_PREFETCH_DEPTH,
+                 use_cache=True, incremental=True, force=False,
+                 intra_op_threads=None, spectrum_aware=MARCO_SPECTRUM_AWARE,
+                 checkpoint=True, parent=None):
         super(ClassificationThread, self).__init__(parent)
         self.classification_run = run_object
+        self.batch_size = max(int(batch_size), 1)
+        self.num_workers = max(int(num_workers), 1)
+        self.queue_depth = max(int(queue_depth), 1)
+        self.use_cache = use_cache
+        self.incremental = incremental
+        self.force = force
+        self.intra_op_threads = intra_op_threads
+        self.spectrum_aware = spectrum_aware
+        self.deferred = False  # True if left for the linked visible run
+        self.marco_version = marco_model_version()
+        self.timer = StageTimer()
+        self.meter = ThroughputMeter()
+        self.queue = PriorityBatchQueue()
+        self._priority_images = []
+        self.journal = ClassificationJournal(run_object) if checkpoint else None
+        self._cancel_event = threading.Event()
+        self._resume_event = threading.Event()  # cleared while paused
+        self._resume_event.set()
         self.exceptions = None
         logger.debug('Created classification thread {}'.format(self))
 
+    @property
+    def is_cancelled(self):
+        '''True if :meth:`cancel` has been called.
+
+        :return: Cancelled status
+        :rtype: bool
+        '''
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        '''Ask the thread to stop classifying. The batch currently being
+        classified is finished and kept, then the thread exits without
+        marking the run as classified. Safe to call from any thread.
+        '''
+        self._cancel_event.set()
+        self._resume_event.set()  # a paused thread has to wake up to exit
+        logger.debug('Cancelling {}'.format(self))
+
+    @property
+    def is_paused(self):
+        '''True if :meth:`pause` has been called and the thread has not been
+        resumed since.
+
+        :return: Paused status
+        :rtype: bool
+        '''
+        return not self._resume_event.is_set()
+
+    def pause(self):
+        '''Ask the thread to stop classifying until :meth:`resume` is
+        called. The batch currently being classified is finished first.
+        Worker processes and the model stay loaded so resuming is instant.
+        Safe to call from any thread.
+        '''
+        if not self.is_paused and not self.is_cancelled:
+            self._resume_event.clear()
+            self.paused.emit(True)
+            logger.debug('Pausing {}'.format(self))
+
+    def resume(self):
+        '''Continue classifying after :meth:`pause`. Safe to call from any
+        thread.
+        '''
+        if self.is_paused:
+            self._resume_event.set()
+            self.paused.emit(False)
+            logger.debug('Resuming {}'.format(self))
+
+    def _is_alt_spectrum_run(self):
+        '''Private method that checks if :attr:`classification_run` contains
+        images taken with something other than visible light and can be
+        given classifications from a linked visible run.
+
+        :return: True if the run is a non-visible spectrum run
+        :rtype: bool
+        '''
+        run = self.classification_run
+        return (hasattr(run, 'propagate_marco_classifications')
+                and run.image_spectrum
+                and run.image_spectrum != IMAGE_SPECS[0])
+
+    def _pending_images(self):
+        '''Private method that returns the images of the
+        :attr:`classification_run` that need to be classified. In
+        incremental mode this only includes images that
+        :meth:`~polo.crystallography.image.Image.needs_classification`,
+        otherwise (or if :attr:`force` is set) it is every image
+        that is not a placeholder.
+
+        :return: List of images to classify
+        :rtype: list
+        '''
+        if self.incremental and not self.force:
+            return [image for image in self.classification_run.images
+                    if image and image.needs_classification(self.marco_version)]
+        else:
+            return [image for image in self.classification_run.images
+                    if image and not image.is_placeholder]
+
+    def _apply_cached_predictions(self, images):
+        '''Private method that sets the MARCO classification of every image in
+        `images` that is already in the prediction cache. Image files are
+        looked up by their :func:`~polo.marco.cache.file_source_key` so
+        nothing is read before classification starts; files the cache has
+        not seen are hashed by the pipeline as it reads them for the model.
+
+        :param images: Images to look up
+        :type images: list
+        :return: Images that were not in the cache and still need to be
+                 classified
+        :rtype: list
+        '''
+        cache = get_prediction_cache()
+        with self.timer.time('cache', len(images)):
+            sources = [file_source_key(image.path) for image in images]
+            content_keys = cache.get_source_keys(sources)
+            cached = cache.get_many(content_keys.values())
+        uncached = []
+        for image, source in zip(images, sources):
+            key = content_keys.get(source)
+            if key in cached:
+                image.set_marco_classification(*cached[key], self.marco_version)
+            else:
+                uncached.append(image)
+        logger.debug('Found {} of {} images in the prediction cache'.format(
+            len(images) - len(uncached), len(images)))
+        return uncached
+
+    def _cache_predictions(self, images, results, keys):
+        '''Private method that stores newly made predictions in the
+        prediction cache.
+
+        :param images: Images that were classified
+        :type images: list
+        :param results: (classification, prediction dict) tuple for each image
+        :type results: list
+        :param keys: Content key of each image, computed when it was read
+        :type keys: list
+        '''
+        cache = get_prediction_cache()
+        cache.put_many(
+            (key, machine_class, prediction_dict)
+            for key, (machine_class, prediction_dict) in zip(keys, results)
+        )
+        cache.put_source_keys(
+            (file_source_key(image.path), key) for image, key in zip(images, keys))
+
+    def _classify_on_thread(self):
+        '''Private method that classifies the images in :attr:`queue` in
+        batches on this thread.
+
+        :yield: Tuple of classified images, their (classification,
+                prediction dict) results and their content keys
+        :rtype: tuple
+        '''
+        pipeline = PrefetchPipeline(
+            get_predictor(), self.batch_size, queue_depth=self.queue_depth,
+            timer=self.timer)
+        yield from pipeline.classify_queue(
+            self.queue, key=lambda i: i.path, hash_content=True)
+
+    def _classify_with_pool(self):
+        '''Private method that classifies the images in :attr:`queue` using a
+        :class:`~polo.marco.pool.ClassificationPool`.
+
+        :yield: Tuple of classified images, their (classification,
+                prediction dict) results and their content keys
+        :rtype: tuple
+        '''
+        with ClassificationPool(self.num_workers, self.batch_size,
+                                intra_op_threads=self.intra_op_threads,
+                                timer=self.timer) as pool:
+            yield from pool.classify_queue(
+                self.queue, key=lambda i: i.path, hash_content=True)
+
+    def _telemetry(self, pending, remaining, **kwargs):
+        '''Private method that collects the current throughput numbers of
+        the thread.
+
+        :param pending: Images that needed classification when the thread
+                        started
+        :type pending: int
+        :param remaining: Images that still have to be run through the model
+        :type remaining: int
+        :return: Telemetry with the smoothed and mean images per second, the
+                 estimated seconds remaining, the stage timings and any
+                 extra keyword arguments
+        :rtype: dict
+        '''
+        rate, mean_rate = self.meter.rate, self.meter.mean_rate
+        seconds_remaining = self.meter.seconds_remaining(remaining)
+        return dict(
+            run=self.classification_run.run_name,
+            pending=pending,
+            done=pending - remaining,
+            remaining=remaining,
+            images_per_second=round(rate, 3) if rate else None,
+            mean_images_per_second=round(mean_rate, 3) if mean_rate else None,
+            seconds_remaining=(round(seconds_remaining, 1)
+                               if seconds_remaining is not None else None),
+            inference_seconds=round(self.meter.elapsed, 3),
+            stages=self.timer.summary(),
+            **kwargs
+        )
+
+    def prioritize(self, images):
+        '''Classify `images` before the rest of the run. Meant to be called
+        with the images the user is currently looking at, for example the
+        wells visible in the plate viewer, so they are classified first and
+        reported through :const:`images_classified` as soon as they are done.
+        Images that are not part of the run or have already been classified
+        are ignored. Safe to call from any thread.
+
+        :param images: Images to move to the front of the queue
+        :type images: list
+        '''
+        self._priority_images = list(images)
+        moved = self.queue.prioritize(self._priority_images)
+        if moved:
+            logger.debug('Moved {} images to the front of {}'.format(
+                moved, self))
+
     def run(self):
-        '''Method that actually does the classification work. Emits the the
-        :const:`change_value` signal everytime an image is classified. This is primary
-        to update the progress bar widget in the `RunOrganizer` widget to
-        notify the user how many images have been classified. Additionally,
-        every five images classified the :const:`estimated_time` signal is emitted
-        which includes a tuple that contains as the first item the time in
-        seconds it took to classify the last five images and the number
-        of images that remain to be classified as the second item. This allows
-        for making an estimate on about how much time remains in until the
-        thread finishes.
+        '''Method that actually does the classification work. Images are
+        sent to the MARCO model in batches of
+        :attr:`~polo.threads.thread.ClassificationThread.batch_size`. Emits
+        the :const:`change_value` signal everytime a batch is classified.
+        This is primary to update the progress bar widget in the
+        `RunOrganizer` widget to notify the user how many images have been
+        classified. The number of images that will be classified is emitted
+        through the :const:`pending_count` signal before classification
+        starts and :const:`change_value` counts up to it. Additionally, after
+        each batch the :const:`estimated_time` signal is emitted which includes
+        as the first item the time in seconds it takes to classify one image,
+        taken from the moving average of :attr:`meter`, and the number of
+        images that remain to be classified as the second item. The full
+        numbers, including stage timings, are emitted through
+        :const:`telemetry` and a summary of the whole run is logged and
+        emitted through :const:`telemetry` once more when the thread is done
+        with `finished` set. Classification stops early if :meth:`cancel` is
+        called and waits between batches while the thread is paused, see
+        :meth:`pause`. With :attr:`journal` set, predictions of an earlier
+        interrupted classification are restored first and every new batch
+        is recorded in the journal.
         '''
         try:
             start_time = time.time()
-            for i, image in enumerate(self.classification_run.images):
-                s = time.time()
-                if image and not image.is_placeholder:
-                    image.classify_image()
-                self.change_value.emit(i+1)
-                if i % 5 == 0:
-                    e = time.time()
-                    self.estimated_time.emit(
-                        e-s, len(self.classification_run.images)-(i+1))
+            if self.spectrum_aware and self._is_alt_spectrum_run():
+                # classifications come from the visible run instead
+                self.deferred = True
+                self.pending_count.emit(0)
+                logger.debug('Deferred classification of {}'.format(
+                    self.classification_run))
+                return
+            if self.journal and self.force:
+                self.journal.clear()
+            elif self.journal:
+                restored = self.journal.restore(
+                    self.classification_run, self.marco_version)
+                if restored:
+                    self.images_classified.emit(restored)
+            images = self._pending_images()
+            pending = len(images)
+            self.pending_count.emit(pending)
+            if self.use_cache and not self.force:
+                uncached = self._apply_cached_predictions(images)
+                if len(uncached) < len(images):
+                    uncached_ids = set(id(i) for i in uncached)
+                    self.images_classified.emit(
+                        [i for i in images if id(i) not in uncached_ids])
+                images = uncached
+            remaining = len(images)
+            self.change_value.emit(pending - remaining)
+            self.queue.extend(images)
+            self.queue.prioritize(self._priority_images)
+            if (self.num_workers > 1 and len(images) > self.batch_size
+                and get_remote_predictor() is None):
+                classifier = self._classify_with_pool()
+            else:
+                classifier = self._classify_on_thread()
+            self.meter.restart_clock()
+            for batch, results, keys in classifier:
+                with self.timer.time('post-process', 0):
+                    for image, (machine_class, prediction_dict) in zip(batch, results):
+                        image.set_marco_classification(
+                            machine_class, prediction_dict, self.marco_version)
+                    if self.use_cache:
+                        self._cache_predictions(batch, results, keys)
+                    if self.journal:
+                        self.journal.record(batch, self.marco_version)
+                remaining -= len(batch)
+                rate = self.meter.update(len(batch))
+                self.images_classified.emit(list(batch))
+                self.change_value.emit(pending - remaining)
+                self.estimated_time.emit(1 / rate, remaining)
+                self.telemetry.emit(self._telemetry(pending, remaining))
+                if self.is_paused:
+                    self._resume_event.wait()
+                    self.meter.restart_clock()  # time paused is not inference
+                if self.is_cancelled:
+                    classifier.close()  # stops readers or worker processes
+                    break
             end_time = time.time()
-            self.classification_run.has_been_machine_classified = True
+            if self.journal and self.is_cancelled:
+                self.journal.mark_cancelled()
+            elif self.journal:
+                self.journal.clear()
+            if not self.is_cancelled:
+                self.classification_run.has_been_machine_classified = True
+                if self.spectrum_aware and hasattr(
+                        self.classification_run, 'propagate_marco_classifications'):
+                    propagated = self.classification_run.propagate_marco_classifications()
+                    if propagated:
+                        self.images_classified.emit(propagated)
             logger.debug(
-                'Classified {} images in {} minutes'.format(
-                len(self.classification_run.images), round((end_time - start_time) / 60), 2)
+                'Classified {} of {} pending images in {} minutes'.format(
+                len(images) - remaining, pending,
+                round((end_time - start_time) / 60, 2))
                 )
+            summary = self._telemetry(
+                pending, remaining, finished=True,
+                cancelled=self.is_cancelled, model_images=len(images),
+                seconds=round(end_time - start_time, 3))
+            logger.info('Classification summary {}'.format(json.dumps(summary)))
+            self.stage_timings.emit(summary['stages'])
+            self.telemetry.emit(summary)
         except Exception as e:
             self.change_value.emit(0)  # reset the progress bar
             logger.error('Caught {} at {}'.format(e, self.run))
             self.exceptions = e
 
 
+class MarcoWarmupThread(thread):
+    '''Thread that loads TensorFlow and the MARCO model in the background
+    so the first classification request does not have to wait for it. Polo
+    starts one right after the main window is shown, see
+    :const:`polo.MARCO_WARMUP_ON_START`.
+    '''
+
+    def __init__(self, parent=None):
+        super(MarcoWarmupThread, self).__init__(parent)
+        self.exceptions = None
+
+    def run(self):
+        try:
+            start_time = time.time()
+            get_predictor()  # loads the model, unless using a MARCO server
+            logger.debug('Warmed up MARCO in {} seconds'.format(
+                round(time.time() - start_time, 2)))
+        except Exception as e:
+            logger.error('Caught {} at {}'.format(e, self.run))
+            self.exceptions = e
+
+
+class ImageLoaderSignals(QObject):
+    '''Signals of an :class:`ImageLoader`, which as a :class:`QRunnable` can
+    not have signals of its own.
+    '''
+    loaded = pyqtSignal(object, int, list)
+
+
+class ImageLoader(QRunnable):
+    '''Task that decodes a chunk of images on a :class:`QThreadPool`, as
+    thumbnails from the shared
+    :class:`~polo.utils.thumbnail_utils.ThumbnailCache` or at full size.
+    When it is done the :const:`signals.loaded` signal is emitted with `key`,
+    `start` and the list of
+    :class:`~polo.utils.thumbnail_utils.Thumbnail` instances, None for any
+    image that could not be read.
+
+    :param key: Anything identifying what the images are loaded for, passed
+                along with the results
+    :type key: object
+    :param start: Index of the first image of the chunk in whatever the
+                  images are loaded for, passed along with the results
+    :type start: int
+    :param images: Images to load
+    :type images: list
+    :param size: Thumbnail tier to load, defaults to None (full size)
+    :type size: int, optional
+    '''
+
+    def __init__(self, key, start, images, size=None):
+        super(ImageLoader, self).__init__()
+        self.signals = ImageLoaderSignals()
+        self.key = key
+        self.start = start
+        self.images = images
+        self.size = size
+        self.setAutoDelete(True)
+
+    def run(self):
+        try:
+            if self.size:
+                thumbnails = get_thumbnail_cache().thumbnails(self.images, self.size)
+            else:
+                thumbnails = [load_full_size(image) if image else None
+                              for image in self.images]
+        except Exception as e:
+            logger.error('Caught {} at {}'.format(e, self.run))
+            thumbnails = [None] * len(self.images)
+        self.signals.loaded.emit(self.key, self.start, thumbnails)
+
+
 class FTPDownloadThread(thread):
     '''Thread specific for downloading files from a remote FTP server.
 
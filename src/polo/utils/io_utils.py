@@ -290,12 +290,12 @@ class RunCsvWriter(RunSerializer):
         :rtype: list
         '''
         row = {}
-        for attr, value in image.__dict__.items():
+        for attr, value in image.to_dict().items():
             if attr[0] == '_':  # remove _ from hidden attributes so looks nice when displayed
                 attr = attr[1:]
             if isinstance(value, Cocktail):
                 row[attr] = value.number
-            elif isinstance(value, Image):
+            elif isinstance(value, ImageRecord):
                 row[attr] = value.path
             elif isinstance(value, dict):
                 # unwrap the dict
@@ -307,6 +307,10 @@ class RunCsvWriter(RunSerializer):
                 continue  # currently do not encode bytes (base 64 stuff)  
             else:
                 row[attr] = str(value)  # default to case to string
+        for attr in ('next_image', 'previous_image', 'alt_image'):
+            # linked images of indexed runs are not stored in the image
+            linked_image = getattr(image, attr)
+            row[attr] = linked_image.path if linked_image else str(None)
         return row
 
     @property
@@ -630,8 +634,10 @@ class JsonWriter(RunSerializer):
         :rtype: dict or str
         '''
         d = None
-        if hasattr(obj, '__dict__'):  # can send to dict object
-            d = obj.__dict__
+        if isinstance(obj, ImageRecord):  # slotted so has no __dict__
+            d = obj.to_dict()
+        elif hasattr(obj, '__dict__'):  # can send to dict object
+            d = XtalWriter.saved_attributes(obj)
         else:  # not castable to dict
             if isinstance(obj, bytes):  # likely the base64 encoded image
                 d = obj.decode('utf-8')
@@ -706,8 +712,12 @@ class XtalWriter(RunSerializer):
         :returns: A dictionary or string version of the passed object
         '''
         d = None
-        if hasattr(obj, '__dict__'):  # can send to dict object
-            d = obj.__dict__
+        if isinstance(obj, ImageRecord) or hasattr(obj, '__dict__'):
+            # can send to dict object, images are slotted and have no __dict__
+            if isinstance(obj, ImageRecord):
+                d = obj.to_dict()
+            else:
+                d = XtalWriter.saved_attributes(obj)
             d['__class__'] = obj.__class__.__name__
             d['__module__'] = obj.__module__
             # store module and class name along with object as dict
@@ -718,6 +728,21 @@ class XtalWriter(RunSerializer):
                 d = str(obj)  # if all else fails case to string
         return d
 
+    @staticmethod
+    def saved_attributes(obj):
+        '''Get the attributes of `obj` that should be written to a file,
+        leaving out the ones listed in its `transient_attributes` class
+        attribute such as caches.
+
+        :param obj: Object to serialize
+        :type obj: obj
+        :return: Attributes to save
+        :rtype: dict
+        '''
+        transient = getattr(obj, 'transient_attributes', ())
+        return {key: value for key, value in obj.__dict__.items()
+                if key not in transient}
+
     @staticmethod
     def clean_run_for_save(run):
         '''Remove circular references from the run passed through the `run`
@@ -902,7 +927,7 @@ class RunDeserializer():  # convert saved file into a run
                     temp_d[key] = item
                 obj = class_(**temp_d)
 
-                if isinstance(obj, Image):  # clean up base64 encoded data
+                if isinstance(obj, ImageRecord):  # clean up base64 encoded data
                     if obj.bites:
                         obj.bites = RunDeserializer.clean_base64_string(
                             obj.bites)
@@ -1706,9 +1731,11 @@ class RunLinker():
     def the_big_link(runs):
         '''Wrapper method to do all the linking required for a collection of
         runs. First calls :meth:`~polo.utils.io_utils.RunLinker.unlink_runs_completely`
-        to separate any existing links so things do not get tangled. Then 
-        calls :meth:`~polo.utils.io_utils.RunLinker.link_runs_by_date` and
-        :meth:`~polo.utils.io_utils.RunLinker.link_runs_by_spectrum`.
+        to separate any existing links so things do not get tangled. Then
+        calls :meth:`~polo.utils.io_utils.RunLinker.index_sample` which links
+        the runs by date and spectrum the same way as
+        :meth:`~polo.utils.io_utils.RunLinker.link_runs_by_date` and
+        :meth:`~polo.utils.io_utils.RunLinker.link_runs_by_spectrum` would.
 
         :param runs: List of runs to link
         :type runs: list
@@ -1716,11 +1743,54 @@ class RunLinker():
         :rtype: list
         '''
         runs = RunLinker.unlink_runs_completely(runs)
-        runs = RunLinker.link_runs_by_date(runs)
-        runs = RunLinker.link_runs_by_spectrum(runs)
+        RunLinker.index_sample(runs)
 
         return runs
 
+    @staticmethod
+    def index_sample(runs):
+        '''Link the runs of one sample by date and spectrum through a
+        :class:`~polo.crystallography.sample_index.SampleIndex`. The links
+        of the images are read from the index so no image is touched
+        when runs are linked or looked up.
+
+        :param runs: Runs of the sample
+        :type runs: list
+        :return: The index of the sample
+        :rtype: SampleIndex
+        '''
+        index = SampleIndex(runs)
+        logger.debug('Linked {} runs into {}'.format(len(index), index))
+        return index
+
+    @staticmethod
+    def update_sample(runs):
+        '''Link the runs of one sample, reusing the
+        :class:`~polo.crystallography.sample_index.SampleIndex` the sample
+        already has. Runs that are new to the sample are inserted into the
+        index and runs that are no longer part of it are removed, so
+        importing one more run of a sample does not relink the images of
+        all the others. Falls back to
+        :meth:`~polo.utils.io_utils.RunLinker.the_big_link` if the runs do
+        not share exactly one index.
+
+        :param runs: All runs of the sample
+        :type runs: list
+        :return: List of runs with links made
+        :rtype: list
+        '''
+        indexes = {id(r.sample_index): r.sample_index for r in runs
+                   if getattr(r, 'sample_index', None)}
+        if len(indexes) != 1:
+            return RunLinker.the_big_link(runs)
+        index = indexes.popitem()[1]
+        members = set(id(r) for r in runs)
+        for run in [r for r in index.runs if id(r) not in members]:
+            index.remove(run)
+        for run in runs:
+            index.insert(run)
+        return runs
+
     @staticmethod
     def link_runs_by_date(runs):
         # need to seperate out the runs that can be linked and not
@@ -1784,6 +1854,9 @@ class RunLinker():
         :return: List of runs without any links
         :rtype: list
         '''
+        for run in runs:
+            if getattr(run, 'sample_index', None):
+                run.sample_index.discard()
         for i, _ in enumerate(runs):
             runs[i].previous_run, runs[i].next_run, runs[i].alt_spectrum = None, None, None
             for image in runs[i].images:
@@ -2030,7 +2103,9 @@ def if_dir_not_exists_make(parent_dir, child_dir=None):
 
 from polo.crystallography.cocktail import *
 from polo.crystallography.image import Image
+from polo.crystallography.image_record import ImageRecord
 from polo.crystallography.run import *
+from polo.crystallography.sample_index import SampleIndex
 RUN_TYPES = sorted(
         [types[-1] for types in 
         inspect.getmembers(sys.modules['polo.crystallography.run'], inspect.isclass)
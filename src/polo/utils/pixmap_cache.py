@@ -0,0 +1,141 @@
+from collections import OrderedDict
+
+from polo import PIXMAP_CACHE_MAX_BYTES, make_default_logger
+
+logger = make_default_logger(__name__)
+
+
+def pixmap_bytes(pixmap):
+    '''Memory taken up by the pixel data of a pixmap.
+
+    :param pixmap: Pixmap to measure
+    :type pixmap: QPixmap
+    :return: Size in bytes
+    :rtype: int
+    '''
+    if pixmap.isNull():
+        return 0
+    return pixmap.width() * pixmap.height() * max(pixmap.depth(), 8) // 8
+
+
+class PixmapCache():
+    '''Least recently used cache of decoded pixmaps with a memory budget.
+    All the views that show images keep the pixmaps they decode here so
+    going back to an image that was just shown does not decode it again,
+    while the memory used for pixmaps stays under `max_bytes` no matter how
+    many runs are browsed.
+
+    :class:`~polo.crystallography.image.Image`s do not hold pixel data,
+    their pixmaps only live here, so evicting a pixmap frees it as soon as
+    no scene is showing it anymore. Pixmaps are only valid on the GUI thread
+    so the cache should only be used from there.
+
+    :param max_bytes: Memory budget, defaults to
+                      :const:`polo.PIXMAP_CACHE_MAX_BYTES`
+    :type max_bytes: int, optional
+    '''
+
+    def __init__(self, max_bytes=PIXMAP_CACHE_MAX_BYTES):
+        self.max_bytes = max(int(max_bytes), 0)
+        self.total_bytes = 0
+        self._entries = OrderedDict()  # key: (pixmap, bytes), oldest first
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, touch=True):
+        '''Return the pixmap cached under `key` and mark it as recently used.
+
+        :param key: Cache key
+        :type key: hashable
+        :param touch: Mark the pixmap as recently used, defaults to True
+        :type touch: bool, optional
+        :return: Pixmap or None if nothing is cached under `key`
+        :rtype: QPixmap or None
+        '''
+        entry = self._entries.get(key)
+        if entry:
+            if touch:
+                self._entries.move_to_end(key)
+            return entry[0]
+
+    def add(self, key, pixmap):
+        '''Cache `pixmap` under `key`, or mark it as recently used if it is
+        already cached, and evict the least recently used pixmaps if the
+        cache is over budget. Null pixmaps are not cached.
+
+        :param key: Cache key
+        :type key: hashable
+        :param pixmap: Pixmap to cache
+        :type pixmap: QPixmap
+        :return: The cached pixmap
+        :rtype: QPixmap
+        '''
+        entry = self._entries.pop(key, None)
+        if entry:
+            self.total_bytes -= entry[1]
+        size = pixmap_bytes(pixmap)
+        if size:
+            self._entries[key] = (pixmap, size)
+            self.total_bytes += size
+            self.evict()
+        return pixmap
+
+    def discard(self, key):
+        '''Forget the pixmap cached under `key`.
+
+        :param key: Cache key
+        :type key: hashable
+        '''
+        entry = self._entries.pop(key, None)
+        if entry:
+            self.total_bytes -= entry[1]
+
+    def evict(self, max_bytes=None):
+        '''Drop least recently used pixmaps until the cache uses at most
+        `max_bytes`. The most recently used pixmap is always kept.
+
+        :param max_bytes: Memory to shrink to, defaults to None
+                          (:attr:`max_bytes`)
+        :type max_bytes: int, optional
+        :return: Number of pixmaps dropped
+        :rtype: int
+        '''
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        evicted = 0
+        while self.total_bytes > max_bytes and len(self._entries) > 1:
+            _, (_, size) = self._entries.popitem(last=False)
+            self.total_bytes -= size
+            evicted += 1
+        if evicted:
+            logger.debug('Evicted {} pixmaps, {} MB cached'.format(
+                evicted, round(self.total_bytes / 1024 ** 2, 1)))
+        return evicted
+
+    def clear(self):
+        '''Drop every cached pixmap.
+        '''
+        self._entries, self.total_bytes = OrderedDict(), 0
+
+    def __repr__(self):
+        return '<PixmapCache {} pixmaps {} MB>'.format(
+            len(self), round(self.total_bytes / 1024 ** 2, 1))
+
+
+_pixmap_cache = None
+
+
+def get_pixmap_cache():
+    '''Return the :class:`PixmapCache` shared by the whole program, creating
+    it the first time it is needed.
+
+    :return: Shared pixmap cache
+    :rtype: PixmapCache
+    '''
+    global _pixmap_cache
+    if _pixmap_cache is None:
+        _pixmap_cache = PixmapCache()
+    return _pixmap_cache
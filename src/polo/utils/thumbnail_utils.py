@@ -0,0 +1,437 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from PyQt5.QtCore import QBuffer, QByteArray, QIODevice, QSize, Qt
+from PyQt5.QtGui import QImage, QImageReader
+
+from polo import (THUMBNAIL_CACHE_MAX_BYTES, THUMBNAIL_DIR, THUMBNAIL_SIZES,
+                  make_default_logger)
+
+logger = make_default_logger(__name__)
+
+
+def thumbnail_size_for(tile_size, sizes=THUMBNAIL_SIZES):
+    '''Pick the thumbnail tier to show an image in a tile of `tile_size`
+    pixels, the smallest tier that is at least as large as the tile.
+
+    :param tile_size: Longest edge of the tile on screen in device pixels
+    :type tile_size: int or float
+    :param sizes: Available tiers, defaults to :const:`polo.THUMBNAIL_SIZES`
+    :type sizes: tuple, optional
+    :return: Tier or None if the tile is larger than every tier and the full
+             size image should be shown
+    :rtype: int or None
+    '''
+    for size in sorted(sizes):
+        if size >= tile_size:
+            return size
+
+
+def _image_reader(image):
+    '''Private helper function that opens a :class:`QImageReader` on the file
+    or base64 encoded data of `image`.
+
+    :return: Reader or None if the image has no data
+    :rtype: QImageReader or None
+    '''
+    if image.path and os.path.isfile(str(image.path)):
+        return QImageReader(str(image.path))
+    image_bytes = image.read_bytes()
+    if image_bytes:
+        data = QBuffer()
+        data.setData(QByteArray(image_bytes))
+        data.open(QIODevice.ReadOnly)
+        reader = QImageReader(data)
+        reader.buffer = data  # keep the buffer alive as long as the reader
+        return reader
+
+
+def image_size(image):
+    '''Read the size of an image from its header without decoding it.
+
+    :param image: Image to get the size of
+    :type image: Image
+    :return: Width and height in pixels or None if the size is unknown
+    :rtype: tuple or None
+    '''
+    reader = _image_reader(image)
+    if reader:
+        size = reader.size()
+        if size.isValid():
+            return size.width(), size.height()
+
+
+def load_full_size(image):
+    '''Decode an image at full resolution. Unlike
+    :meth:`~polo.crystallography.image.Image.setPixmap` this can be called
+    from any thread.
+
+    :param image: Image to load
+    :type image: Image
+    :return: Image data as a :class:`Thumbnail` without a tier or None if
+             the image could not be read
+    :rtype: Thumbnail or None
+    '''
+    reader = _image_reader(image)
+    if reader:
+        decoded = reader.read()
+        if not decoded.isNull():
+            return Thumbnail(decoded, None, decoded.width(), decoded.height())
+
+
+class Thumbnail():
+    '''Downscaled copy of an image from a :class:`ThumbnailCache`.
+
+    :param image: Thumbnail image data
+    :type image: QImage
+    :param size: Tier the thumbnail belongs to, None for a full size image
+    :type size: int or None
+    :param source_width: Width of the full size image in pixels
+    :type source_width: int
+    :param source_height: Height of the full size image in pixels
+    :type source_height: int
+    '''
+
+    def __init__(self, image, size, source_width, source_height):
+        self.image = image
+        self.size = size
+        self.source_width = source_width
+        self.source_height = source_height
+
+    @property
+    def scale(self):
+        '''Factor that scales the thumbnail up to the size of the full size
+        image.
+
+        :return: Scale factor
+        :rtype: float
+        '''
+        return self.source_width / max(self.image.width(), 1)
+
+    def __repr__(self):
+        return '<Thumbnail {} of {}x{}>'.format(
+            self.size, self.source_width, self.source_height)
+
+
+class ThumbnailCache():
+    '''On disk cache of downscaled copies of images at the fixed tiers in
+    `sizes`, so views showing many images at once do not have to decode and
+    hold every image at full resolution.
+
+    Thumbnails are keyed by the content hash of the image, so the same
+    image imported from a rar archive, a directory or an xtal file shares
+    its thumbnails. To avoid hashing image files on every lookup the content
+    key of a file is remembered along with its size and modification time.
+    When a thumbnail is first asked for every tier up to the one asked for
+    is made from a single decode of the image. The files of the least
+    recently used thumbnails are removed once the cache holds more than
+    `max_bytes`.
+
+    Thumbnails are returned as :class:`QImage` so the cache can be used from
+    worker threads.
+
+    :param cache_dir: Directory to store thumbnails in, defaults to
+                      :const:`polo.THUMBNAIL_DIR`
+    :type cache_dir: str or Path, optional
+    :param max_bytes: Max total size of the thumbnail files, defaults to
+                      :const:`polo.THUMBNAIL_CACHE_MAX_BYTES`
+    :type max_bytes: int, optional
+    :param sizes: Thumbnail tiers, defaults to :const:`polo.THUMBNAIL_SIZES`
+    :type sizes: tuple, optional
+    :param quality: JPEG quality of the thumbnails, defaults to 85
+    :type quality: int, optional
+    '''
+
+    def __init__(self, cache_dir=THUMBNAIL_DIR, max_bytes=THUMBNAIL_CACHE_MAX_BYTES,
+                 sizes=THUMBNAIL_SIZES, quality=85):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max(int(max_bytes), 0)
+        self.sizes = tuple(sorted(sizes))
+        self.quality = quality
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            str(self.cache_dir.joinpath('thumbnails.sqlite')),
+            check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                '''CREATE TABLE IF NOT EXISTS sources (
+                    source TEXT PRIMARY KEY, key TEXT)''')
+            self._connection.execute(
+                '''CREATE TABLE IF NOT EXISTS thumbnails (
+                    key TEXT, size INTEGER, file TEXT, source_width INTEGER,
+                    source_height INTEGER, bytes INTEGER, last_used REAL,
+                    PRIMARY KEY (key, size))''')
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS last_used_index ON thumbnails (last_used)')
+        logger.debug('Opened {} at {}'.format(self, self.cache_dir))
+
+    @property
+    def total_bytes(self):
+        '''Total size of the cached thumbnail files.
+
+        :return: Size in bytes
+        :rtype: int
+        '''
+        with self._lock:
+            return self._connection.execute(
+                'SELECT COALESCE(SUM(bytes), 0) FROM thumbnails').fetchone()[0]
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute(
+                'SELECT COUNT(*) FROM thumbnails').fetchone()[0]
+
+    @staticmethod
+    def source_key(image):
+        '''Identify the file of an image by its path, size and modification
+        time. Used to remember the content key of files without hashing
+        them again.
+
+        :param image: Image to identify
+        :type image: Image
+        :return: Source key or None if the image is not stored in a file
+        :rtype: str or None
+        '''
+        if image.path and os.path.isfile(str(image.path)):
+            stat = os.stat(str(image.path))
+            return '{}|{}|{}'.format(
+                os.path.abspath(str(image.path)), stat.st_size, stat.st_mtime_ns)
+
+    def thumbnail(self, image, size):
+        '''Return the thumbnail of one image. See :meth:`thumbnails`.
+
+        :param image: Image to get the thumbnail of
+        :type image: Image
+        :param size: Thumbnail tier, one of :attr:`sizes`
+        :type size: int
+        :return: Thumbnail or None if the image could not be read
+        :rtype: Thumbnail or None
+        '''
+        return self.thumbnails([image], size)[0]
+
+    def thumbnails(self, images, size):
+        '''Return the thumbnails of a collection of images at tier `size`,
+        making and caching the ones that are not cached yet. Cache lookups
+        and updates for the whole collection are done in one transaction.
+
+        :param images: Images to get thumbnails of
+        :type images: list
+        :param size: Thumbnail tier, one of :attr:`sizes`
+        :type size: int
+        :raises ValueError: If `size` is not a tier of this cache
+        :return: Thumbnail of each image, None for images that could not be
+                 read, in the same order as `images`
+        :rtype: list
+        '''
+        if size not in self.sizes:
+            raise ValueError('No thumbnail tier {}, use one of {}'.format(
+                size, ', '.join(str(s) for s in self.sizes)))
+        thumbnails = [None] * len(images)
+        sources = [self.source_key(image) if image else None for image in images]
+        with self._lock:
+            keys = self._select('SELECT source, key FROM sources WHERE source IN ({})',
+                                [], [s for s in sources if s])
+            keys = dict(keys)
+            rows = self._select(
+                'SELECT key, file, source_width, source_height FROM thumbnails '
+                'WHERE size = ? AND key IN ({})', [size], list(set(keys.values())))
+        rows = {row[0]: row[1:] for row in rows}
+
+        hits, new_sources, new_rows = set(), [], []
+        for i, (image, source) in enumerate(zip(images, sources)):
+            if not image:
+                continue
+            key = keys.get(source)
+            if key in rows:
+                thumbnails[i] = self._load(size, *rows[key])
+            if thumbnails[i] is not None:
+                hits.add(key)
+                continue
+            image_bytes = image.read_bytes()
+            if not image_bytes:
+                continue
+            key = hashlib.sha1(image_bytes).hexdigest()
+            if source:
+                new_sources.append((source, key))
+            thumbnails[i], made = self._make(key, image_bytes, size)
+            new_rows.extend(made)
+
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO sources VALUES (?, ?)', new_sources)
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO thumbnails VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [row + (now,) for row in new_rows])
+            self._connection.executemany(
+                'UPDATE thumbnails SET last_used = ? WHERE key = ? AND size = ?',
+                [(now, key, size) for key in hits])
+        if new_rows:
+            self.evict()
+        return thumbnails
+
+    def evict(self):
+        '''Remove the least recently used thumbnails until the thumbnail
+        files take up at most :attr:`max_bytes`.
+
+        :return: Number of thumbnails removed
+        :rtype: int
+        '''
+        overflow = self.total_bytes - self.max_bytes
+        if overflow <= 0:
+            return 0
+        evicted = []
+        with self._lock, self._connection:
+            for key, size, file_name, size_bytes in self._connection.execute(
+                    'SELECT key, size, file, bytes FROM thumbnails ORDER BY last_used'):
+                if overflow <= 0:
+                    break
+                evicted.append((key, size, file_name))
+                overflow -= size_bytes
+            self._connection.executemany(
+                'DELETE FROM thumbnails WHERE key = ? AND size = ?',
+                [(key, size) for key, size, _ in evicted])
+        for _, _, file_name in evicted:
+            try:
+                self.cache_dir.joinpath(file_name).unlink()
+            except FileNotFoundError:
+                pass
+        logger.debug('Evicted {} thumbnails'.format(len(evicted)))
+        return len(evicted)
+
+    def clear(self):
+        '''Remove every cached thumbnail.
+        '''
+        with self._lock, self._connection:
+            files = [row[0] for row in self._connection.execute(
+                'SELECT file FROM thumbnails')]
+            self._connection.execute('DELETE FROM thumbnails')
+            self._connection.execute('DELETE FROM sources')
+        for file_name in files:
+            try:
+                self.cache_dir.joinpath(file_name).unlink()
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def _select(self, query, params, values):
+        '''Private method that runs `query` with an IN clause over `values`
+        in chunks that stay under the SQLite variable limit. Must be called
+        holding :attr:`_lock`.
+        '''
+        rows = []
+        for i in range(0, len(values), 500):
+            chunk = values[i:i+500]
+            rows.extend(self._connection.execute(
+                query.format(','.join('?' * len(chunk))), params + chunk))
+        return rows
+
+    def _load(self, size, file_name, source_width, source_height):
+        '''Private method that reads a cached thumbnail file.
+
+        :return: Thumbnail or None if the file is missing or unreadable
+        :rtype: Thumbnail or None
+        '''
+        image = QImage(str(self.cache_dir.joinpath(file_name)))
+        if not image.isNull():
+            return Thumbnail(image, size, source_width, source_height)
+
+    def _make(self, key, image_bytes, size):
+        '''Private method that decodes an image once, at the resolution of
+        tier `size`, and writes thumbnails for that tier and every smaller
+        tier.
+
+        :param key: Content key of the image
+        :type key: str
+        :param image_bytes: Raw image data
+        :type image_bytes: bytes
+        :param size: Largest tier to make
+        :type size: int
+        :return: Tuple of the thumbnail at tier `size`, or None if the image
+                 could not be decoded, and the database rows of the
+                 thumbnail files written
+        :rtype: tuple
+        '''
+        data = QBuffer()
+        data.setData(QByteArray(image_bytes))
+        data.open(QIODevice.ReadOnly)
+        reader = QImageReader(data)
+        source_size = reader.size()
+        bounds = QSize(size, size)
+        if source_size.isValid() and (source_size.width() > size
+                                      or source_size.height() > size):
+            # let the decoder skip detail the thumbnail will not show
+            reader.setScaledSize(source_size.scaled(bounds, Qt.KeepAspectRatio))
+        decoded = reader.read()
+        if decoded.isNull():
+            logger.warning('Could not make thumbnail: {}'.format(reader.errorString()))
+            return None, []
+        if not source_size.isValid():
+            source_size = decoded.size()
+
+        thumbnail, rows = None, []
+        for tier in self.sizes:
+            if tier > size:
+                break
+            image = decoded
+            if decoded.width() > tier or decoded.height() > tier:
+                image = decoded.scaled(
+                    QSize(tier, tier), Qt.KeepAspectRatio, Qt.SmoothTransformation)
+            file_name = self._write(key, tier, image)
+            if file_name:
+                rows.append((key, tier, file_name, source_size.width(),
+                             source_size.height(),
+                             self.cache_dir.joinpath(file_name).stat().st_size))
+            if tier == size:
+                thumbnail = Thumbnail(image, tier, source_size.width(),
+                                      source_size.height())
+        return thumbnail, rows
+
+    def _write(self, key, size, image):
+        '''Private method that saves a thumbnail, as a PNG if it has
+        transparency and a JPEG otherwise. The file is written under a
+        temporary name first so other threads never read a partial file.
+
+        :return: Path of the file relative to :attr:`cache_dir` or None if
+                 it could not be written
+        :rtype: str or None
+        '''
+        image_format = 'png' if image.hasAlphaChannel() else 'jpg'
+        file_name = '{}/{}_{}.{}'.format(key[:2], key, size, image_format)
+        path = self.cache_dir.joinpath(file_name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name('{}.{}.tmp'.format(
+            path.stem, threading.get_ident()))
+        if image.save(str(temp_path), image_format.upper(), self.quality):
+            os.replace(str(temp_path), str(path))
+            return file_name
+        logger.warning('Could not write thumbnail {}'.format(path))
+
+    def __repr__(self):
+        return '<ThumbnailCache {}>'.format(self.cache_dir)
+
+
+_thumbnail_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_thumbnail_cache():
+    '''Return the :class:`ThumbnailCache` shared by the whole program,
+    opening it the first time it is needed.
+
+    :return: Shared thumbnail cache
+    :rtype: ThumbnailCache
+    '''
+    global _thumbnail_cache
+    with _cache_lock:
+        if _thumbnail_cache is None:
+            _thumbnail_cache = ThumbnailCache()
+    return _thumbnail_cache
@@ -172,10 +172,9 @@ class OptimizeWidget(QtWidgets.QWidget):
         '''
         hits = []
         if isinstance(self.run, (Run, HWIRun)):
-            for image in self.run.images:
-                if (image.human_class == IMAGE_CLASSIFICATIONS[0] 
-                    and not image.is_placeholder):
-                    hits.append(image)
+            columns = self.run.columns
+            hits = columns.images(
+                columns.class_mask(IMAGE_CLASSIFICATIONS[0]) & ~columns.placeholder)
         return hits
 
     @property
@@ -270,6 +270,21 @@ class PlateInspectorWidget(QtWidgets.QWidget):
             self.selected_classifications, self.human, self.marco, 
             self.favorite
         )
+
+    def refresh_classified_images(self, images):
+        '''Update the displayed images that are in `images` after they have
+        been classified by MARCO. Labels and tooltips are updated and the
+        current image filters and color mapping are applied again.
+
+        :param images: Newly classified images
+        :type images: list
+        '''
+        if self._run and self.ui.plateViewer.update_images(images):
+            if self.ui.checkBox_27.isChecked():
+                self._apply_image_filters()
+            if self.ui.checkBox_28.isChecked():
+                self._apply_color_mapping()
+
     def _set_time_resolved_buttons(self):
         '''Private helper function that determines if navigation buttons 
         that display alt spectrum images, previous and next date images 
@@ -6,18 +6,29 @@ from PyQt5.QtGui import (QBitmap, QBrush, QColor, QFont, QIcon, QPainter,
                          QPixmap, QPixmapCache)
 from PyQt5.QtWidgets import QGraphicsColorizeEffect, QGraphicsScene
 
-from polo import ALLOWED_IMAGE_COUNTS, COLORS, IMAGE_CLASSIFICATIONS, make_default_logger
+from polo import (ALLOWED_IMAGE_COUNTS, COLORS, DEFAULT_IMAGE_PATH,
+                  IMAGE_CLASSIFICATIONS, PLATE_LOADER_CHUNK,
+                  PLATE_LOADER_THREADS, make_default_logger)
 from polo.crystallography.run import HWIRun, Run
-from polo.threads.thread import QuickThread
+from polo.threads.thread import ImageLoader, QuickThread
 from polo.utils.dialog_utils import make_message_box
 from polo.utils.io_utils import RunSerializer, SceneExporter
 from polo.utils.math_utils import *
+from polo.utils.pixmap_cache import get_pixmap_cache
+from polo.utils.thumbnail_utils import image_size, thumbnail_size_for
 from polo.widgets.slideshow_viewer import PhotoViewer
 from polo.windows.image_pop_dialog import ImagePopDialog
 
 logger = make_default_logger(__name__)
 
 
+def _tier_rank(tier):
+    '''Private helper function to order thumbnail tiers, None being the
+    full size image.
+    '''
+    return math.inf if tier is None else tier
+
+
 class PlateGraphicsItem(QtWidgets.QGraphicsPixmapItem):
 
     def __init__(self, pixmap, parent=None):
@@ -32,9 +43,22 @@ class plateViewer(QtWidgets.QGraphicsView):
     subgrid_dict = {16: (4, 4), 64: (8, 8), 96: (8, 12), 1536: (32, 48)}
     changed_page_signal = pyqtSignal(int)
     changed_images_per_page_signal = pyqtSignal(tuple)
+    visible_images_changed = pyqtSignal(list)
 
     def __init__(self, parent, run=None, images_per_page=24):
         super(plateViewer, self).__init__(parent)
+        self._loader_pool = QtCore.QThreadPool(self)
+        self._loader_pool.setMaxThreadCount(PLATE_LOADER_THREADS)
+        self._page_cache = {}  # images and tiles of the shown and adjacent pages
+        self._shown_page = None  # key of the page in _page_cache being shown
+        self._tiles = []  # pixmap items of the shown page in page order
+        self._tile_tiers = []  # tier each tile should show, 0 for none yet
+        self._lod_loading = set()  # (tile index, tier) being loaded for zoom
+        self._lod_timer = QtCore.QTimer(self)
+        self._lod_timer.setSingleShot(True)
+        self._lod_timer.setInterval(100)  # wait for the user to stop zooming
+        self._lod_timer.timeout.connect(self.update_level_of_detail)
+        self._cell_dims = None
         self.preserve_aspect = False  # how to fit images in scene
         self._images_per_page = images_per_page
         self._graphics_wells = None
@@ -44,6 +68,8 @@ class plateViewer(QtWidgets.QGraphicsView):
         self._zoom = 0
         self._scene_map = {}
         self._view_cache = {}
+        self._label_dict = {}
+        self._scene_labels = {}  # image labels on the scene keyed by id(image)
         self.setInteractive(True)
         self.setScene(self._scene)
         self.setBackgroundBrush(QtGui.QBrush(QtGui.QColor(30, 30, 30)))
@@ -166,6 +192,10 @@ class plateViewer(QtWidgets.QGraphicsView):
     @run.setter
     def run(self, new_run):
         self._run = new_run
+        self._loader_pool.clear()  # drop queued loads of the previous run
+        self._page_cache, self._shown_page, self._tiles = {}, None, []
+        self._tile_tiers, self._lod_loading = [], set()
+        self._cell_dims = None
         self._scene.clear()
         QPixmapCache.clear()
 
@@ -243,63 +273,259 @@ class plateViewer(QtWidgets.QGraphicsView):
 
         return item
 
+    def _tile_size(self):
+        '''Private helper method that estimates the size each image of the
+        current page will be drawn at.
+
+        :return: Longest edge of a tile in device pixels
+        :rtype: float
+        '''
+        rows, cols = self.subgrid_dict[self.images_per_page]
+        view_w, view_h = self.view_dims
+        return max(view_w / cols, view_h / rows) * self.devicePixelRatioF()
+
+    def _cell_size(self, images):
+        '''Private helper method that returns the size, in scene units, of
+        each cell of the image grid. Cells are the size of the full size
+        images of the run, read from the header of the first readable image
+        so the grid can be laid out before any image is decoded.
+
+        :param images: Images of the current page
+        :type images: list
+        :return: Width and height of a cell
+        :rtype: tuple
+        '''
+        if not self._cell_dims:
+            for image in images:
+                self._cell_dims = image_size(image) if image else None
+                if self._cell_dims:
+                    break
+            else:
+                size = QtGui.QImageReader(str(DEFAULT_IMAGE_PATH)).size()
+                self._cell_dims = (size.width(), size.height()) if size.isValid() else None
+        return self._cell_dims or (1, 1)
+
+    def _page_key(self, page, tier):
+        '''Private helper method that identifies the tiles of one page as
+        they are loaded and cached.
+        '''
+        return (id(self.run), self.images_per_page, page, tier)
+
+    def _adjacent_pages(self):
+        '''Private helper method that returns the pages before and after the
+        current page, wrapping around like
+        :attr:`~polo.widgets.plate_viewer.plateViewer.current_page` does.
+
+        :return: Next and previous page numbers
+        :rtype: set
+        '''
+        total = self.total_pages
+        if total <= 1:
+            return set()
+        return {self.current_page % total + 1,
+                (self.current_page - 2) % total + 1}
+
+    def _cached_tile(self, image, tier):
+        '''Private helper method that returns the pixmap of `image` at
+        `tier` from the shared :class:`~polo.utils.pixmap_cache.PixmapCache`
+        if it is there. Thumbnails are cached under the path of their image
+        and their tier, full size images are the pixmaps of the images.
+
+        :return: Pixmap or None if it is not loaded
+        :rtype: QPixmap or None
+        '''
+        if not image:
+            return None
+        elif tier is None:
+            if not image.isNull():
+                return image.setPixmap()  # marks it as recently used
+        else:
+            return get_pixmap_cache().get(
+                ('tile', image.path or id(image), tier))
+
+    def _cache_tile(self, image, thumbnail):
+        '''Private helper method that turns a loaded thumbnail or full size
+        image into a pixmap and adds it to the shared
+        :class:`~polo.utils.pixmap_cache.PixmapCache`. See
+        :meth:`_cached_tile`.
+
+        :return: Pixmap
+        :rtype: QPixmap
+        '''
+        if thumbnail.size is None:
+            return image.attach_pixmap(thumbnail.image)
+        return get_pixmap_cache().add(
+            ('tile', image.path or id(image), thumbnail.size),
+            QPixmap.fromImage(thumbnail.image))
+
+    def _load_page(self, page, tier, priority=0):
+        '''Private method that starts loading the tiles of `page` on
+        :attr:`_loader_pool` unless they are already being loaded. Tiles
+        found in the shared :class:`~polo.utils.pixmap_cache.PixmapCache`
+        are used straight away and chunks of the page that are completely
+        cached are not loaded again. Results are collected in
+        :attr:`_page_cache` by :meth:`_tiles_loaded`.
+
+        :param page: Page to load
+        :type page: int
+        :param tier: Thumbnail tier to load, None for full size images
+        :type tier: int or None
+        :param priority: :class:`QThreadPool` priority, defaults to 0
+        :type priority: int, optional
+        :return: Key of the page
+        :rtype: tuple
+        '''
+        key = self._page_key(page, tier)
+        if key not in self._page_cache:
+            images = [self.run.images[i] for i in self._get_visible_wells(page)]
+            tiles = [self._cached_tile(image, tier) for image in images]
+            self._page_cache[key] = (images, tiles)
+            for start in range(0, len(images), PLATE_LOADER_CHUNK):
+                end = start + PLATE_LOADER_CHUNK
+                if all(tile is not None for tile in tiles[start:end]):
+                    continue
+                loader = ImageLoader(key, start, images[start:end], tier)
+                loader.signals.loaded.connect(self._tiles_loaded)
+                self._loader_pool.start(loader, priority)
+        return key
+
+    def _tiles_loaded(self, key, start, thumbnails):
+        '''Private method called on the GUI thread when an
+        :class:`~polo.threads.thread.ImageLoader` finishes. Caches the
+        loaded tiles and swaps them in for the placeholders if their page is
+        shown.
+        '''
+        if key not in self._page_cache:
+            return  # page is no longer shown or next to the shown page
+        images, tiles = self._page_cache[key]
+        for i, thumbnail in enumerate(thumbnails, start):
+            if thumbnail is None or tiles[i] is not None:
+                continue
+            tiles[i] = self._cache_tile(images[i], thumbnail)
+            if key == self._shown_page:
+                self._set_tile(i, tiles[i], key[-1])
+
+    def _set_tile(self, index, pixmap, tier):
+        '''Private method that replaces the pixmap of a tile of the shown
+        page with a loaded image, scaled to fill its cell of the grid.
+        Nothing is changed if the tile should now show a different tier,
+        like when a page tile finishes loading after the tile was zoomed in
+        on.
+
+        :param index: Index of the tile in the page
+        :type index: int
+        :param pixmap: Loaded thumbnail or full size image, if None the
+                       current pixmap is kept
+        :type pixmap: QPixmap
+        :param tier: Thumbnail tier of `pixmap`, None for full size
+        :type tier: int or None
+        '''
+        if (pixmap is None or index >= len(self._tiles)
+                or self._tile_tiers[index] != tier):
+            return
+        cell_w, cell_h = self._cell_dims or (pixmap.width(), pixmap.height())
+        self._tiles[index].setPixmap(pixmap)
+        self._tiles[index].setScale(min(cell_w / max(pixmap.width(), 1),
+                                        cell_h / max(pixmap.height(), 1)))
+
+    def _placeholder(self, cell_w, cell_h):
+        '''Private helper method that makes the small pixmap shown, scaled
+        up, in cells whose image is still loading. One pixmap is shared by
+        every cell.
+        '''
+        size = QtCore.QSize(cell_w, cell_h).scaled(
+            64, 64, Qt.KeepAspectRatio)
+        placeholder = QPixmap(max(size.width(), 1), max(size.height(), 1))
+        placeholder.fill(QColor(55, 55, 55))
+        return placeholder
+
     def tile_images_onto_scene(self, label_dict={}):
         '''Calculates images that should be shown based on the current page
         and the number of images per page. Then tiles these images into a grid,
         adding them to :attr:`_scene` attribute. 
 
+        The grid is drawn straight away with a placeholder in every cell.
+        Images are decoded by a background thread pool, as thumbnails of the
+        tier matching the size of the cells on screen, and swapped in as they
+        finish. The pages before and after the current page are loaded in
+        the background as well so flipping to them is instant.
+
         :param label_dict: Dictionary of Image attributes to pass along to
                            :meth:`~polo.widgets.plate_viewer.plateViewer._make_image_label`
                            to create image labels, defaults to {}
         :type label_dict: dict, optional
         '''
         if self.run:
-            QtWidgets.QApplication.setOverrideCursor(Qt.WaitCursor)
-            [item.data(0).delete_all_pixmap_data() for item in self._scene.items()
-             if isinstance(item, QtWidgets.QGraphicsPixmapItem)]
-            # for now delete all previous pixmap data from ram
-
-            _, stride = self.subgrid_dict[self.images_per_page]
-            cur_x_pos, cur_y_pos = 0, 0  # position to place image in pixels
-            row_height = 0  # height of tallest image in a given row of images
-
             images = [self.run.images[i] for i in self._get_visible_wells()]
             _, stride = self.subgrid_dict[self.images_per_page]
             self._scene.clear()
+            self._label_dict, self._scene_labels, self._tiles = label_dict, {}, []
+            self._lod_loading = set()
             self.viewport().update()
 
+            cell_w, cell_h = self._cell_size(images)
+            placeholder = self._placeholder(cell_w, cell_h)
             for i, image in enumerate(images):
-                if i % stride == 0 and i != 0:
-                    cur_y_pos += row_height
-                    row_height, cur_x_pos, = 0, 0  # reset row height for next row
-
-                if image.isNull():
-                    image.setPixmap()
-
-                item = self._scene.addPixmap(image)
-                item.setPos(cur_x_pos, cur_y_pos)
+                row, col = divmod(i, stride)
+                item = self._scene.addPixmap(placeholder)
+                item.setTransformationMode(Qt.SmoothTransformation)
+                item.setScale(cell_w / placeholder.width())
+                item.setPos(col * cell_w, row * cell_h)
                 label = self._make_image_label(image, label_dict)
                 if label:
                     self._scene.addItem(label)
-                    label.setPos(cur_x_pos, cur_y_pos)
+                    label.setPos(col * cell_w, row * cell_h)
+                    self._scene_labels[id(image)] = label
                 item.setData(0, image)
                 self._set_prerender_info(item, image)
-                if image.height() > row_height:
-                    row_height = image.height()
-                cur_x_pos += image.width()
+                self._tiles.append(item)
+
+            tier = thumbnail_size_for(self._tile_size())
+            self._tile_tiers = [tier] * len(self._tiles)
+            self._shown_page = self._load_page(self.current_page, tier, priority=1)
+            for i, tile in enumerate(self._page_cache[self._shown_page][1]):
+                self._set_tile(i, tile, tier)
+            wanted = {self._shown_page} | {
+                self._load_page(page, tier) for page in self._adjacent_pages()}
+            for key in set(self._page_cache) - wanted:
+                del self._page_cache[key]
 
             self._scene.selectionChanged.connect(self.pop_out_selected_well)
 
             self.setScene(self._scene)
             self.fitInView(self._scene, self.preserve_aspect)
-            QtWidgets.QApplication.restoreOverrideCursor()
             self.changed_images_per_page_signal.emit(
                 self.subgrid_dict[self._images_per_page]
             )
             logger.debug('Added {} images to scene'.format(len(images)))
             self.changed_page_signal.emit(self._current_page)
+            self.visible_images_changed.emit(images)
             self.repaint()
 
+    def update_images(self, images):
+        '''Update the tooltips and labels of any of `images` that are
+        currently shown so they reflect changes to the images' data, such as
+        a new MARCO classification, without re-tiling the scene.
+
+        :param images: Images whose data has changed
+        :type images: list
+        :return: True if any of the images are currently shown
+        :rtype: bool
+        '''
+        changed = set(id(image) for image in images)
+        updated = False
+        for item in self._scene.items():
+            if isinstance(item, QtWidgets.QGraphicsPixmapItem):
+                image = item.data(0)
+                if id(image) in changed:
+                    self._set_prerender_info(item, image)
+                    label = self._scene_labels.get(id(image))
+                    if label:
+                        label.setPlainText(self._make_image_label(
+                            image, self._label_dict).toPlainText())
+                    updated = True
+        return updated
+
     def set_scene_opacity_from_filters(self, image_types, human=False,
                                        marco=False, favorite=False,
                                        filtered_opacity=0.2):
@@ -381,7 +607,9 @@ class plateViewer(QtWidgets.QGraphicsView):
 
     def wheelEvent(self, event):
         '''Handle Qt wheelEvents by setting the :attr:`_zoom` attribute. Allows users
-        to zoom in and out of the current view.
+        to zoom in and out of the current view. Once the user stops zooming
+        :meth:`update_level_of_detail` swaps in pixmaps with enough detail
+        for the new zoom level.
 
         :param event: event
         :type event: QEvent
@@ -399,6 +627,59 @@ class plateViewer(QtWidgets.QGraphicsView):
                 self.fitInView(self._scene, self.preserve_aspect)
             else:
                 self._zoom = 0
+            self._lod_timer.start()
+
+    def update_level_of_detail(self):
+        '''Show each tile of the current page at the resolution it is drawn
+        at. Tiles inside the visible part of the scene are upgraded to the
+        thumbnail tier matching their size on screen, or to the full size
+        image once they are larger than the largest tier. All other tiles,
+        and every tile once the view is zoomed all the way out, go back to
+        the tier the page was loaded at. Pixmaps that are not cached are
+        loaded in the background.
+        '''
+        if not self._tiles or self._shown_page not in self._page_cache:
+            return
+        page_tier = self._shown_page[-1]
+        cell_w, cell_h = self._cell_dims or (1, 1)
+        transform = self.transform()
+        zoom_tier = thumbnail_size_for(max(cell_w * transform.m11(),
+                                           cell_h * transform.m22())
+                                       * self.devicePixelRatioF())
+        if self._zoom <= 0 or _tier_rank(zoom_tier) < _tier_rank(page_tier):
+            zoom_tier = page_tier
+        visible = self.mapToScene(self.viewport().rect()).boundingRect()
+
+        images, page_tiles = self._page_cache[self._shown_page]
+        for i, item in enumerate(self._tiles):
+            tier = page_tier
+            if item.sceneBoundingRect().intersects(visible):
+                tier = zoom_tier
+            if tier == self._tile_tiers[i]:
+                continue
+            self._tile_tiers[i] = tier
+            if tier == page_tier:
+                pixmap = page_tiles[i]
+            else:
+                pixmap = self._cached_tile(images[i], tier)
+            if pixmap is not None:
+                self._set_tile(i, pixmap, tier)
+            elif tier != page_tier and (i, tier) not in self._lod_loading:
+                self._lod_loading.add((i, tier))
+                loader = ImageLoader((self._shown_page, tier), i, [images[i]], tier)
+                loader.signals.loaded.connect(self._lod_tile_loaded)
+                self._loader_pool.start(loader, 2)
+
+    def _lod_tile_loaded(self, key, index, thumbnails):
+        '''Private method called on the GUI thread when a tile loaded by
+        :meth:`update_level_of_detail` is ready.
+        '''
+        page_key, tier = key
+        self._lod_loading.discard((index, tier))
+        if page_key != self._shown_page or thumbnails[0] is None:
+            return
+        images, _ = self._page_cache[page_key]
+        self._set_tile(index, self._cache_tile(images[index], thumbnails[0]), tier)
 
     def pop_out_selected_well(self):
         '''Helper method to handle image selection and open an :class:`ImagePopDialog`
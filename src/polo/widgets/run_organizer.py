@@ -8,9 +8,14 @@ from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 from PyQt5.QtWidgets import QAction, QApplication, QGridLayout
 
-from polo import ICON_DICT, IMAGE_SPECS, SPEC_KEYS, make_default_logger
+from polo import (ICON_DICT, IMAGE_SPECS, MARCO_SPECTRUM_AWARE, SPEC_KEYS,
+                  make_default_logger)
 from polo.crystallography.run import HWIRun, Run
+from polo.marco.checkpoint import ClassificationJournal
+from polo.marco.run_marco import marco_model_version
 from polo.designer.UI_run_organizer import Ui_Form
+from polo.threads.classification_queue import (ClassificationJob,
+                                               ClassificationQueue)
 from polo.threads.thread import *
 from polo.utils.dialog_utils import make_message_box
 from polo.utils.io_utils import *
@@ -36,6 +41,7 @@ class RunOrganizer(QtWidgets.QWidget):
     opening_run = pyqtSignal(list)
     classify_run = pyqtSignal(list)
     ftp_download_status = pyqtSignal(bool)
+    images_classified = pyqtSignal(list)
 
     def __init__(self, parent=None, auto_link_runs=True):
 
@@ -49,12 +55,35 @@ class RunOrganizer(QtWidgets.QWidget):
         self._has_been_opened = set([])
         self._recent_files = []
         self._shown_unrecognized_run_warning = False
+        self._announce_queue_empty = False
+        self.classification_queue = ClassificationQueue(parent=self)
+        self.classification_queue.job_added.connect(
+            self._show_classification_job)
+        self.classification_queue.job_started.connect(
+            self._show_classification_job)
+        self.classification_queue.job_progress.connect(
+            self._show_classification_job)
+        self.classification_queue.job_finished.connect(
+            self._classification_job_finished)
+        self.classification_queue.images_classified.connect(
+            self.images_classified.emit)
+        self.classification_queue.queue_empty.connect(
+            self._classification_queue_empty)
         self.ui.pushButton.clicked.connect(self._handle_classification_request)
         self.ui.runTree.itemDoubleClicked.connect(self._handle_opening_run)
         self.ui.runTree.opening_run.connect(self._handle_opening_run)
         self.ui.runTree.remove_run_signal.connect(self._clear_current_run)
         self.ui.runTree.dropped_links_signal.connect(self._import_runs)
+        self.ui.runTree.sample_linked.connect(
+            lambda _: self._retry_deferred_classifications())
         self.ui.runTree.classify_sample_signal.connect(self._classify_multiple_runs)
+        self.ui.runTree.cancel_classification_signal.connect(
+            self._cancel_classification)
+        self.ui.runTree.classify_next_signal.connect(self._classify_next)
+        self.ui.runTree.pause_classification_signal.connect(
+            self._pause_classification)
+        self.ui.runTree.resume_classification_signal.connect(
+            self._resume_classification)
 
         logger.debug('Created {}'.format(self))
     
@@ -94,6 +123,18 @@ class RunOrganizer(QtWidgets.QWidget):
                 for f in self.recent_files:
                     recent_files.write(f + '\n')
 
+    def prioritize_classification(self, images):
+        '''Ask the running classification jobs to classify `images`
+        before the rest of their runs. Called with the images the user is
+        currently looking at so their MARCO classifications show up first.
+        The images are remembered so a classification started later also
+        starts with them.
+
+        :param images: Images currently shown to the user
+        :type images: list
+        '''
+        self.classification_queue.prioritize(images)
+
     def _clear_current_run(self, run_list):
         '''Clear out the current run from other widgets by emiting a
         :attr:`opening_run` signal with a list that does not contain
@@ -106,14 +147,22 @@ class RunOrganizer(QtWidgets.QWidget):
             self.opening_run.emit([None])
 
     def _handle_classification_request(self):
-        '''Private method to open a classification thread of the currently selected run.
-        Calls  :meth:`~polo.widgets.run_organizer.RunOrganizer._open_classification_thread` to
-        start the classification thread.
+        '''Private method to classify the currently selected run.
+        Calls  :meth:`~polo.widgets.run_organizer.RunOrganizer._queue_classification` to
+        add the run to the classification queue.
         '''
         selected_run = self.ui.runTree.selected_run
         if selected_run:
 
             classification_greenlight = True
+            force = False
+
+            if (MARCO_SPECTRUM_AWARE and isinstance(selected_run, HWIRun)
+                and selected_run.image_spectrum
+                and selected_run.image_spectrum != IMAGE_SPECS[0]):
+                # classifications come from the linked visible run instead
+                self._classify_alt_spectrum_run(selected_run)
+                return
 
             # check if run is an alternative spectrum, if true then warn the
             # user that MARCO has not been trained on this type of image
@@ -142,9 +191,10 @@ class RunOrganizer(QtWidgets.QWidget):
                             buttons=QtWidgets.QMessageBox.Ok
                         ).exec_()
                     classification_greenlight = False 
+                else:
+                    force = True
             if classification_greenlight:
-                self._open_classification_thread(selected_run)
-                self.classification_thread.start()
+                self._queue_classification(selected_run, force=force)
         else:
             logger.error('Failed to open classification thread for {}'.format(selected_run))
 
@@ -186,88 +236,215 @@ class RunOrganizer(QtWidgets.QWidget):
                             make_message_box(
                                 parent=self, message=message
                             ).exec_()
+                self._resume_from_checkpoint(selected_run)
             self.opening_run.emit([selected_run])
             self._has_been_opened.add(selected_run.run_name)
         else:
             logger.error('Could not open {}'.format(selected_run))
 
-    def _open_classification_thread(self, run):
-        '''Private method to create and run a classification thread which will run
-        the MARCO model on all images in the run passed to `run` argument.
-        Does not actually start the classification thread, just stores the
-        newly created classification thread in `classification_thread`
-        attribute.
+    def _resume_from_checkpoint(self, run):
+        '''Private method that picks up an interrupted classification of
+        `run`. Predictions saved in the run's
+        :class:`~polo.marco.checkpoint.ClassificationJournal` are restored
+        and, unless the user cancelled the classification, the rest of the
+        run is queued for classification.
+
+        :param run: Run being opened
+        :type run: Run or HWIRun
+        '''
+        journal = ClassificationJournal(run)
+        if not journal.exists or self.classification_queue.job_for(run):
+            return
+        restored = journal.restore(run, marco_model_version())
+        if restored:
+            self.images_classified.emit(restored)
+        if journal.cancelled:
+            logger.debug('Restored {} classifications of cancelled run {}'.format(
+                len(restored), run))
+        else:
+            logger.debug('Resuming classification of {} with {} images restored'.format(
+                run, len(restored)))
+            self._queue_classification(run)
+
+    def _queue_classification(self, run, force=False):
+        '''Private method to add `run` to the :attr:`classification_queue`.
+        The MARCO model is run on the images in the run that do not have a
+        current MARCO classification yet, as soon as there is room in the
+        queue's CPU budget.
 
         :param run: Run or HWIRun instance to run MARCO on
         :type run: Run or HWIRun
+        :param force: Reclassify every image in the run, defaults to False
+        :type force: bool, optional
+        :return: Classification job of the run
+        :rtype: ClassificationJob
         '''
-        logger.debug('Opening classification thread for {}'.format(run))
-        self.ui.pushButton.setEnabled(False)
-        self.ui.progressBar.setMaximum(len(run))
-        self.ui.progressBar.setValue(1)  # reset the bar to 0
-        self.classification_thread = ClassificationThread(run)
-        self.classification_thread.change_value.connect(
-            self._set_progress_value)
-        self.classification_thread.estimated_time.connect(
-            self._set_estimated_classification_time)
-
-        self.classification_thread.finished.connect(self._classification_cleanup)
-        self.ui.runTree.setEnabled(False)
-        self.ui.runTree.add_classified_run(run)
-
-        return self.classification_thread
-        # add return classification thread for easier access
-    
-    def _classification_cleanup(self):
-        '''"Cleanup" the UI after a classification thread has completed.
+        logger.debug('Queueing classification of {}'.format(run))
+        return self.classification_queue.add(run, force=force)
+
+    def _classify_alt_spectrum_run(self, run, notify=True):
+        '''Private method that classifies a non-visible spectrum run by
+        copying the classifications of the visible run of the same sample
+        imaged closest to it, see
+        :meth:`~polo.crystallography.run.HWIRun.propagate_marco_classifications`.
+        If that visible run has not been classified yet it is queued and
+        `run` is given its classifications once the visible run is done.
+        If there is no visible run yet `run` is deferred until one is
+        imported, see :meth:`_retry_deferred_classifications`.
+
+        :param run: Non-visible spectrum run to classify
+        :type run: HWIRun
+        :param notify: Tell the user if there is no visible run to copy
+                       classifications from, defaults to True
+        :type notify: bool, optional
         '''
-        self.ui.runTree.setEnabled(True)
-        logger.debug('Closed classification thread: {}'.format(
-            self.classification_thread
-        ))
-        if self.classification_thread.exceptions:
+        visible_runs = [
+            r for r in self.all_runs if r.image_spectrum == IMAGE_SPECS[0]
+            and getattr(r, 'sampleName', None) == getattr(run, 'sampleName', None)]
+        visible_run = run.nearest_visible_run(visible_runs)
+        if not visible_run:
+            self.classification_queue.defer(run)
+            self.ui.runTree.set_classification_status(
+                run, ClassificationJob.DEFERRED, False)
+            if notify:
+                make_message_box(
+                    parent=self,
+                    message='MARCO is only trained on visible light images. {} will be classified once a visible run of the same plate is imported.'.format(
+                        run.run_name)
+                ).exec_()
+        elif (visible_run.has_been_machine_classified
+              and not self.classification_queue.job_for(visible_run)):
+            classified_images = visible_run.propagate_marco_classifications()
+            if run.has_been_machine_classified:
+                self.ui.runTree.set_classification_status(
+                    run, ClassificationJob.FINISHED, False)
+                self.images_classified.emit(classified_images)
+                self.classification_queue.resolve_deferred()
+        else:
+            self._queue_classification(visible_run)
+            self.classification_queue.defer(run)
+            self.ui.runTree.set_classification_status(
+                run, ClassificationJob.DEFERRED, False)
+
+    def _retry_deferred_classifications(self):
+        '''Private method that tries again to classify the non-visible
+        spectrum runs in the :attr:`classification_queue`'s deferred jobs.
+        Called whenever a sample is linked since a deferred run may now have
+        a visible run to take classifications from.
+        '''
+        for job in list(self.classification_queue.deferred_jobs):
+            if not job.run.has_been_machine_classified:
+                self._classify_alt_spectrum_run(job.run, notify=False)
+        self.classification_queue.resolve_deferred()
+
+    def _show_classification_job(self, job):
+        '''Private method that shows the status of a classification job in
+        the runTree and the overall progress of the
+        :attr:`classification_queue` in the progress bar.
+
+        :param job: Job that changed
+        :type job: ClassificationJob
+        '''
+        self.ui.runTree.set_classification_status(
+            job.run, job.status, job.is_active, job.is_paused)
+        done, pending = self.classification_queue.progress
+        self._set_progress_maximum(pending)
+        self._set_progress_value(done)
+        seconds_remaining = self.classification_queue.seconds_remaining
+        if seconds_remaining is not None:
+            self._set_estimated_classification_time(
+                seconds_remaining, self.classification_queue.images_per_second)
+        if job.telemetry.get('stages'):
+            self._show_stage_timings(job.telemetry)
+
+    def _classification_job_finished(self, job):
+        '''Private method that updates the UI after a classification job
+        has finished, failed or been cancelled.
+
+        :param job: Job that left the queue
+        :type job: ClassificationJob
+        '''
+        self._show_classification_job(job)
+        logger.debug('Classification job finished: {}'.format(job))
+        if job.state == job.FINISHED:
+            self.ui.runTree.add_classified_run(job.run)
+            if isinstance(job.run, HWIRun):
+                # non-visible runs given the classifications of this run
+                for alt_run in job.run.get_linked_alt_runs():
+                    if (alt_run and alt_run.image_spectrum != IMAGE_SPECS[0]
+                        and alt_run.has_been_machine_classified):
+                        self.ui.runTree.set_classification_status(
+                            alt_run, job.FINISHED, False)
+        elif job.exceptions:
             make_message_box(
                 parent=self,
                 message='Polo encountered an error while classifying your images {}'.format(
-                    self.classification_thread.exceptions
+                    job.exceptions
                 )
             ).exec_()
 
-        self.ui.pushButton.setEnabled(True)
-    
+    def _classification_queue_empty(self):
+        '''Private method called when the last job of the
+        :attr:`classification_queue` is done.
+        '''
+        if self._announce_queue_empty:
+            self._announce_queue_empty = False
+            make_message_box(
+                parent=self,
+                message='Completed all classifications'
+            ).exec_()
+
+    def _cancel_classification(self, runs):
+        '''Private method that cancels classification of `runs`.
+
+        :param runs: Runs to stop classifying
+        :type runs: list
+        '''
+        for run in runs:
+            self.classification_queue.cancel(run)
+
+    def _pause_classification(self, runs):
+        '''Private method that pauses classification of `runs`.
+
+        :param runs: Runs to pause
+        :type runs: list
+        '''
+        for run in runs:
+            self.classification_queue.pause(run)
+
+    def _resume_classification(self, runs):
+        '''Private method that resumes paused classification of `runs`.
+
+        :param runs: Runs to resume
+        :type runs: list
+        '''
+        for run in runs:
+            self.classification_queue.resume(run)
+
+    def _classify_next(self, runs):
+        '''Private method that moves `runs` to the front of the
+        :attr:`classification_queue`.
+
+        :param runs: Runs to classify next
+        :type runs: list
+        '''
+        for run in reversed(runs):
+            self.classification_queue.move_to_front(run)
+
     def _classify_multiple_runs(self, runs):
-        '''Run the MARCO model on a list of runs. Recursively creates
-        :class:`ClassificationThreads` for each :class:`Run` until all
-        :class:`Run` instances have been classified.
+        '''Run the MARCO model on a list of runs. All runs are added to
+        the :attr:`classification_queue` which classifies as many of them at
+        once as its CPU budget allows. The user is told once all of them
+        are done.
 
         :param runs: List of :class:`Run` instance to classify using MARCO  
         :type runs: list
         '''
         if runs:
-            def recursive_classification_spawner():
-                try:
-                    if runs:
-                        current_run = runs.pop()
-                        self._open_classification_thread(current_run)
-                        self.classification_thread.finished.connect(
-                            recursive_classification_spawner)
-                        self.classification_thread.start()
-                    else:
-                        make_message_box(
-                            parent=self,
-                            message='Completed all classifications'
-                        ).exec_()
-                except Exception as e:
-                    self.ui.runTree.setEnabled(True)
-                    logger.error('Caught {} at {}'.format(
-                        e, self._classify_multiple_runs))
-                    make_message_box(
-                        parent=self,
-                        message='Classification failed {}'.format(e)
-                    ).exec_()
-        
-            recursive_classification_spawner()
-    
+            self._announce_queue_empty = True
+            for run in runs:
+                self._queue_classification(run)
+
     def refresh_run_after_update(self, run):
         if run:
             run = run.pop()
@@ -275,6 +452,18 @@ class RunOrganizer(QtWidgets.QWidget):
             self.ui.runTree.remove_run(display_name)
             self.ui.runTree.add_run_to_tree(run)
 
+    def _set_progress_maximum(self, val):
+        '''Private helper method to set the maximum of the classification
+        progress bar to the number of images that will actually be
+        classified. If there is nothing left to classify the bar is shown
+        as full.
+
+        :param val: Number of images pending classification
+        :type val: int
+        '''
+        self.ui.progressBar.setMaximum(max(val, 1))
+        self.ui.progressBar.setValue(0 if val else 1)
+
     def _set_progress_value(self, val):
         '''Private helper method to increment the classification
         progress bar.
@@ -284,23 +473,42 @@ class RunOrganizer(QtWidgets.QWidget):
         '''
         self.ui.progressBar.setValue(val)
 
-    def _set_estimated_classification_time(self, time, num_images_remain):
-        '''Display the estimated classification time to the user. Time remaining
-        is calculated by multiplying the time it took to classify a representative
-        image by the number of images that remain to be classified.
+    def _set_estimated_classification_time(self, time, images_per_second=None):
+        '''Display the estimated classification time to the user. The time
+        remaining comes from the moving average of the images classified per
+        second, see :class:`~polo.marco.pipeline.ThroughputMeter`.
 
-        :param time: Time to classify latest image
-        :type time: int
-        :param num_images_remain: Number of images that still require classification
-        :type num_images_remain: int
+        :param time: Estimated seconds until classification finishes
+        :type time: float
+        :param images_per_second: Current classification rate, defaults to None
+        :type images_per_second: float, optional
         '''
-        time = time*num_images_remain
         if time >= 60:
             time_string = '{} mins'.format(round(time/60, 2))
         else:
             time_string = '{} secs'.format(round(time))
+        if images_per_second:
+            time_string += ' ({} images / sec)'.format(round(images_per_second, 1))
         self.ui.label_32.setText(time_string)
 
+    def _show_stage_timings(self, telemetry):
+        '''Private method that shows the time spent in each stage of
+        classification as the tooltip of the estimated time label.
+
+        :param telemetry: Telemetry of a classification thread, see
+                          :meth:`~polo.threads.thread.ClassificationThread._telemetry`
+        :type telemetry: dict
+        '''
+        lines = ['{}: {} / {} images'.format(
+            telemetry['run'], telemetry['done'], telemetry['pending'])]
+        if telemetry.get('mean_images_per_second'):
+            lines.append('Mean rate: {} images / sec'.format(
+                telemetry['mean_images_per_second']))
+        for stage, timing in telemetry['stages'].items():
+            lines.append('{}: {} secs ({} secs / image)'.format(
+                stage, round(timing['total'], 2), timing['mean']))
+        self.ui.label_32.setToolTip('\n'.join(lines))
+
     def _add_runs_to_tree(self, runs):
         '''Private method to add a set of runs to the runTree.
 
@@ -52,9 +52,17 @@ class RunTree(QtWidgets.QTreeWidget):
     remove_run_signal = pyqtSignal(list)
     dropped_links_signal = pyqtSignal(list)
     classify_sample_signal = pyqtSignal(list)
+    cancel_classification_signal = pyqtSignal(list)
+    classify_next_signal = pyqtSignal(list)
+    pause_classification_signal = pyqtSignal(list)
+    resume_classification_signal = pyqtSignal(list)
+    sample_linked = pyqtSignal(str)
 
     def __init__(self, parent=None, auto_link=True):
         self.classified_status = {}
+        self.classifying = set()  # names of runs queued or being classified
+        self.paused = set()  # names of runs whose classification is paused
+        self.unlinked_samples = set()  # linking waits for classification
         self.loaded_runs = {}
         self.formated_name_to_name = {}
         self.samples = []
@@ -63,6 +71,8 @@ class RunTree(QtWidgets.QTreeWidget):
         self.setHorizontalScrollBarPolicy(QtCore.Qt.ScrollBarAlwaysOn)
         self.setAcceptDrops(True)
         self.setSortingEnabled(True)
+        self.setColumnCount(2)
+        self.headerItem().setText(1, 'MARCO')  # classification status column
         logger.debug('Created {}'.format(self))
 
     @property
@@ -105,7 +115,13 @@ class RunTree(QtWidgets.QTreeWidget):
         :type event: QEvent, optional
         '''
         current_selection = self.selected_run
-        if current_selection:
+        if current_selection and current_selection.run_name in self.classifying:
+            make_message_box(
+                parent=self,
+                message='Cancel classification of {} before editing it.'.format(
+                    current_selection.run_name)
+            ).exec_()
+        elif current_selection:
             updater = RunUpdaterDialog(
                 run=current_selection, run_names=self.current_run_names)
             updater.exec_()
@@ -188,6 +204,52 @@ class RunTree(QtWidgets.QTreeWidget):
             if child_node.text(0) == run_name:
                 return child_node
 
+    def _find_run_node(self, run):
+        '''Private helper method that returns the :class:`QTreeWidgetItem`
+        displaying `run` by searching all nodes for the run's display name.
+
+        :param run: Run to search for
+        :type run: Run or HWIRun
+        :return: Node of the run or None if it is not in the tree
+        :rtype: QTreeWidgetItem
+        '''
+        iterator = QtWidgets.QTreeWidgetItemIterator(self)
+        while iterator.value():
+            node = iterator.value()
+            if self.formated_name_to_name.get(node.text(0)) == run.run_name:
+                return node
+            iterator += 1
+
+    def set_classification_status(self, run, status, active=True, paused=False):
+        '''Show the MARCO classification status of `run` next to its name.
+
+        :param run: Run to set the status of
+        :type run: Run or HWIRun
+        :param status: Status to show, for example the number of images
+                       classified so far
+        :type status: str
+        :param active: True if the run is queued or being classified,
+                       defaults to True
+        :type active: bool, optional
+        :param paused: True if classification of the run is paused, defaults
+                       to False
+        :type paused: bool, optional
+        '''
+        if active:
+            self.classifying.add(run.run_name)
+        else:
+            self.classifying.discard(run.run_name)
+        if active and paused:
+            self.paused.add(run.run_name)
+        else:
+            self.paused.discard(run.run_name)
+        node = self._find_run_node(run)
+        if node:
+            node.setText(1, status)
+        sample_name = getattr(run, 'sampleName', None)
+        if not active and sample_name in self.unlinked_samples:
+            self.link_sample(sample_name)
+
     def _add_classifications_from_mso_slot(self, event=None):
         '''Add classifications to an existing :class:`Run` from the contents of an
         MSO file. Intended to be connected to the `classify_from_mso`
@@ -234,6 +296,8 @@ class RunTree(QtWidgets.QTreeWidget):
         '''
         try:
             condemned_run = self.loaded_runs[self.formated_name_to_name[display_name]]
+            if condemned_run.run_name in self.classifying:
+                self.cancel_classification_signal.emit([condemned_run])
             self.remove_run_from_view(display_name, condemned_run.sampleName)
             self.formated_name_to_name.pop(display_name)  # remove display name
             self.loaded_runs.pop(condemned_run.run_name)  # remove from loaded runs
@@ -336,8 +400,15 @@ class RunTree(QtWidgets.QTreeWidget):
 
     def link_sample(self, sample_name):
         '''Links all :class:`Run` instances in a given sample together by both date
-        and spectrum using the :meth:`~polo.utils.io_utils.RunLinker.the_big_link`
-        method.
+        and spectrum using the :meth:`~polo.utils.io_utils.RunLinker.update_sample`
+        method, which only links runs that were added to or removed from the
+        sample since it was last linked.
+
+        Classification threads write MARCO classifications into the runs
+        and copy them along the links between the runs of a sample, so
+        while any run of the sample is queued or being classified linking
+        waits until the last of them is done. Emits :const:`sample_linked`
+        once the sample has been linked.
 
         :param sample_name: Name of the sample who's runs should be linked
         :type sample_name: str
@@ -345,9 +416,15 @@ class RunTree(QtWidgets.QTreeWidget):
         # gather runs with this sample
         runs_in_sample = [run for run_name, run in self.loaded_runs.items()
                           if run.sampleName == sample_name]
-        linked_runs = RunLinker.the_big_link(runs_in_sample)
+        if any(run.run_name in self.classifying for run in runs_in_sample):
+            self.unlinked_samples.add(sample_name)
+            logger.debug('Linking {} after classification'.format(sample_name))
+            return
+        self.unlinked_samples.discard(sample_name)
+        linked_runs = RunLinker.update_sample(runs_in_sample)
         linked_runs_dict = {run.run_name: run for run in linked_runs}
         self.loaded_runs.update(linked_runs_dict)
+        self.sample_linked.emit(sample_name)
 
     def add_run_to_tree(self, new_run):
         '''Add a new :class:`Run` instance to the tree. Uses the :class:`Run` instance's 
@@ -440,6 +517,26 @@ class RunTree(QtWidgets.QTreeWidget):
             self.menu.addAction(remove_run_action)
             self.menu.addSeparator()
             self.menu.addAction(classify_from_mso)
+
+            if current_run.run_name in self.classifying:
+                classify_next_action = QtWidgets.QAction('Classify Next', self)
+                classify_next_action.triggered.connect(
+                    lambda: self.classify_next_signal.emit([current_run]))
+                if current_run.run_name in self.paused:
+                    pause_action = QtWidgets.QAction('Resume Classification', self)
+                    pause_action.triggered.connect(
+                        lambda: self.resume_classification_signal.emit([current_run]))
+                else:
+                    pause_action = QtWidgets.QAction('Pause Classification', self)
+                    pause_action.triggered.connect(
+                        lambda: self.pause_classification_signal.emit([current_run]))
+                cancel_action = QtWidgets.QAction('Cancel Classification', self)
+                cancel_action.triggered.connect(
+                    lambda: self.cancel_classification_signal.emit([current_run]))
+                self.menu.addSeparator()
+                self.menu.addAction(classify_next_action)
+                self.menu.addAction(pause_action)
+                self.menu.addAction(cancel_action)
             
             self.menu.popup(QtGui.QCursor.pos())
         else:
@@ -3,7 +3,7 @@ from polo.crystallography.run import Run, HWIRun
 from polo.utils.math_utils import *
 import os
 from PyQt5 import QtWidgets, QtCore, QtGui
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, pyqtSignal
 from PyQt5.QtWidgets import QGraphicsColorizeEffect, QGraphicsScene
 from PyQt5.QtGui import QBrush, QColor, QIcon, QPixmap, QColor, QBitmap, QPainter
 from polo.widgets.slideshow_viewer import PhotoViewer
@@ -28,6 +28,7 @@ class slideshowInspector(QtWidgets.QWidget):
     :type run: Run or HWIRun, optional
 
     '''
+    showing_images = pyqtSignal(list)
 
     def __init__(self, parent, run=None):
 
@@ -411,6 +412,7 @@ class slideshowInspector(QtWidgets.QWidget):
             self._set_time_resolved_functions()
             self._set_alt_spectrum_buttons()
             self._set_slide_number_label()
+            self.showing_images.emit([self.current_image])
         except Exception as e:
             logger.error('Caught {} at {}'.format(
                 e, self._display_current_image))
@@ -419,6 +421,18 @@ class slideshowInspector(QtWidgets.QWidget):
                 message='Failed to display current image {}'.format(e)
             ).exec_()
 
+    def refresh_classified_images(self, images):
+        '''Update the displayed image metadata if the current image is
+        one of `images`, which have just been classified by MARCO.
+
+        :param images: Newly classified images
+        :type images: list
+        '''
+        if self.current_image and id(self.current_image) in set(
+                id(image) for image in images):
+            self.ui.textBrowser_2.setText(
+                self.ui.slideshowViewer.get_cur_img_meta_str())
+
     def _submit_filters(self):
         '''Private method that passes the current user selected
         image filters to the slideshowViewer so the current
@@ -4,8 +4,10 @@ import math
 from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtGui import QFont
 
-from polo import IMAGE_CLASSIFICATIONS, BLANK_IMAGE, make_default_logger
+from polo import (IMAGE_CLASSIFICATIONS, BLANK_IMAGE, SLIDESHOW_PREFETCH_AHEAD,
+                  SLIDESHOW_PREFETCH_BEHIND, make_default_logger)
 from polo.crystallography.image import Image
+from polo.threads.thread import ImageLoader
 from polo.utils.dialog_utils import make_message_box
 from polo.crystallography.run import HWIRun, Run
 
@@ -96,6 +98,39 @@ class Carousel():
         else:
             self._current_slide = None
 
+    def neighbours(self, ahead=SLIDESHOW_PREFETCH_AHEAD,
+                   behind=SLIDESHOW_PREFETCH_BEHIND):
+        '''Images of the slides around the current slide, nearest first,
+        alternating between slides ahead and behind while both last. Each
+        image is only returned once even if the carousel is shorter than
+        `ahead` + `behind` slides.
+
+        :param ahead: Number of slides after the current slide, defaults to
+                      :const:`polo.SLIDESHOW_PREFETCH_AHEAD`
+        :type ahead: int, optional
+        :param behind: Number of slides before the current slide, defaults to
+                       :const:`polo.SLIDESHOW_PREFETCH_BEHIND`
+        :type behind: int, optional
+        :return: Images of the neighbouring slides
+        :rtype: list
+        '''
+        images = []
+        if self.current_slide:
+            seen = {id(self.current_slide)}
+            next_slide = prev_slide = self.current_slide
+            for i in range(max(ahead, behind)):
+                if i < ahead:
+                    next_slide = next_slide.next_slide
+                    if id(next_slide) not in seen:
+                        seen.add(id(next_slide))
+                        images.append(next_slide.image)
+                if i < behind:
+                    prev_slide = prev_slide.prev_slide
+                    if id(prev_slide) not in seen:
+                        seen.add(id(prev_slide))
+                        images.append(prev_slide.image)
+        return images
+
     def controls(self, next_slide=False, prev_slide=False):
         '''Controls the navigation through the slides
         in the carousel. Does not control access to alternative
@@ -109,7 +144,6 @@ class Carousel():
         :type prev_slide: bool
         '''
         if self.current_slide:
-            self.current_slide.image.delete_all_pixmap_data()
             if next_slide:
                 self.current_slide = self.current_slide.next_slide
             elif prev_slide:
@@ -225,6 +259,11 @@ class SlideshowViewer(PhotoViewer):
 
     def __init__(self, parent, run=None, current_image=None):
         super(SlideshowViewer, self).__init__(parent)
+        self._prefetch_pool = QtCore.QThreadPool(self)
+        self._prefetch_pool.setMaxThreadCount(2)
+        self._prefetch_window = {}  # images to keep decoded keyed by id
+        self._prefetching = set()  # ids of images being decoded
+        self._prefetched = {}  # images decoded by prefetch keyed by id
         self.run = run
         self.current_image = current_image
         self._carousel = Carousel()
@@ -257,6 +296,8 @@ class SlideshowViewer(PhotoViewer):
             self._carousel = Carousel()
             self.scene.clear()
             self.current_image = None
+        self._prefetch_pool.clear()
+        self._release_prefetched({})
     
     @property
     def current_slide_number(self):
@@ -320,10 +361,8 @@ class SlideshowViewer(PhotoViewer):
         :type image: Image
         '''
         if isinstance(image, Image):
-            if image.isNull():
-                image.setPixmap()
             self.scene.clear()
-            self.scene.addPixmap(image)
+            self.scene.addPixmap(image.setPixmap())
             self.fitInView()
             logger.debug('Displayed single image view')
         else:
@@ -437,9 +476,7 @@ class SlideshowViewer(PhotoViewer):
                     if isinstance(item, Image):
                         pass
             elif isinstance(item, Image):
-                if item.isNull():
-                    item.setPixmap()
-                scene_item = self.scene.addPixmap(item)
+                scene_item = self.scene.addPixmap(item.setPixmap())
                 scene_item.setToolTip(item.get_tool_tip())
                 scene_item.setPos(x, y)
                 if render_date and item.date:
@@ -460,12 +497,61 @@ class SlideshowViewer(PhotoViewer):
                 self._set_all_spectrums_scene(cur_img)
             else:
                 self._set_single_image_scene(cur_img)
+            self.prefetch()
         else:
             logger.warning('Attempted to display object of type {}'.format(
                 type(self.current_image)
             ))
 
 
+    def prefetch(self):
+        '''Decode the images the user is likely to look at next on a
+        background thread pool: the images of the neighbouring slides, see
+        :meth:`~polo.widgets.slideshow_viewer.Carousel.neighbours`, and the
+        images linked to the current image by date and spectrum. Nearer
+        slides are decoded first. Images this method decoded earlier that
+        are no longer in the window are unloaded so only a bounded number of
+        images is kept decoded.
+        '''
+        cur_img = self.current_image
+        if not isinstance(cur_img, Image):
+            return
+        linked = [cur_img.next_image, cur_img.previous_image, cur_img.alt_image]
+        images = [i for i in linked + self._carousel.neighbours()
+                  if isinstance(i, Image)]
+        self._prefetch_window = {id(image): image for image in images}
+        self._prefetch_window[id(cur_img)] = cur_img
+        self._release_prefetched(self._prefetch_window)
+        for priority, image in enumerate(reversed(images)):
+            if image.isNull() and id(image) not in self._prefetching:
+                self._prefetching.add(id(image))
+                loader = ImageLoader(image, 0, [image])
+                loader.signals.loaded.connect(self._image_prefetched)
+                self._prefetch_pool.start(loader, priority)
+
+    def _image_prefetched(self, image, _, loaded):
+        '''Private method called on the GUI thread when a prefetched image has
+        been decoded. The image is given its pixmap if it is still in the
+        prefetch window.
+        '''
+        self._prefetching.discard(id(image))
+        if loaded[0] is None or id(image) not in self._prefetch_window:
+            return
+        image.attach_pixmap(loaded[0].image)
+        self._prefetched[id(image)] = image
+
+    def _release_prefetched(self, keep):
+        '''Private method that unloads images decoded by :meth:`prefetch`
+        that are not in `keep` and are not the current image.
+
+        :param keep: Images to keep decoded keyed by id
+        :type keep: dict
+        '''
+        for key, image in list(self._prefetched.items()):
+            if key not in keep and image is not self.current_image:
+                image.delete_pixmap_data()
+                del self._prefetched[key]
+
     def get_cur_img_cocktail_str(self):
         '''Retruns the `current_image` cocktail information
         as a string.
@@ -110,9 +110,7 @@ class ImagePopDialog(QtWidgets.QDialog):
         '''
         if self.image:
             self.ui.photoViewer.scene.clear()
-            if self.image.isNull():
-                self.image.setPixmap()
-            self.ui.photoViewer.add_pixmap(self.image)
+            self.ui.photoViewer.add_pixmap(self.image.setPixmap())
             self.ui.photoViewer.fitInView()
             self._set_groupbox_title()
             self._set_cocktail_details()
@@ -8,7 +8,7 @@ from matplotlib.backends.backend_qt5agg import \
     NavigationToolbar2QT as NavigationToolbar
 from PyQt5 import QtWidgets
 from PyQt5.QtCore import Qt
-from PyQt5.QtGui import QIcon,QPixmapCache
+from PyQt5.QtGui import QIcon
 from PyQt5.QtWidgets import QAction, QApplication, QGridLayout
 
 from polo import *
@@ -37,6 +37,13 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         self.setupUi(self)
         self.current_run = None
         self.runOrganizer.opening_run.connect(self._handle_opening_run)
+        self.runOrganizer.images_classified.connect(
+            self._handle_images_classified)
+        # classify what the user is looking at first
+        self.plateInspector.ui.plateViewer.visible_images_changed.connect(
+            self.runOrganizer.prioritize_classification)
+        self.slideshowInspector.showing_images.connect(
+            self.runOrganizer.prioritize_classification)
 
         # menu connections 
         self.menuImport.triggered[QAction].connect(self._handle_image_import)
@@ -286,9 +293,10 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         and :meth:`~polo.windows.main_window.MainWindow._plot_limiter` to set 
         allowed functions for the user based on the type of run they open.
 
-        Additionally, if this is not the first run to be opened, before
-        the `new_run` is set as the :attr:`current_run` the pixmaps of the 
-        :attr:`current_run` are unloaded to free up memory.
+        Pixmaps of the previous :attr:`current_run` are left loaded so going
+        back to it is quick, the shared
+        :class:`~polo.utils.pixmap_cache.PixmapCache` releases them once
+        they are no longer recently used.
 
         :param q: List containing the run to be opened. Likely originating from
                   the :class:`RunOrganizer` widget.
@@ -297,15 +305,11 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         try:
             if isinstance(new_run, list) and len(new_run) > 0:
                 if self.current_run:
-                    self.current_run.unload_all_pixmaps()
-                    QPixmapCache.clear()
-                
                     for image in self.current_run.images:
                         if image.human_class:
                             self.runOrganizer.backup_classifications_on_thread(
                                 self.current_run)
                             break
-                    logger.debug('Image data cleared from previous run')
 
                 self.current_run = new_run.pop()
                 self._check_current_run_for_missing_images()
@@ -332,6 +336,18 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
                             ).exec_()
             # enable nav by time if has linked runs
     
+    def _handle_images_classified(self, images):
+        '''Private method that updates the views showing the
+        :attr:`current_run` when some of its images have been classified
+        by MARCO.
+
+        :param images: Newly classified images
+        :type images: list
+        '''
+        if self.current_run and images:
+            self.plateInspector.refresh_classified_images(images)
+            self.slideshowInspector.refresh_classified_images(images)
+
     # Menu handling methods
     # ======================================================================
 
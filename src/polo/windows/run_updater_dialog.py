@@ -156,6 +156,7 @@ class RunUpdaterDialog(QtWidgets.QDialog):
             for image in self.run.images:
                 image.date = new_date
             linked_runs = self.run.get_linked_date_runs()
+            self.run.dissolve_sample_indexes(*linked_runs)
             if len(linked_runs) > 1:
                 for run in linked_runs:
                     for image in run.images:
@@ -0,0 +1,9 @@
+import pytest
+from polo.classify import make_headless_application
+
+
+@pytest.fixture(scope='session')
+def qapp():
+    # keep a reference to the application for the whole session, Qt
+    # aborts if pixmaps are made after it has been garbage collected
+    return make_headless_application()
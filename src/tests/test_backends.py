@@ -0,0 +1,45 @@
+import pytest
+from polo import IMAGE_CLASSIFICATIONS
+from polo.marco.backends import (BACKENDS, MockPredictor, get_backend,
+                                 make_predictor, set_backend)
+from polo.marco.pipeline import PrefetchPipeline
+from polo.marco.run_marco import marco_model_version
+
+
+@pytest.fixture
+def images():
+    return [bytes([i]) * 100 for i in range(20)]
+
+
+@pytest.fixture
+def mock_backend():
+    backend = get_backend()
+    set_backend('mock')
+    yield
+    set_backend(backend)
+
+
+def test_mock_is_deterministic(images):
+    first = MockPredictor().predict_batch(images, batch_size=3)
+    second = MockPredictor().predict_batch(images, batch_size=7)
+    assert first == second
+    for machine_class, prediction_dict in first:
+        assert machine_class in IMAGE_CLASSIFICATIONS
+        assert sum(prediction_dict.values()) == pytest.approx(1)
+
+
+def test_mock_in_pipeline(images):
+    pipeline = PrefetchPipeline(MockPredictor(), batch_size=8)
+    results = [r for _, batch in pipeline.classify(images) for r in batch]
+    assert results == MockPredictor().predict_batch(images)
+
+
+def test_mock_model_version(mock_backend):
+    assert marco_model_version() == MockPredictor.model_version
+    assert isinstance(make_predictor(), MockPredictor)
+
+
+def test_unknown_backend():
+    assert 'tf1' in BACKENDS
+    with pytest.raises(ValueError):
+        set_backend('onnx')
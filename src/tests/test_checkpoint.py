@@ -0,0 +1,45 @@
+import pytest
+from polo import IMAGE_CLASSIFICATIONS
+from polo.crystallography.image import Image
+from polo.crystallography.run import Run
+from polo.marco.checkpoint import ClassificationJournal
+
+
+@pytest.fixture
+def run(qapp, tmp_path):
+    images = [Image(path=str(tmp_path.joinpath('well_{}.jpg'.format(i))))
+              for i in range(4)]
+    return Run(tmp_path, 'test_run', images=images)
+
+
+@pytest.fixture
+def prediction():
+    return IMAGE_CLASSIFICATIONS[0], dict(zip(IMAGE_CLASSIFICATIONS, [0.7, 0.1, 0.1, 0.1]))
+
+
+def test_record_and_restore(run, prediction, tmp_path):
+    journal = ClassificationJournal(run, tmp_path.joinpath('checkpoints'))
+    for image in run.images[:2]:
+        image.set_marco_classification(*prediction, 'test')
+    journal.record(run.images, 'test')
+    with open(str(journal.path), 'a') as journal_file:
+        journal_file.write('{"path": "cut off by a cra')
+
+    for image in run.images:
+        image.machine_class, image.prediction_dict = None, {}
+    restored = journal.restore(run, 'test')
+    assert restored == run.images[:2]
+    assert restored[0].machine_class == prediction[0]
+    assert not journal.cancelled
+    assert journal.restore(run, 'other') == []
+
+
+def test_cancel_and_clear(run, prediction, tmp_path):
+    journal = ClassificationJournal(run, tmp_path)
+    run.images[0].set_marco_classification(*prediction, 'test')
+    journal.record(run.images[:1], 'test')
+    journal.mark_cancelled()
+    journal.read()
+    assert journal.cancelled
+    journal.clear()
+    assert not journal.exists
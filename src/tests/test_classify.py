@@ -0,0 +1,45 @@
+import os
+
+import pytest
+
+from polo.classify import (OUTPUT_FORMATS, load_run, make_headless_application,
+                           make_parser, write_outputs)
+from polo.crystallography.run import HWIRun
+
+dirname = os.path.dirname(__file__)
+
+
+@pytest.fixture
+def app():
+    return make_headless_application()
+
+
+@pytest.fixture
+def image_dir():
+    return os.path.join(dirname, 'test_files/X000015804202004011136-jpg')
+
+
+def test_parser_defaults():
+    args = make_parser().parse_args(['plate_a.rar', 'plate_b'])
+    assert args.targets == ['plate_a.rar', 'plate_b']
+    assert args.formats == list(OUTPUT_FORMATS)
+    assert not args.force and not args.no_cache
+
+
+def test_load_run_from_dir(app, image_dir):
+    run = load_run(image_dir)
+    assert isinstance(run, HWIRun)
+    assert run.images
+
+
+def test_load_bad_target(app, tmp_path):
+    with pytest.raises(ValueError):
+        load_run(tmp_path.joinpath('not_a_run.txt'))
+
+
+def test_write_outputs(app, image_dir, tmp_path):
+    run = load_run(image_dir)
+    written = write_outputs(run, tmp_path, formats=['csv', 'xtal'])
+    assert len(written) == 2
+    for path in written:
+        assert os.path.isfile(path)
@@ -62,4 +62,14 @@ def test_make_base64(image_objects):
         
 
 
-    
\ No newline at end of file
+    
+
+def test_needs_classification(image_objects):
+    image = image_objects[0]
+    assert image.needs_classification('v1')
+    image.set_marco_classification(
+        'Clear', {c: 0 for c in IMAGE_CLASSIFICATIONS}, 'v1')
+    assert not image.needs_classification('v1')
+    assert image.needs_classification('v2')
+    image.marco_version = None  # classified before versions were recorded
+    assert not image.needs_classification('v2')
@@ -0,0 +1,31 @@
+import json
+
+import pytest
+from polo import IMAGE_CLASSIFICATIONS
+from polo.crystallography.image import Image
+from polo.crystallography.image_record import ImageRecord
+from polo.utils.io_utils import RunCsvWriter, RunDeserializer, XtalWriter
+
+
+@pytest.fixture
+def image():
+    return Image(path='missing.jpg', well_number=12, machine_class='Clear',
+                 prediction_dict={c: 0.25 for c in IMAGE_CLASSIFICATIONS},
+                 date='2020-04-01 11:36:00', spectrum='Visible')
+
+
+def test_records_are_slotted(image):
+    assert isinstance(image, ImageRecord)
+    assert not hasattr(image, '__dict__')
+    with pytest.raises(AttributeError):
+        image.not_an_attribute = 1
+
+
+def test_record_round_trip(image):
+    image.next_image = Image(path='next.jpg')
+    assert RunCsvWriter.image_to_row(image)['next_image'] == 'next.jpg'
+    image.next_image = None
+    d = json.loads(json.dumps(image, default=XtalWriter.json_encoder),
+                   object_hook=RunDeserializer.dict_to_obj)
+    assert isinstance(d, Image)
+    assert d.to_dict() == image.to_dict()
@@ -2,7 +2,10 @@
 import pytest
 from polo import *
 import logging
+import os
 import pathlib
+import subprocess
+import sys
 import tensorflow
 from polo.utils.io_utils import BarTender, Menu
 from polo.crystallography.cocktail import Cocktail
@@ -31,3 +34,12 @@ def test_bartender_creation():
             assert well_assignment > 0 and well_assignment <= 1537
             assert isinstance(cocktail, Cocktail)
 
+
+def test_lazy_model_loading():
+    # run from the src directory no matter where pytest was started
+    src_dir = pathlib.Path(__file__).resolve().parent.parent
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        filter(None, [str(src_dir), os.environ.get('PYTHONPATH')])))
+    check = 'import sys, polo; assert "tensorflow" not in sys.modules'
+    assert subprocess.call([sys.executable, '-c', check],
+                           cwd=str(src_dir), env=env) == 0
@@ -0,0 +1,52 @@
+import pytest
+from polo import (DEFAULT_IMAGE_PATH, IMAGE_CLASSIFICATIONS, LOADED_MODEL,
+                  SESS)
+from polo.marco.run_marco import (MarcoPredictor, get_predictor, load_image,
+                                  run_model, run_model_batch)
+
+
+@pytest.fixture
+def image_paths():
+    return [str(DEFAULT_IMAGE_PATH)] * 5
+
+
+def test_run_model_batch(image_paths):
+    for batch_size in (1, 2, 16):
+        results = run_model_batch(LOADED_MODEL, SESS, image_paths, batch_size)
+        assert len(results) == len(image_paths)
+        for machine_class, prediction_dict in results:
+            assert machine_class in IMAGE_CLASSIFICATIONS
+            assert isinstance(prediction_dict, dict)
+
+
+def test_batch_matches_single(image_paths):
+    single = run_model(LOADED_MODEL, SESS, image_paths[0])
+    batched = run_model_batch(
+        LOADED_MODEL, SESS, [load_image(p) for p in image_paths])
+    for machine_class, prediction_dict in batched:
+        assert machine_class == single[0]
+        for key, value in prediction_dict.items():
+            assert value == pytest.approx(single[1][key], abs=1e-4)
+
+
+def test_get_predictor_is_cached():
+    assert get_predictor() is get_predictor(LOADED_MODEL, SESS)
+    assert isinstance(get_predictor(), MarcoPredictor)
+
+
+def test_callable_matches_session_run(image_paths):
+    fast = MarcoPredictor(LOADED_MODEL, SESS, use_callable=True)
+    slow = MarcoPredictor(LOADED_MODEL, SESS, use_callable=False)
+    assert fast.has_callable and not slow.has_callable
+    for a, b in zip(fast.predict_batch(image_paths), slow.predict_batch(image_paths)):
+        assert a[0] == b[0]
+
+
+def test_classification_pool(image_paths):
+    from polo.marco.pool import ClassificationPool
+    expected = get_predictor().predict_batch(image_paths)
+    classified = [None] * len(image_paths)
+    with ClassificationPool(num_workers=2, chunk_size=2) as pool:
+        for start, results in pool.classify(image_paths):
+            classified[start:start+len(results)] = results
+    assert [c[0] for c in classified] == [e[0] for e in expected]
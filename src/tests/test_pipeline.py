@@ -0,0 +1,94 @@
+import inspect
+
+import pytest
+from polo import IMAGE_CLASSIFICATIONS, MARCO_PREFETCH_DEPTH
+from polo.marco.cache import content_key
+from polo.marco.pipeline import (PrefetchPipeline, PriorityBatchQueue,
+                                 StageTimer, ThroughputMeter)
+from polo.threads.thread import ClassificationThread
+
+
+class EchoPredictor():
+    '''Stands in for the MARCO model, scores each image by its first byte'''
+
+    def infer(self, image_bytes):
+        classes = [c.encode('utf-8') for c in IMAGE_CLASSIFICATIONS]
+        return {
+            'classes': [classes for _ in image_bytes],
+            'scores': [[1.0 if i == b[0] % 4 else 0.0 for i in range(4)]
+                       for b in image_bytes]
+        }
+
+
+@pytest.fixture
+def images():
+    return [bytes([i]) for i in range(50)]
+
+
+def test_pipeline_keeps_order(images):
+    pipeline = PrefetchPipeline(EchoPredictor(), batch_size=8, queue_depth=2)
+    classified = []
+    for start, results in pipeline.classify(images):
+        assert start == len(classified)
+        classified += results
+    assert len(classified) == len(images)
+    for b, (machine_class, _) in zip(images, classified):
+        assert machine_class == IMAGE_CLASSIFICATIONS[b[0] % 4]
+
+
+def test_pipeline_timings(images):
+    pipeline = PrefetchPipeline(EchoPredictor(), batch_size=8)
+    list(pipeline.classify(images))
+    summary = pipeline.timer.summary()
+    for stage in ('read', 'infer', 'post-process'):
+        assert summary[stage]['count'] == len(images)
+
+
+def test_stage_timer():
+    timer = StageTimer()
+    with timer.time('read', 2):
+        pass
+    timer.add('read', 1.0)
+    assert timer.summary()['read']['count'] == 3
+    assert timer.summary()['read']['total'] >= 1.0
+    other = StageTimer()
+    other.merge(timer.summary())
+    assert other.summary()['read']['count'] == 3
+
+
+def test_throughput_meter():
+    meter = ThroughputMeter(smoothing=0.5)
+    assert meter.seconds_remaining(10) is None
+    meter.update(10, 1.0)
+    meter.update(10, 0.5)
+    assert meter.rate == 15
+    assert meter.mean_rate == 20 / 1.5
+    assert meter.seconds_remaining(30) == 2
+
+
+def test_priority_queue():
+    queue = PriorityBatchQueue(range(10))
+    assert queue.prioritize([7, 3, 42]) == 2
+    assert queue.next_batch(3) == [7, 3, 0]
+    assert queue.prioritize([7]) == 0  # already handed out
+    assert len(queue) == 7
+
+
+def test_pipeline_classifies_queue(images):
+    queue = PriorityBatchQueue(images)
+    queue.prioritize(images[-4:])
+    pipeline = PrefetchPipeline(EchoPredictor(), batch_size=4, queue_depth=1)
+    batches = [items for items, _ in pipeline.classify_queue(queue)]
+    assert batches[0] == images[-4:]
+    assert sum(len(b) for b in batches) == len(images)
+
+
+def test_classification_thread_prefetch_depth():
+    params = inspect.signature(ClassificationThread.__init__).parameters
+    assert params['queue_depth'].default == MARCO_PREFETCH_DEPTH
+
+
+def test_pipeline_hashes_content(images):
+    pipeline = PrefetchPipeline(EchoPredictor(), batch_size=8)
+    for start, results, keys in pipeline.classify(images, hash_content=True):
+        assert keys == [content_key(i) for i in images[start:start+len(results)]]
@@ -0,0 +1,34 @@
+import pytest
+from PyQt5.QtGui import QPixmap
+from polo.crystallography.image import Image
+from polo.utils.pixmap_cache import PixmapCache, get_pixmap_cache, pixmap_bytes
+
+
+@pytest.fixture
+def pixmaps(qapp):
+    return [QPixmap(100, 100) for _ in range(4)]
+
+
+def test_lru_eviction(pixmaps):
+    cache = PixmapCache(max_bytes=pixmap_bytes(pixmaps[0]) * 3)
+    for i, pixmap in enumerate(pixmaps[:3]):
+        cache.add(i, pixmap)
+    assert cache.get(0) is pixmaps[0]  # 1 is now the least recently used
+    cache.add(3, pixmaps[3])
+    assert 1 not in cache and len(cache) == 3
+    assert cache.total_bytes <= cache.max_bytes
+    cache.clear()
+    assert len(cache) == 0 and cache.total_bytes == 0
+
+
+def test_evicted_images_are_unloaded(pixmaps):
+    cache = get_pixmap_cache()
+    cache.clear()
+    image = Image(path='missing.jpg')
+    assert image.isNull()
+    image.attach_pixmap(pixmaps[0])
+    assert not image.isNull() and image.width() == 100
+    cache.add('other', pixmaps[1])
+    cache.evict(max_bytes=0)
+    assert image.isNull() and image.pixmap().isNull()
+    assert not pixmaps[0].isNull()
@@ -0,0 +1,58 @@
+import pytest
+from polo import IMAGE_CLASSIFICATIONS
+from polo.marco.cache import (PredictionCache, content_key, file_content_key,
+                             file_source_key)
+
+
+@pytest.fixture
+def prediction():
+    return IMAGE_CLASSIFICATIONS[0], dict(zip(IMAGE_CLASSIFICATIONS, [0.7, 0.1, 0.1, 0.1]))
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return PredictionCache(tmp_path.joinpath('cache.sqlite'), max_entries=10,
+                           model_version='test')
+
+
+def test_put_get(cache, prediction):
+    key = content_key(b'image')
+    assert cache.get(key) is None
+    cache.put(key, *prediction)
+    assert cache.get(key) == prediction
+    assert key in cache
+
+
+def test_file_content_key(tmp_path):
+    image_path = tmp_path.joinpath('image.jpg')
+    image_path.write_bytes(b'image' * 100000)
+    assert file_content_key(image_path) == content_key(b'image' * 100000)
+
+
+def test_model_versions_are_separate(cache, prediction, tmp_path):
+    key = content_key(b'image')
+    cache.put(key, *prediction)
+    other = PredictionCache(cache.path, model_version='other')
+    assert other.get(key) is None
+
+
+def test_eviction_is_lru(cache, prediction):
+    keys = [content_key(bytes([i])) for i in range(10)]
+    cache.put_many((key,) + prediction for key in keys)
+    cache.get(keys[0])  # most recently used now
+    cache.put(content_key(b'new'), *prediction)
+    assert len(cache) == 10
+    assert keys[0] in cache
+    assert content_key(b'new') in cache
+
+
+def test_source_keys(cache, prediction, tmp_path):
+    image_path = tmp_path.joinpath('image.jpg')
+    image_path.write_bytes(b'image')
+    source = file_source_key(image_path)
+    assert cache.get_source_keys([source]) == {}
+    cache.put(content_key(b'image'), *prediction)
+    cache.put_source_keys([(source, content_key(b'image'))])
+    assert cache.get_source_keys([source]) == {source: content_key(b'image')}
+    image_path.write_bytes(b'changed image')
+    assert file_source_key(image_path) != source
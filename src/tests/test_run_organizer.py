@@ -75,9 +75,9 @@ def test_classification_thread_opening(all_xtal_files, run_org):
     all_runs = run_org.ui.runTree.all_runs  # should just be one
     
     for run_name, run in all_runs.items():
-        run_org.open_classification_thread(run)
-        assert hasattr(run_org, 'classification_thread')
-        assert run_org.classification_thread.isRunning()
+        job = run_org._queue_classification(run)
+        assert run_org.classification_queue.job_for(run) is job
+        assert job.thread.isRunning()
         break
     
     # let the classification progress for 10 seconds
@@ -88,8 +88,8 @@ def test_classification_thread_opening(all_xtal_files, run_org):
     # assert run_org.ui.progressBar.value() > start_progress_value
     # assert that the progress bar as incremeneted
     
-    if run_org.classification_thread.isRunning():
-        run_org.classification_thread.end()  # or stop need to find out the command
+    run_org.classification_queue.cancel(run)
+    run_org.classification_queue.wait()
     
     # test to make sure at least some of the images where classified
 
@@ -1,7 +1,8 @@
 import pytest
 from polo.crystallography.run import Run, HWIRun
 import os
-from polo.utils.io_utils import RunDeserializer
+from polo import IMAGE_SPECS
+from polo.utils.io_utils import RunCsvWriter, RunDeserializer, RunLinker
 
 dirname = os.path.dirname(__file__)
 
@@ -26,3 +27,82 @@ def test_make_run_from_dir(image_dir):
 
 
 
+@pytest.fixture
+def linked_runs():
+    xtal_dir = os.path.join(dirname, 'test_files/xtals')
+    runs = [RunDeserializer(os.path.join(xtal_dir, x)).xtal_to_run()
+            for x in sorted(os.listdir(xtal_dir))]
+    RunLinker.the_big_link(runs)
+    return runs
+
+
+def test_propagate_marco_classifications(linked_runs):
+    visible_runs = [r for r in linked_runs if r.image_spectrum == IMAGE_SPECS[0]]
+    alt_runs = [r for r in linked_runs if r.image_spectrum != IMAGE_SPECS[0]]
+    for alt_run in alt_runs:
+        assert alt_run.nearest_visible_run(visible_runs) in visible_runs
+        assert alt_run.propagate_marco_classifications() == []
+    for visible_run in visible_runs:
+        for image in visible_run.images:
+            if image:
+                image.set_marco_classification(
+                    'Crystals', {'Crystals': 1.0}, 'test')
+        visible_run.propagate_marco_classifications()
+    for alt_run in alt_runs:
+        assert alt_run.has_been_machine_classified
+        classified = [i for i in alt_run.images if i and i.machine_class]
+        assert classified
+        assert all(i.marco_version == 'test' for i in classified)
+
+
+def test_columns_match_image_queries(full_run):
+    images = [i for i in full_run.images if i]
+    images[0].human_class, images[1].favorite = 'Crystals', True
+    for args in ((['Crystals'], True, False, False), ([], False, False, True)):
+        assert full_run.image_filter_query(*args) == [
+            i for i in images if i.standard_filter(*args)]
+    assert images[0] in full_run.get_current_hits()
+    images[0].human_class = None  # changes are written through to the columns
+    assert images[0] not in full_run.get_current_hits()
+    full_run.images[0] = None  # changes to the images list rebuild them
+    assert not full_run.columns.present[0]
+
+
+def test_sample_index_links(linked_runs):
+    index = linked_runs[0].sample_index
+    assert index and all(run.sample_index is index for run in linked_runs)
+    first = index.date_runs[0]
+    image = first.images[0]
+    assert image.get_linked_images_by_date() == [r.images[0] for r in index.date_runs]
+    if len(index.date_runs) > 1:
+        assert image.next_image is index.date_runs[1].images[0]
+        assert image.next_image.previous_image is image
+    if index.spectrum_runs:
+        assert image.alt_image is index.spectrum_runs[0].images[0]
+        assert first.get_linked_alt_runs()[0] is index.spectrum_runs[0]
+    links = [(i.next_image, i.previous_image, i.alt_image) for i in first.images]
+    index.dissolve()  # links are kept when the index goes away
+    assert first.sample_index is None
+    assert [(i.next_image, i.previous_image, i.alt_image) for i in first.images] == links
+
+
+def test_csv_rows_of_indexed_runs(linked_runs):
+    first = linked_runs[0].sample_index.date_runs[0]
+    image = next(i for i in first.images if i and (i.next_image or i.alt_image))
+    row = RunCsvWriter.image_to_row(image)
+    for attr in ('next_image', 'previous_image', 'alt_image'):
+        linked_image = getattr(image, attr)
+        assert row[attr] == (linked_image.path if linked_image else 'None')
+
+
+def test_update_sample_matches_big_link(linked_runs):
+    def links(runs):
+        return [(r.next_run, r.previous_run, r.alt_spectrum) for r in runs]
+    expected = links(linked_runs)
+    new_run = linked_runs[-1]
+    RunLinker.the_big_link(linked_runs[:-1])
+    RunLinker.update_sample(linked_runs)  # only inserts new_run
+    assert new_run.sample_index is linked_runs[0].sample_index
+    assert links(linked_runs) == expected
+    RunLinker.update_sample(linked_runs[:-1])  # and removes it again
+    assert new_run.sample_index is None
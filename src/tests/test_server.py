@@ -0,0 +1,85 @@
+import http.client
+import threading
+import time
+
+import pytest
+from polo import MARCO_SERVER_MAX_REQUEST_BYTES
+from polo.marco.server import (MarcoServer, MicroBatcher, RemotePredictor,
+                               pack_images, parse_address, unpack_images)
+
+
+class FixedPredictor():
+    '''Predictor that scores images by their length and records the size of
+    every batch it is given.'''
+
+    def __init__(self):
+        self.batches = []
+
+    def infer(self, image_bytes):
+        self.batches.append(len(image_bytes))
+        return {
+            'classes': [[b'Clear', b'Crystals']] * len(image_bytes),
+            'scores': [[0.5, len(i) / 100] for i in image_bytes]
+        }
+
+
+@pytest.fixture(params=['unix', 'http'])
+def server(request, tmp_path):
+    if request.param == 'unix':
+        address = 'unix://{}'.format(tmp_path.joinpath('marco.sock'))
+    else:
+        address = 'http://127.0.0.1:0'  # any free port
+    server = MarcoServer(address, predictor=FixedPredictor(), max_batch=16,
+                         max_wait=0.05)
+    server.start()
+    yield server
+    server.shutdown()
+
+
+def test_pack_images():
+    images = [b'a', b'', b'image' * 100]
+    assert unpack_images(pack_images(images)) == images
+    with pytest.raises(ValueError):
+        unpack_images(pack_images(images)[:-1])
+
+
+def test_remote_predictions(server):
+    predictor = RemotePredictor(server.address)
+    assert predictor.health()['max_batch'] == 16
+    assert predictor.predict(b'x' * 90) == (
+        'Crystals', {'Clear': 0.5, 'Crystals': 0.9})
+    results = predictor.predict_batch([b'x' * 10, b'x' * 60], batch_size=1)
+    assert [r[0] for r in results] == ['Clear', 'Crystals']
+
+
+def test_large_requests_are_rejected(server):
+    if server.address.startswith('unix'):
+        pytest.skip('checked over http')
+    connection = http.client.HTTPConnection(*parse_address(server.address)[1])
+    connection.putrequest('POST', '/predict')
+    connection.putheader('Content-Length', str(MARCO_SERVER_MAX_REQUEST_BYTES + 1))
+    connection.endheaders()
+    assert connection.getresponse().status == 413
+    assert not server.predictor.batches
+
+
+def test_requests_are_micro_batched():
+    predictor = FixedPredictor()
+    # nothing is timed, the batch takes whatever was queued before starting
+    batcher = MicroBatcher(predictor, max_batch=16, max_wait=0)
+    results = {}
+
+    def classify(i):
+        results[i] = batcher.infer([b'x' * i] * 4)
+
+    threads = [threading.Thread(target=classify, args=(i,)) for i in range(5)]
+    for thread in threads:
+        thread.start()
+    while batcher.pending < len(threads):
+        time.sleep(0.001)
+    batcher.start()
+    for thread in threads:
+        thread.join()
+    batcher.stop()
+    assert all(len(r['scores']) == 4 for r in results.values())
+    assert sorted(predictor.batches) == [4, 16]
@@ -0,0 +1,14 @@
+from polo.crystallography.image import Image
+from polo.widgets.slideshow_viewer import Carousel
+
+
+def test_carousel_neighbours(qapp):
+    images = [Image(path='well_{}.jpg'.format(i)) for i in range(10)]
+    carousel = Carousel()
+    carousel.add_slides(list(images))
+    assert carousel.neighbours(ahead=3, behind=1) == [
+        images[1], images[9], images[2], images[3]]
+
+    small = Carousel()
+    small.add_slides(images[:3])
+    assert small.neighbours(ahead=4, behind=2) == [images[1], images[2]]
@@ -0,0 +1,55 @@
+import pytest
+from PyQt5.QtGui import QColor, QImage
+from polo.crystallography.image import Image
+from polo.utils.thumbnail_utils import (ThumbnailCache, image_size,
+                                        load_full_size, thumbnail_size_for)
+
+
+@pytest.fixture
+def image(qapp, tmp_path):
+    image_path = str(tmp_path.joinpath('well.jpg'))
+    source = QImage(400, 200, QImage.Format_RGB32)
+    source.fill(QColor(40, 133, 199))
+    assert source.save(image_path)
+    return Image(path=image_path)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ThumbnailCache(tmp_path.joinpath('thumbnails'), sizes=(64, 128))
+
+
+def test_thumbnail_size_for():
+    assert thumbnail_size_for(30, (64, 128)) == 64
+    assert thumbnail_size_for(100, (64, 128)) == 128
+    assert thumbnail_size_for(500, (64, 128)) is None
+
+
+def test_thumbnails_are_cached(cache, image):
+    thumbnail = cache.thumbnail(image, 128)
+    assert (thumbnail.image.width(), thumbnail.image.height()) == (128, 64)
+    assert (thumbnail.source_width, thumbnail.source_height) == (400, 200)
+    assert thumbnail.scale == 400 / 128
+    assert len(cache) == 2  # smaller tiers are made from the same decode
+
+    cached = cache.thumbnail(image, 64)
+    assert cached.image.width() == 64
+    assert len(cache) == 2
+    assert cache.thumbnails([image, None], 64)[1] is None
+    with pytest.raises(ValueError):
+        cache.thumbnail(image, 100)
+
+
+def test_eviction(cache, image):
+    cache.thumbnail(image, 128)
+    cache.max_bytes = cache.total_bytes - 1
+    assert cache.evict() == 1
+    assert len(cache) == 1
+    assert cache.total_bytes <= cache.max_bytes
+
+
+def test_full_size(image):
+    assert image_size(image) == (400, 200)
+    full_size = load_full_size(image)
+    assert full_size.size is None and full_size.scale == 1
+    assert load_full_size(Image(path='missing.jpg')) is None